@@ -6,18 +6,29 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                             QHBoxLayout, QLabel, QPushButton, QListWidget, 
                             QTextEdit, QProgressBar, QCheckBox, QFileDialog,
                             QMessageBox, QDialog, QTreeWidget, QTreeWidgetItem,
-                            QTimeEdit, QComboBox, QSpinBox, QDialogButtonBox, 
+                            QTimeEdit, QComboBox, QSpinBox, QDoubleSpinBox, QDialogButtonBox, 
                             QFormLayout, QGroupBox, QProgressDialog, QSystemTrayIcon, QMenu, QAction)
 from PyQt5.QtCore import Qt, QDateTime, QThread, pyqtSignal, QTime, QTimer
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import time
-import mimetypes
+import queue
 import shutil
 import ctypes
+from sync_index import HashCache, ContentIndex
+from folder_cache import FolderCache, FOLDER_MIME_TYPE
+from remote_index import RemoteIndex
+from folder_tree_cache import FolderTreeCache
+from drive_transport import build_drive_service, transport_stats
+from drive_retry import default_policy
+from file_watcher import FileWatcher
+from sync_progress import ProgressAggregator
+from sync_engine import SyncEngine
+from scanner import TreeScanner, DIRECTORY
+from sync_scheduler import SyncScheduler
+from bandwidth import BandwidthLimiter, load_bandwidth, BANDWIDTH_FILE, MB
+from file_packer import PACK_THRESHOLD
+from scan_rules import load_scan_rules
 
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
@@ -33,142 +44,189 @@ if sys.platform.startswith('win'):
         print(f"Error hiding console: {e}")
 
 class SyncWorker(QThread):
+    """Runs a SyncEngine on its own thread and reports through Qt signals"""
     progress = pyqtSignal(str, int)  # Message, percentage
     finished = pyqtSignal()
     error = pyqtSignal(str)
 
-    def __init__(self, drive_service, folder_path, parent_id=None):
+    def __init__(self, drive_service, folder_path, parent_id=None, **options):
         super().__init__()
-        if drive_service is None:
-            raise ValueError("Drive service cannot be None")
-        self.drive_service = drive_service
-        self.folder_path = folder_path
-        self.parent_id = parent_id
-        self.running = True
+        self.engine = SyncEngine(drive_service, folder_path, parent_id,
+                                 on_progress=self.progress.emit, on_error=self.error.emit,
+                                 on_finished=self.finished.emit, **options)
 
     def run(self):
         """Main sync process"""
-        try:
-            if not self.parent_id:
-                self.error.emit("No destination folder selected")
-                return
+        self.engine.run()
 
-            total_files = sum([len(files) for _, _, files in os.walk(self.folder_path)])
-            processed_files = 0
+    def stop(self):
+        """Stop the sync process"""
+        self.engine.stop()
 
-            for root, _, files in os.walk(self.folder_path):
-                if not self.running:
-                    break
+class RealtimeSyncWorker(QThread):
+    """Uploads files reported by the FileWatcher as soon as they settle"""
+    progress = pyqtSignal(str, int)
+    error = pyqtSignal(str)
+    folder_lost = pyqtSignal(str)  # Backup root removed or renamed while watched
 
-                # Create folder structure in Google Drive
-                relative_path = os.path.relpath(root, self.folder_path)
-                current_parent_id = self.create_folder_structure(relative_path)
+    def __init__(self, credentials, parent_id, bandwidth=None, pack_threshold=0):
+        super().__init__()
+        self.credentials = credentials
+        self.parent_id = parent_id
+        self.bandwidth = bandwidth
+        self.pack_threshold = pack_threshold
+        self.changes = queue.Queue()
+        self.folder_cache = FolderCache()
+        self.content_index = None
+        self.remote_index = None
+        self.current_worker = None
+        self.running = True
 
-                # Upload files
-                for file_name in files:
-                    if not self.running:
-                        break
+    def enqueue(self, changes):
+        """Queue (root, path) pairs, safe to call from any thread"""
+        self.changes.put(changes)
 
-                    file_path = os.path.join(root, file_name)
-                    relative_file_path = os.path.relpath(file_path, self.folder_path)
-                    
-                    try:
-                        self.upload_file(file_path, relative_file_path)
-                    except Exception as e:
-                        self.error.emit(f"Error uploading {file_path}: {str(e)}")
-                    
-                    processed_files += 1
-                    progress = int((processed_files / total_files) * 100)
-                    self.progress.emit(f"Processing: {relative_file_path}", progress)
+    def run(self):
+        """Upload queued changes until stopped"""
+        try:
+            drive_service = build_drive_service(self.credentials)
+            self.content_index = ContentIndex()
+            self.remote_index = RemoteIndex()
+            scheduler = SyncScheduler()
+        except Exception as e:
+            self.error.emit(f"Real-time sync error: {str(e)}")
+            return
 
-            self.finished.emit()
+        try:
+            self.process_changes(drive_service, scheduler)
+        finally:
+            scheduler.close()
 
-        except Exception as e:
-            self.error.emit(f"Sync error: {str(e)}")
+    def process_changes(self, drive_service, scheduler):
+        """Sync batches of queued changes until stopped"""
+        while self.running:
+            try:
+                changes = self.changes.get(timeout=0.5)
+            except queue.Empty:
+                continue
 
-    def create_folder_structure(self, relative_path):
-        """Create folder structure in Google Drive"""
-        if relative_path == '.':
-            return self.parent_id
+            # Merge everything that queued up while the last batch was uploading
+            batch = {}
+            while True:
+                for root, path in changes:
+                    batch.setdefault(root, set()).add(path)
+                try:
+                    changes = self.changes.get_nowait()
+                except queue.Empty:
+                    break
 
-        current_parent = self.parent_id
-        path_parts = relative_path.split(os.sep)
+            # One changes().list per batch keeps the mirror current
+            self.remote_index.invalidate()
+            for root, paths in batch.items():
+                if not self.running:
+                    break
+                try:
+                    # Read for every batch so edited rules apply without restarting
+                    scan_rules = load_scan_rules(root)
+                except Exception as e:
+                    self.error.emit(f"Scan rules of {root} are not usable, not syncing it: {str(e)}")
+                    continue
+                worker = SyncEngine(drive_service, root, self.parent_id,
+                                    folder_cache=self.folder_cache, credentials=self.credentials,
+                                    paths=sorted(paths), content_index=self.content_index,
+                                    remote_index=self.remote_index, scheduler=scheduler,
+                                    bandwidth=self.bandwidth, pack_threshold=self.pack_threshold,
+                                    scan_rules=scan_rules,
+                                    progress_aggregator=ProgressAggregator(bandwidth=self.bandwidth),
+                                    on_progress=self.progress.emit, on_error=self.error.emit)
+                self.current_worker = worker
+                worker.run()
+                self.current_worker = None
 
-        for folder_name in path_parts:
-            if not folder_name:
-                continue
+    def stop(self):
+        """Stop after the current file"""
+        self.running = False
+        worker = self.current_worker
+        if worker:
+            worker.stop()
 
-            # Check if folder exists
-            query = f"name='{folder_name}' and '{current_parent}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-            results = self.drive_service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name)'
-            ).execute()
+class FolderListWorker(QThread):
+    """Lists Google Drive folders page by page off the GUI thread
 
-            if results['files']:
-                current_parent = results['files'][0]['id']
-            else:
-                # Create new folder
-                folder_metadata = {
-                    'name': folder_name,
-                    'mimeType': 'application/vnd.google-apps.folder',
-                    'parents': [current_parent]
-                }
-                folder = self.drive_service.files().create(
-                    body=folder_metadata,
-                    fields='id'
-                ).execute()
-                current_parent = folder['id']
+    With a FolderTreeCache, listings that are still fresh are skipped
+    (listing_done arrives without any page) and complete listings are
+    written back to the cache.
+    """
+    page_loaded = pyqtSignal(int, str, object)  # Generation, parent ID, folders
+    listing_done = pyqtSignal(int, str)  # Generation, parent ID
+    error = pyqtSignal(int, str, str)  # Generation, parent ID, message
 
-        return current_parent
+    def __init__(self, credentials, retry_policy=None, tree_cache=None):
+        super().__init__()
+        self.credentials = credentials
+        self.retry_policy = retry_policy or default_policy
+        self.tree_cache = tree_cache
+        self.requests = queue.Queue()
+        self.generation = 0
+        self.running = True
 
-    def upload_file(self, file_path, relative_path):
-        """Upload a file to Google Drive"""
-        try:
-            file_size = os.path.getsize(file_path)
-            mime_type, _ = mimetypes.guess_type(file_path)
-            
-            if mime_type is None:
-                mime_type = 'application/octet-stream'
+    def request(self, generation, parent_id, force=False):
+        """Queue the sub-folders of parent_id, older generations are dropped"""
+        self.generation = max(self.generation, generation)
+        self.requests.put((generation, parent_id, force))
 
-            file_metadata = {
-                'name': os.path.basename(file_path),
-                'parents': [self.parent_id]
-            }
+    def run(self):
+        """List queued folders until stopped"""
+        drive_service = None
+        while self.running:
+            try:
+                generation, parent_id, force = self.requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if generation < self.generation:
+                continue
 
-            media = MediaFileUpload(
-                file_path,
-                mimetype=mime_type,
-                resumable=True,
-                chunksize=1024*1024
-            )
+            try:
+                if drive_service is None:
+                    drive_service = build_drive_service(self.credentials)
 
-            request = self.drive_service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id'
-            )
+                if self.tree_cache:
+                    try:
+                        self.tree_cache.validate(drive_service)
+                    except Exception as e:
+                        # Fall back to the TTL alone
+                        print(f"Could not check Drive for folder changes: {e}")
+                        self.tree_cache.validated = True
+                    if not force and self.tree_cache.is_fresh(parent_id):
+                        self.listing_done.emit(generation, parent_id)
+                        continue
 
-            response = None
-            retries = 3
-            while response is None and retries > 0:
-                try:
-                    status, response = request.next_chunk()
-                    if status:
-                        self.progress.emit(f"Uploading: {relative_path}", int(status.progress() * 100))
-                except Exception as chunk_error:
-                    print(f"Chunk Error (retrying): {chunk_error}")
-                    retries -= 1
-                    time.sleep(1)
-                    if retries == 0:
-                        raise
+                folders = []
+                page_token = None
+                while self.running and generation == self.generation:
+                    results = self.retry_policy.execute(drive_service.files().list(
+                        q=f"'{parent_id}' in parents and mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
+                        spaces='drive',
+                        fields='nextPageToken, files(id, name)',
+                        orderBy='name',
+                        pageSize=1000,
+                        pageToken=page_token
+                    ), is_running=lambda: self.running)
+                    page = results.get('files', [])
+                    folders.extend(page)
+                    self.page_loaded.emit(generation, parent_id, page)
+                    page_token = results.get('nextPageToken')
+                    if not page_token:
+                        if self.tree_cache:
+                            self.tree_cache.store(parent_id, folders)
+                        break
+                self.listing_done.emit(generation, parent_id)
 
-        except Exception as e:
-            raise Exception(f"Error uploading {file_path}: {str(e)}")
+            except Exception as e:
+                self.error.emit(generation, parent_id, str(e))
 
     def stop(self):
-        """Stop the sync process"""
+        """Stop listing, pages already requested are abandoned"""
         self.running = False
 
 class ScheduleDialog(QDialog):
@@ -319,6 +377,15 @@ class DriveBackupGUI(QMainWindow):
         self.progress_bar = QProgressBar()
         self.progress_label = QLabel("")
         self.auto_backup_checkbox = QCheckBox("Enable Real-time Sync")
+        self.pack_checkbox = QCheckBox("Pack Small Files")
+        self.pack_checkbox.setToolTip(f"Upload files under {PACK_THRESHOLD // 1024} KB in one archive per folder")
+        self.bandwidth_spin = QDoubleSpinBox()
+        self.bandwidth_spin.setRange(0, 1000)
+        self.bandwidth_spin.setDecimals(1)
+        self.bandwidth_spin.setSingleStep(0.5)
+        self.bandwidth_spin.setSuffix(" MB/s")
+        self.bandwidth_spin.setSpecialValueText("Schedule")
+        self.bandwidth_spin.setToolTip(f"Upload limit, 'Schedule' follows the profiles in {BANDWIDTH_FILE}")
         
         # Disable buttons initially
         self.add_folder_btn.setEnabled(False)
@@ -341,6 +408,11 @@ class DriveBackupGUI(QMainWindow):
         left_layout.addWidget(self.progress_bar)
         left_layout.addWidget(self.progress_label)
         left_layout.addWidget(self.auto_backup_checkbox)
+        left_layout.addWidget(self.pack_checkbox)
+        bandwidth_layout = QHBoxLayout()
+        bandwidth_layout.addWidget(QLabel("Upload limit:"))
+        bandwidth_layout.addWidget(self.bandwidth_spin)
+        left_layout.addLayout(bandwidth_layout)
         
         # Add stretch to push everything up
         left_layout.addStretch()
@@ -407,6 +479,18 @@ class DriveBackupGUI(QMainWindow):
         self.credentials = None
         self.drive_service = None
         self.google_drive_destination = None
+
+        # Upload limit shared by every sync, changes apply to uploads already running
+        try:
+            self.bandwidth = load_bandwidth()
+        except Exception as e:
+            self.bandwidth = BandwidthLimiter()
+            self.log_error(f"Error loading {BANDWIDTH_FILE}: {str(e)}")
+        self.bandwidth_spin.valueChanged.connect(self.set_bandwidth_limit)
+
+        # Real-time sync, created when the checkbox is ticked
+        self.file_watcher = None
+        self.realtime_worker = None
         
         # Load credentials if they exist
         self.load_credentials()
@@ -417,6 +501,7 @@ class DriveBackupGUI(QMainWindow):
         
         # Initialize sync workers list
         self.sync_workers = []
+        self.sync_scheduler = None
         
         # Add stop sync button
         self.stop_sync_btn = QPushButton("Stop Sync")
@@ -459,7 +544,7 @@ class DriveBackupGUI(QMainWindow):
         self.sync_btn.clicked.connect(self.sync_now)
         self.browse_drive_btn.clicked.connect(self.browse_google_drive)
         self.schedule_btn.clicked.connect(self.show_schedule_dialog)
-        self.auto_backup_checkbox.stateChanged.connect(self.placeholder)
+        self.auto_backup_checkbox.stateChanged.connect(self.toggle_realtime_sync)
 
     def load_credentials(self):
         """Load saved credentials if they exist"""
@@ -469,7 +554,7 @@ class DriveBackupGUI(QMainWindow):
                     self.credentials = pickle.load(token)
 
             if self.credentials and self.credentials.valid:
-                self.drive_service = build('drive', 'v3', credentials=self.credentials)
+                self.drive_service = build_drive_service(self.credentials)
                 self.status_label.setText("Status: Logged in")
                 self.login_btn.setText("Switch Google Account")
                 self.enable_buttons()
@@ -477,7 +562,7 @@ class DriveBackupGUI(QMainWindow):
                 self.credentials.refresh(Request())
                 with open('token.pickle', 'wb') as token:
                     pickle.dump(self.credentials, token)
-                self.drive_service = build('drive', 'v3', credentials=self.credentials)
+                self.drive_service = build_drive_service(self.credentials)
                 self.status_label.setText("Status: Logged in")
                 self.login_btn.setText("Switch Google Account")
                 self.enable_buttons()
@@ -495,7 +580,8 @@ class DriveBackupGUI(QMainWindow):
             with open('token.pickle', 'wb') as token:
                 pickle.dump(self.credentials, token)
             
-            self.drive_service = build('drive', 'v3', credentials=self.credentials)
+            self.drive_service = build_drive_service(self.credentials)
+            self.reset_folder_tree_cache()
             self.status_label.setText("Status: Logged in")
             self.login_btn.setText("Switch Google Account")
             self.enable_buttons()
@@ -503,6 +589,19 @@ class DriveBackupGUI(QMainWindow):
         except Exception as e:
             self.log_error(f"Authentication error: {str(e)}")
 
+    def reset_folder_tree_cache(self):
+        """Forget the folder tree of the browse dialog if another account logged in"""
+        try:
+            about = default_policy.execute(self.drive_service.about().get(fields='user(emailAddress)'))
+            account = about['user']['emailAddress']
+        except Exception as e:
+            self.log_error(f"Could not identify the Google account, clearing the folder cache: {str(e)}")
+            account = None
+        try:
+            FolderTreeCache().set_account(account)
+        except Exception as e:
+            self.log_error(f"Error clearing the folder cache: {str(e)}")
+
     def enable_buttons(self):
         """Enable buttons after successful login"""
         self.add_folder_btn.setEnabled(True)
@@ -527,6 +626,8 @@ class DriveBackupGUI(QMainWindow):
                 if folder not in items:
                     self.folder_list.addItem(folder)
                     self.remove_folder_btn.setEnabled(True)
+                    if self.file_watcher:
+                        self.file_watcher.start_watching(folder)
                     
         except Exception as e:
             self.log_error(f"Error adding folder: {str(e)}")
@@ -536,6 +637,8 @@ class DriveBackupGUI(QMainWindow):
         try:
             current_item = self.folder_list.currentItem()
             if current_item:
+                if self.file_watcher:
+                    self.file_watcher.stop_watching(current_item.text())
                 self.folder_list.takeItem(self.folder_list.row(current_item))
                 
             if self.folder_list.count() == 0:
@@ -611,61 +714,176 @@ class DriveBackupGUI(QMainWindow):
 
             layout.addLayout(button_layout)
 
-            def load_folders(parent_item=None, parent_id='root'):
-                try:
-                    query = f"mimeType='application/vnd.google-apps.folder' and trashed=false"
-                    if parent_id != 'root':
-                        query += f" and '{parent_id}' in parents"
-                    
-                    results = self.drive_service.files().list(
-                        q=query,
-                        spaces='drive',
-                        fields='files(id, name, parents)',
-                        orderBy='name'
-                    ).execute()
-
-                    folders = results.get('files', [])
-                    
-                    for folder in folders:
-                        if parent_item is None:
-                            item = QTreeWidgetItem(tree)
-                        else:
-                            item = QTreeWidgetItem(parent_item)
-                            
+            # Folders are drawn from the on-disk cache at once and listed again on a
+            # background thread where Drive reports changes or the cache expired
+            tree_cache = FolderTreeCache()
+            cached = tree_cache.load()
+            lister = FolderListWorker(self.credentials, tree_cache=tree_cache)
+            items = {}  # Folder ID -> tree item
+            loading = {}  # Parent ID -> "Loading..." placeholder while it is listed
+            shown = set()  # Parent IDs whose sub-folders are in the tree
+            seen = {}  # Parent ID -> folder IDs received while it is being listed
+            generation = [0]
+
+            def add_placeholder(parent_item=None):
+                placeholder = QTreeWidgetItem(parent_item) if parent_item else QTreeWidgetItem(tree)
+                placeholder.setText(0, "Loading...")
+                return placeholder
+
+            def detach(item):
+                parent_item = item.parent()
+                if parent_item:
+                    parent_item.removeChild(item)
+                else:
+                    tree.takeTopLevelItem(tree.indexOfTopLevelItem(item))
+
+            def remove_placeholder(parent_id):
+                placeholder = loading.pop(parent_id, None)
+                if placeholder is not None:
+                    detach(placeholder)
+
+            def parent_of(item):
+                parent_item = item.parent()
+                return parent_item.data(0, Qt.UserRole) if parent_item else 'root'
+
+            def child_items(parent_id):
+                parent_item = items.get(parent_id)
+                if parent_item:
+                    return [parent_item.child(i) for i in range(parent_item.childCount())]
+                return [tree.topLevelItem(i) for i in range(tree.topLevelItemCount())]
+
+            def insert_item(parent_id, item):
+                """Insert item among its siblings in name order"""
+                parent_item = items.get(parent_id)
+                siblings = child_items(parent_id)
+                key = item.text(0).lower()
+                index = len(siblings)
+                # Listings arrive in name order, so this rarely moves
+                while index > 0 and siblings[index - 1].text(0).lower() > key:
+                    index -= 1
+                if parent_item:
+                    parent_item.insertChild(index, item)
+                else:
+                    tree.insertTopLevelItem(index, item)
+
+            def remove_item(item):
+                """Drop item and everything below it from the tree"""
+                pending = [item]
+                while pending:
+                    current = pending.pop()
+                    folder_id = current.data(0, Qt.UserRole)
+                    if folder_id:
+                        items.pop(folder_id, None)
+                        shown.discard(folder_id)
+                        loading.pop(folder_id, None)
+                    pending.extend(current.child(i) for i in range(current.childCount()))
+                detach(item)
+
+            def show_folders(parent_id, folders):
+                """Merge folders into the children of parent_id, touching only what changed"""
+                for folder in folders:
+                    item = items.get(folder['id'])
+                    if item is None:
+                        item = QTreeWidgetItem()
                         item.setText(0, folder['name'])
                         item.setData(0, Qt.UserRole, folder['id'])
-                        
-                        # Add loading indicator
-                        loading = QTreeWidgetItem(item)
-                        loading.setText(0, "Loading...")
-                        
-                except Exception as e:
-                    self.log_error(f"Error loading folders: {str(e)}")
+                        items[folder['id']] = item
+                        insert_item(parent_id, item)
+
+                        # Shows the expand arrow until the folder is listed
+                        add_placeholder(item)
+                        continue
+
+                    if item.text(0) != folder['name']:
+                        item.setText(0, folder['name'])
+                    if parent_of(item) != parent_id:
+                        # Moved here from another folder, its sub-tree comes along
+                        detach(item)
+                        insert_item(parent_id, item)
+
+            def load_folders(parent_id='root', placeholder=None):
+                shown.add(parent_id)
+                if parent_id in cached:
+                    # Drawn right away, the worker checks it against Drive
+                    if placeholder is not None:
+                        detach(placeholder)
+                    show_folders(parent_id, cached.pop(parent_id))
+                else:
+                    loading[parent_id] = placeholder or add_placeholder()
+                lister.request(generation[0], parent_id)
+
+            def is_current(request_generation, parent_id):
+                # Results for folders removed from the tree meanwhile are dropped
+                return (request_generation == generation[0]
+                        and (parent_id == 'root' or parent_id in items))
+
+            def add_folders(request_generation, parent_id, folders):
+                """Merge one page of a listing into the tree"""
+                if not is_current(request_generation, parent_id):
+                    return
+                remove_placeholder(parent_id)
+                seen.setdefault(parent_id, set()).update(folder['id'] for folder in folders)
+                show_folders(parent_id, folders)
+
+            def listing_done(request_generation, parent_id):
+                if not is_current(request_generation, parent_id):
+                    return
+                # Nothing was found or the cache was fresh, drop the placeholder
+                remove_placeholder(parent_id)
+                listed = seen.pop(parent_id, None)
+                if listed is None:
+                    return
+                # Folders missing from a complete listing were deleted or moved away
+                for item in child_items(parent_id):
+                    if item.data(0, Qt.UserRole) not in listed:
+                        remove_item(item)
+
+            def listing_failed(request_generation, parent_id, message):
+                self.log_error(f"Error loading folders: {message}")
+                seen.pop(parent_id, None)
+                placeholder = loading.pop(parent_id, None)
+                if placeholder and request_generation == generation[0]:
+                    placeholder.setText(0, "Error loading folders")
 
             def expand_item(item):
                 """Load subfolders when parent is expanded"""
-                loading_item = item.child(0)
-                if loading_item and loading_item.text(0) == "Loading...":
-                    folder_id = item.data(0, Qt.UserRole)
-                    item.takeChild(0)  # Remove loading indicator
-                    load_folders(item, folder_id)
+                folder_id = item.data(0, Qt.UserRole)
+                if folder_id and folder_id not in shown:
+                    load_folders(folder_id, item.child(0))
+
+            def refresh():
+                """List every folder in the tree again, keeping what did not change"""
+                generation[0] += 1
+                seen.clear()
+                for parent_id in sorted(shown, key=lambda parent_id: parent_id != 'root'):
+                    lister.request(generation[0], parent_id, force=True)
 
             # Connect signals
+            lister.page_loaded.connect(add_folders)
+            lister.listing_done.connect(listing_done)
+            lister.error.connect(listing_failed)
             tree.itemExpanded.connect(expand_item)
-            refresh_btn.clicked.connect(lambda: (tree.clear(), load_folders()))
+            refresh_btn.clicked.connect(refresh)
             select_btn.clicked.connect(dialog.accept)
             cancel_btn.clicked.connect(dialog.reject)
 
             # Initial load of root folders
+            lister.start()
             load_folders()
 
-            if dialog.exec_() == QDialog.Accepted:
+            accepted = dialog.exec_() == QDialog.Accepted
+            lister.stop()
+            lister.wait()
+
+            if accepted:
                 selected = tree.currentItem()
-                if selected:
+                if selected and selected.data(0, Qt.UserRole):
                     folder_id = selected.data(0, Qt.UserRole)
                     folder_name = selected.text(0)
                     self.google_drive_destination = folder_id
                     self.destination_label.setText(f"Google Drive Destination: {folder_name}")
+                    if self.realtime_worker:
+                        self.realtime_worker.parent_id = folder_id
                     return folder_id
 
             return None
@@ -695,23 +913,65 @@ class DriveBackupGUI(QMainWindow):
             self.remove_folder_btn.setEnabled(False)
             self.browse_drive_btn.setEnabled(False)
             
+            # One folder cache and one progress stream for the whole run, shared by every root
+            folder_cache = FolderCache()
+            aggregator = ProgressAggregator(bandwidth=self.bandwidth)
+            # Duplicates across roots are hashed once and copied instead of uploaded
+            hash_cache = HashCache()
+            content_index = ContentIndex()
+            # Remote state is refreshed once for all roots
+            remote_index = RemoteIndex()
+            # Uploads of every root share one queue and one set of upload threads
+            self.close_scheduler()
+            self.sync_scheduler = SyncScheduler()
+
             # Start sync for each folder
             for i in range(self.folder_list.count()):
                 folder_path = self.folder_list.item(i).text()
+                try:
+                    scan_rules = load_scan_rules(folder_path)
+                except Exception as e:
+                    self.log_error(f"Scan rules of {folder_path} are not usable, not syncing it: {str(e)}")
+                    continue
                 
                 # Create and start worker thread
-                worker = SyncWorker(self.drive_service, folder_path, self.google_drive_destination)
+                worker = SyncWorker(self.drive_service, folder_path, self.google_drive_destination,
+                                    folder_cache=folder_cache, credentials=self.credentials,
+                                    progress_aggregator=aggregator, hash_cache=hash_cache,
+                                    content_index=content_index, remote_index=remote_index,
+                                    scheduler=self.sync_scheduler, bandwidth=self.bandwidth,
+                                    pack_threshold=self.pack_threshold(), scan_rules=scan_rules)
                 worker.progress.connect(self.update_progress)
                 worker.error.connect(self.log_error)
+                if scan_rules:
+                    worker.finished.connect(
+                        lambda folder=folder_path, rules=scan_rules: self.log_scan_rules(folder, rules))
                 worker.finished.connect(self.sync_finished)
                 
                 self.sync_workers.append(worker)
                 worker.start()
+
+            if not self.sync_workers:
+                self.close_scheduler()
+                self.enable_buttons()
                 
         except Exception as e:
             self.log_error(f"Error starting sync: {str(e)}")
             self.enable_buttons()
 
+    def pack_threshold(self):
+        """Size below which files are packed, 0 when packing is off"""
+        return PACK_THRESHOLD if self.pack_checkbox.isChecked() else 0
+
+    def log_scan_rules(self, folder, scan_rules):
+        """Log what the scan rules of a folder kept out of the backup"""
+        for line in scan_rules.summary():
+            self.log_error(f"{folder}: {line}")
+
+    def set_bandwidth_limit(self, value):
+        """Apply the upload limit from the spin box, 0 follows the bandwidth profiles"""
+        self.bandwidth.set_override(int(value * MB) if value else None)
+
     def update_progress(self, message, value):
         """Update progress bar and label"""
         self.progress_label.setText(message)
@@ -725,9 +985,15 @@ class DriveBackupGUI(QMainWindow):
             
             # If all workers are done
             if not self.sync_workers:
+                self.close_scheduler()
                 self.progress_label.setText("Sync completed!")
                 self.progress_bar.setValue(100)
                 self.enable_buttons()
+
+                stats = transport_stats()
+                if stats['requests']:
+                    self.log_error(f"Drive connections: {stats['connections']} opened for "
+                                   f"{stats['requests']} requests, {stats['reused']} reused")
                 
                 # Enable delete button if there are completed files
                 if self.completed_files:
@@ -737,6 +1003,12 @@ class DriveBackupGUI(QMainWindow):
             self.log_error(f"Error in sync completion: {str(e)}")
             self.enable_buttons()
 
+    def close_scheduler(self):
+        """Stop the upload threads of the last sync"""
+        if self.sync_scheduler:
+            self.sync_scheduler.close()
+            self.sync_scheduler = None
+
     def stop_sync(self):
         """Stop all running sync operations"""
         try:
@@ -744,6 +1016,7 @@ class DriveBackupGUI(QMainWindow):
                 worker.stop()
                 worker.wait()
             self.sync_workers.clear()
+            self.close_scheduler()
             self.progress_label.setText("Sync stopped")
             self.enable_buttons()
             
@@ -761,6 +1034,55 @@ class DriveBackupGUI(QMainWindow):
         """Temporary placeholder for button clicks"""
         self.error_log.append("This functionality is not yet implemented.")
 
+    def toggle_realtime_sync(self, state):
+        """Start or stop watching the backup folders for changes"""
+        if state != Qt.Checked:
+            self.stop_realtime_sync()
+            return
+
+        if not self.drive_service or not self.google_drive_destination:
+            self.log_error("Please login and select a destination folder before enabling real-time sync")
+            self.auto_backup_checkbox.setChecked(False)
+            return
+
+        try:
+            self.realtime_worker = RealtimeSyncWorker(self.credentials, self.google_drive_destination,
+                                                      self.bandwidth, self.pack_threshold())
+            self.realtime_worker.progress.connect(self.update_progress)
+            self.realtime_worker.error.connect(self.log_error)
+            self.realtime_worker.folder_lost.connect(self.realtime_folder_lost)
+            self.realtime_worker.start()
+
+            self.file_watcher = FileWatcher(self.realtime_worker.enqueue,
+                                            on_error=self.realtime_worker.error.emit,
+                                            on_root_lost=self.realtime_worker.folder_lost.emit)
+            for i in range(self.folder_list.count()):
+                self.file_watcher.start_watching(self.folder_list.item(i).text())
+            self.log_error("Real-time sync enabled")
+
+        except Exception as e:
+            self.log_error(f"Error enabling real-time sync: {str(e)}")
+            self.auto_backup_checkbox.setChecked(False)
+
+    def realtime_folder_lost(self, folder):
+        """Turn real-time sync off once none of its folders can be watched any more"""
+        if self.file_watcher and not self.file_watcher.watched_paths:
+            self.log_error("No backup folder is left to watch, real-time sync disabled")
+            self.auto_backup_checkbox.setChecked(False)
+
+    def stop_realtime_sync(self):
+        """Stop the file watcher and its upload worker"""
+        try:
+            if self.file_watcher:
+                self.file_watcher.close()
+                self.file_watcher = None
+            if self.realtime_worker:
+                self.realtime_worker.stop()
+                self.realtime_worker.wait()
+                self.realtime_worker = None
+        except Exception as e:
+            self.log_error(f"Error stopping real-time sync: {str(e)}")
+
     def apply_dark_theme(self):
         """Apply dark theme to the application"""
         self.setStyleSheet("""
@@ -960,9 +1282,8 @@ class DriveBackupGUI(QMainWindow):
             progress = QProgressDialog("Moving files...", "Cancel", 0, 100, self)
             progress.setWindowModality(Qt.WindowModal)
             
-            # Count total files
-            total_files = sum(len(files) for folder in source_folders 
-                             for _, _, files in os.walk(folder))
+            # Source folders are scanned as files are moved, the total grows as it goes
+            files_found = 0
             processed_files = 0
             moved_files = 0
             failed_files = 0
@@ -973,43 +1294,46 @@ class DriveBackupGUI(QMainWindow):
                         self.log_error(f"Source folder not found: {source_folder}")
                         continue
 
-                    for root, _, files in os.walk(source_folder):
+                    scanner = TreeScanner(source_folder, on_error=self.log_error)
+                    for item in scanner.scan():
                         if progress.wasCanceled():
                             self.log_error("Move operation cancelled")
                             return
+
+                        if item.kind == DIRECTORY:
+                            continue
                             
                         # Create corresponding subdirectory structure
-                        rel_path = os.path.relpath(root, source_folder)
-                        dest_dir = os.path.join(destination, os.path.basename(source_folder), rel_path)
+                        source_file = item.path
+                        dest_file = os.path.join(destination, os.path.basename(source_folder), item.rel_path)
                         
-                        for file in files:
-                            source_file = os.path.join(root, file)
-                            dest_file = os.path.join(dest_dir, file)
+                        try:
+                            # Create directory if it doesn't exist
+                            os.makedirs(os.path.dirname(dest_file), exist_ok=True)
                             
-                            try:
-                                # Create directory if it doesn't exist
-                                os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-                                
-                                # Check if destination file exists
-                                if os.path.exists(dest_file):
-                                    base, ext = os.path.splitext(dest_file)
-                                    counter = 1
-                                    while os.path.exists(f"{base}_{counter}{ext}"):
-                                        counter += 1
-                                    dest_file = f"{base}_{counter}{ext}"
-                                
-                                # Copy file first, then delete original if successful
-                                shutil.copy2(source_file, dest_file)
-                                os.remove(source_file)
-                                moved_files += 1
-                                self.log_error(f"Moved: {source_file} -> {dest_file}")
-                                
-                            except Exception as e:
-                                failed_files += 1
-                                self.log_error(f"Error moving {source_file}: {str(e)}")
+                            # Check if destination file exists
+                            if os.path.exists(dest_file):
+                                base, ext = os.path.splitext(dest_file)
+                                counter = 1
+                                while os.path.exists(f"{base}_{counter}{ext}"):
+                                    counter += 1
+                                dest_file = f"{base}_{counter}{ext}"
                             
-                            processed_files += 1
-                            progress.setValue(int((processed_files / total_files) * 100))
+                            # Copy file first, then delete original if successful
+                            shutil.copy2(source_file, dest_file)
+                            os.remove(source_file)
+                            moved_files += 1
+                            self.log_error(f"Moved: {source_file} -> {dest_file}")
+                            
+                        except Exception as e:
+                            failed_files += 1
+                            self.log_error(f"Error moving {source_file}: {str(e)}")
+                        
+                        processed_files += 1
+                        total_files = files_found + scanner.files_found
+                        progress.setValue(int((processed_files / total_files) * 100))
+
+                    files_found += scanner.files_found
                 
                     # Remove empty directories
                     try:
@@ -1151,14 +1475,13 @@ class DriveBackupGUI(QMainWindow):
     def quit_application(self):
         """Properly quit the application"""
         # Stop any running operations
-        if hasattr(self, 'file_watcher'):
-            for path in list(self.file_watcher.watched_paths):
-                self.file_watcher.stop_watching(path)
+        self.stop_realtime_sync()
         
         # Stop any running sync workers
         for worker in self.sync_workers:
             worker.stop()
             worker.wait()
+        self.close_scheduler()
         
         # Remove tray icon
         self.tray_icon.hide()
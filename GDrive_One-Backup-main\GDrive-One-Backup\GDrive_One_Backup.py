@@ -6,16 +6,23 @@ from PyQt5.QtGui import *
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 import pickle
 import json
 import hashlib
+import time
 from datetime import datetime
 import win32gui
 import win32con
 import win32process
 import ctypes
+from folder_search import FolderSearchIndex, SEARCH_LIMIT
+from folder_cache import FOLDER_MIME_TYPE
+from drive_transport import build_drive_service, service_credentials
+from drive_retry import default_policy
+
+# Keystrokes closer together than this are searched once
+SEARCH_DEBOUNCE_MS = 50
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
@@ -92,12 +99,91 @@ class SyncWorker(QThread):
     def stop(self):
         self.running = False
 
+def thread_drive_service(drive_service):
+    """Drive service for a worker thread, httplib2 connections cannot be shared"""
+    credentials = service_credentials(drive_service)
+    return build_drive_service(credentials) if credentials else drive_service
+
+class FolderIndexWorker(QThread):
+    """Lists every Drive folder once and builds the search index"""
+    progress = pyqtSignal(int)  # Folders listed so far
+    index_ready = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+    def __init__(self, drive_service):
+        super().__init__()
+        self.drive_service = drive_service
+        self.running = True
+
+    def run(self):
+        try:
+            drive_service = thread_drive_service(self.drive_service)
+            folders = []
+            page_token = None
+            while self.running:
+                results = default_policy.execute(drive_service.files().list(
+                    q=f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
+                    spaces='drive',
+                    fields='nextPageToken, files(id, name, parents)',
+                    pageSize=1000,
+                    pageToken=page_token
+                ), is_running=lambda: self.running)
+                folders.extend(results.get('files', []))
+                self.progress.emit(len(folders))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+
+            if self.running:
+                index = FolderSearchIndex()
+                index.build(folders)
+                self.index_ready.emit(index)
+        except Exception as e:
+            self.error.emit(str(e))
+
+    def stop(self):
+        self.running = False
+
+class RemoteFolderSearch(QThread):
+    """Searches folder names on Drive when the local index cannot answer"""
+    results_ready = pyqtSignal(int, object)  # Search generation, (ID, name, path) tuples
+    error = pyqtSignal(str)
+
+    def __init__(self, drive_service, generation, query):
+        super().__init__()
+        self.drive_service = drive_service
+        self.generation = generation
+        self.query = query
+
+    def run(self):
+        try:
+            drive_service = thread_drive_service(self.drive_service)
+            escaped = self.query.replace('\\', '\\\\').replace("'", "\\'")
+            results = default_policy.execute(drive_service.files().list(
+                q=f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false and name contains '{escaped}'",
+                spaces='drive',
+                fields='files(id, name)',
+                pageSize=SEARCH_LIMIT
+            ))
+            folders = [(folder['id'], folder['name'], folder['name'])
+                       for folder in results.get('files', [])]
+            self.results_ready.emit(self.generation, folders)
+        except Exception as e:
+            self.error.emit(str(e))
+
 class GoogleDriveBrowserDialog(QDialog):
-    def __init__(self, drive_service, parent=None):
+    def __init__(self, drive_service, parent=None, remote_fallback=True):
         try:
             super().__init__(parent)
             self.drive_service = drive_service
             self.selected_folder = None
+            # Filled in the background by load_folders, searches run against it
+            self.search_index = None
+            self.index_worker = None
+            # Ask Drive when the index is not ready or finds nothing
+            self.remote_fallback = remote_fallback
+            self.remote_searches = []
+            self.search_generation = 0
             self.search_timer = QTimer()
             self.search_timer.setSingleShot(True)
             self.search_timer.timeout.connect(self.perform_search)
@@ -142,6 +228,7 @@ class GoogleDriveBrowserDialog(QDialog):
             self.folder_tree.setAnimated(True)
             self.folder_tree.setSortingEnabled(True)
             self.folder_tree.itemClicked.connect(self.on_folder_selected)
+            self.folder_tree.itemExpanded.connect(self.on_folder_expanded)
             layout.addWidget(self.folder_tree)
             
             # Progress bar
@@ -178,6 +265,185 @@ class GoogleDriveBrowserDialog(QDialog):
             print(f"UI setup error: {str(e)}")
             raise
 
+    def load_folders(self):
+        """Index every folder in the background, the tree is filled when it is done"""
+        self.status_label.setText("Loading folders...")
+        self.progress.setRange(0, 0)
+        self.progress.setVisible(True)
+
+        self.index_worker = FolderIndexWorker(self.drive_service)
+        self.index_worker.progress.connect(
+            lambda count: self.status_label.setText(f"Loading folders... {count}"))
+        self.index_worker.index_ready.connect(self.on_index_ready)
+        self.index_worker.error.connect(self.on_index_error)
+        self.index_worker.start()
+
+    def refresh_folders(self):
+        """Rebuild the folder index from Drive"""
+        self.stop_index_worker()
+        self.search_index = None
+        self.folder_tree.clear()
+        self.load_folders()
+
+    def stop_index_worker(self):
+        if self.index_worker:
+            self.index_worker.stop()
+            self.index_worker.wait()
+            self.index_worker = None
+
+    def on_index_ready(self, index):
+        self.search_index = index
+        self.progress.setVisible(False)
+        self.status_label.setText(f"{len(index)} folders")
+        if self.search_input.text().strip():
+            self.perform_search()
+        else:
+            self.show_tree()
+
+    def on_index_error(self, message):
+        self.progress.setVisible(False)
+        self.status_label.setText(f"Error loading folders: {message}")
+
+    def add_tree_item(self, parent, folder_id, name, path=None):
+        item = QTreeWidgetItem(parent)
+        item.setText(0, path or name)
+        item.setData(0, Qt.UserRole, folder_id)
+        if path is None and self.search_index.has_subfolders(folder_id):
+            # Children are added when the item is expanded
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+        return item
+
+    def show_tree(self):
+        """Show the folder hierarchy from the index"""
+        self.folder_tree.clear()
+        self.folder_tree.setSortingEnabled(True)
+        for folder_id, name in self.search_index.subfolders():
+            self.add_tree_item(self.folder_tree, folder_id, name)
+
+    def on_folder_expanded(self, item):
+        """Add sub-folders from the index the first time a folder is opened"""
+        if self.search_index is None or item.childCount():
+            return
+        for folder_id, name in self.search_index.subfolders(item.data(0, Qt.UserRole)):
+            self.add_tree_item(item, folder_id, name)
+
+    def on_search_changed(self, text):
+        """Search as the user types, bursts of keystrokes are searched once"""
+        self.search_timer.start(SEARCH_DEBOUNCE_MS)
+
+    def perform_search(self):
+        """Show folders whose name or path matches the search box"""
+        query = self.search_input.text().strip()
+        self.search_generation += 1
+
+        if self.search_index is None:
+            if query and self.remote_fallback:
+                self.search_remote(query)
+            return
+
+        if not query:
+            self.show_tree()
+            self.status_label.setText(f"{len(self.search_index)} folders")
+            return
+
+        started = time.perf_counter()
+        results = self.search_index.search(query)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.show_results(results)
+        self.status_label.setText(f"{len(results)} folders found in {elapsed:.1f} ms")
+
+        if not results and self.remote_fallback:
+            self.search_remote(query)
+
+    def show_results(self, results):
+        # Keep the ranking of the search, best matches first
+        self.folder_tree.setSortingEnabled(False)
+        self.folder_tree.clear()
+        for folder_id, name, path in results:
+            self.add_tree_item(self.folder_tree, folder_id, name, path)
+
+    def search_remote(self, query):
+        """Ask Drive for matching folder names without blocking the dialog"""
+        self.status_label.setText("Searching Google Drive...")
+        search = RemoteFolderSearch(self.drive_service, self.search_generation, query)
+        search.results_ready.connect(self.on_remote_results)
+        search.error.connect(lambda message: self.status_label.setText(f"Search failed: {message}"))
+        search.finished.connect(lambda: self.remote_searches.remove(search))
+        self.remote_searches.append(search)
+        search.start()
+
+    def on_remote_results(self, generation, results):
+        if generation != self.search_generation:
+            # The search box changed since this query was sent
+            return
+        self.show_results(results)
+        self.status_label.setText(f"{len(results)} folders found on Google Drive")
+
+    def on_folder_selected(self, item, column):
+        folder_id = item.data(0, Qt.UserRole)
+        if folder_id:
+            self.selected_folder = (folder_id, item.text(0))
+
+    def create_new_folder(self):
+        """Create a folder inside the selected one, or at the top level"""
+        name, ok = QInputDialog.getText(self, "Create New Folder", "Folder name:")
+        if not ok or not name.strip():
+            return
+        parent_item = self.folder_tree.currentItem()
+        parent_id = parent_item.data(0, Qt.UserRole) if parent_item else None
+        try:
+            folder = self.drive_service.files().create(
+                body={'name': name.strip(), 'mimeType': FOLDER_MIME_TYPE,
+                      'parents': [parent_id or 'root']},
+                fields='id, name'
+            ).execute()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to create folder: {str(e)}")
+            return
+
+        if self.search_index is not None:
+            parent_path = self.search_index.path(parent_id) if parent_id else None
+            path = f"{parent_path}/{folder['name']}" if parent_path else folder['name']
+            self.search_index.add(folder['id'], folder['name'], path, parent_id)
+        item = QTreeWidgetItem(parent_item or self.folder_tree)
+        item.setText(0, folder['name'])
+        item.setData(0, Qt.UserRole, folder['id'])
+        self.folder_tree.setCurrentItem(item)
+        self.on_folder_selected(item, 0)
+
+    def delete_folder(self):
+        """Move the selected folder to the Drive trash"""
+        item = self.folder_tree.currentItem()
+        if not item or not item.data(0, Qt.UserRole):
+            return
+        folder_id = item.data(0, Qt.UserRole)
+        answer = QMessageBox.question(self, "Delete Folder",
+                                      f"Move '{item.text(0)}' to the Google Drive trash?")
+        if answer != QMessageBox.Yes:
+            return
+        try:
+            self.drive_service.files().update(fileId=folder_id, body={'trashed': True}).execute()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to delete folder: {str(e)}")
+            return
+
+        if self.search_index is not None:
+            self.search_index.discard(folder_id)
+        parent_item = item.parent()
+        if parent_item:
+            parent_item.removeChild(item)
+        else:
+            self.folder_tree.takeTopLevelItem(self.folder_tree.indexOfTopLevelItem(item))
+        if self.selected_folder and self.selected_folder[0] == folder_id:
+            self.selected_folder = None
+
+    def done(self, result):
+        """Stop background work before the dialog goes away"""
+        self.stop_index_worker()
+        for search in list(self.remote_searches):
+            search.wait()
+        super().done(result)
+
 class DriveBackupGUI(QMainWindow):
     def __init__(self):
         try:
@@ -343,7 +609,7 @@ class DriveBackupGUI(QMainWindow):
             with open('token.pickle', 'wb') as token:
                 pickle.dump(self.credentials, token)
 
-            self.drive_service = build('drive', 'v3', credentials=self.credentials)
+            self.drive_service = build_drive_service(self.credentials)
             self.status_label.setText("Status: Logged in")
             self.add_folder_btn.setEnabled(True)
             self.sync_btn.setEnabled(True)
@@ -359,7 +625,7 @@ class DriveBackupGUI(QMainWindow):
                     self.credentials = pickle.load(token)
 
             if self.credentials and self.credentials.valid:
-                self.drive_service = build('drive', 'v3', credentials=self.credentials)
+                self.drive_service = build_drive_service(self.credentials)
                 self.status_label.setText("Status: Logged in")
                 self.add_folder_btn.setEnabled(True)
                 self.sync_btn.setEnabled(True)
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import time
+
+# Upload limit and time-of-day profiles, shared by the GUI and gdrive_sync
+BANDWIDTH_FILE = 'bandwidth.json'
+
+MB = 1024 * 1024
+UNLIMITED = 0
+
+# Bytes that may go out at once, in seconds of traffic at the current limit.
+# Resumable chunks are capped to this so a single chunk never floods the uplink.
+BURST_SECONDS = 1.0
+
+# How often the time-of-day profiles and the bandwidth file are looked at again
+PROFILE_CHECK_INTERVAL = 5.0
+
+# Waiting uploads look at the limit at least this often, so a new limit applies at once
+MAX_WAIT = 0.25
+
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def parse_time(value):
+    """Minutes since midnight of 'HH:MM', '24:00' is the end of the day"""
+    try:
+        hours, minutes = (int(part) for part in value.split(':'))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time of day: {value!r}, expected HH:MM")
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f"Invalid time of day: {value!r}, expected HH:MM")
+    return hours * 60 + minutes
+
+
+def parse_day(value):
+    """Weekday number (Monday is 0) of a day name such as 'Monday' or 'mon'"""
+    name = str(value).strip().lower()
+    for number, day in enumerate(DAYS):
+        if len(name) >= 3 and day.startswith(name):
+            return number
+    raise ValueError(f"Invalid day: {value!r}")
+
+
+def parse_limit(value):
+    """Bytes per second of a limit given in MB/s, 0 or null is unlimited"""
+    if value is None:
+        return UNLIMITED
+    limit = float(value)
+    if limit < 0:
+        raise ValueError(f"Invalid bandwidth limit: {value!r}")
+    return int(limit * MB)
+
+
+class BandwidthProfile:
+    """Upload limit for a window of the day, e.g. 2 MB/s from 09:00 to 18:00 on weekdays
+
+    A window whose end is before its start runs past midnight, its days
+    are the days it starts on.
+    """
+
+    def __init__(self, start, end, limit, days=None):
+        self.start = parse_time(start)
+        self.end = parse_time(end)
+        self.rate = parse_limit(limit)
+        self.days = {parse_day(day) for day in days} if days else None
+
+    def matches(self, now):
+        """Whether the struct_time now falls in this window"""
+        minute = now.tm_hour * 60 + now.tm_min
+        day = now.tm_wday
+        if self.start <= self.end:
+            inside = self.start <= minute < self.end
+        elif minute >= self.start:
+            inside = True
+        else:
+            # After midnight, the window belongs to the day before
+            inside = minute < self.end
+            day = (day - 1) % 7
+        return inside and (self.days is None or day in self.days)
+
+
+def read_bandwidth(path):
+    """(default rate, profiles) of a bandwidth file
+
+    The file holds the limit in MB/s outside every profile and a list of
+    profiles, the first one matching the time of day wins:
+
+        {"limit": 0,
+         "profiles": [{"start": "09:00", "end": "18:00", "limit": 2,
+                       "days": ["Mon", "Tue", "Wed", "Thu", "Fri"]}]}
+    """
+    with open(path, 'r') as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} must hold a JSON object")
+    try:
+        profiles = [BandwidthProfile(profile['start'], profile['end'], profile.get('limit'),
+                                     profile.get('days'))
+                    for profile in config.get('profiles', [])]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid profile in {path}: {str(e)}")
+    return parse_limit(config.get('limit')), profiles
+
+
+class BandwidthLimiter:
+    """Upload byte rate shared by every worker and chunk of a sync
+
+    Each request body is paid for with consume() before it is sent. The
+    bucket holds at most BURST_SECONDS of traffic; a body larger than what
+    is left still goes out and the debt is paid back by whoever sends
+    next, so large chunks cannot starve small files.
+
+    The limit in force is the override set from the UI or command line,
+    otherwise the first time-of-day profile that matches, otherwise the
+    default. It is looked at again every PROFILE_CHECK_INTERVAL seconds
+    and the bandwidth file is re-read when it changes, so a new limit
+    applies to uploads already running without restarting them.
+    """
+
+    def __init__(self, limit=UNLIMITED, profiles=(), path=None):
+        self.default_rate = limit
+        self.profiles = list(profiles)
+        # Bandwidth file watched for edits, None for a fixed configuration
+        self.path = path
+        self.loaded_mtime = None
+        self.override = None
+        self.lock = threading.Lock()
+        self.rate = UNLIMITED  # Bytes per second in force, 0 is unlimited
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.checked = None
+        self.bytes_sent = 0
+        self.waited = 0.0  # Seconds uploads spent held back, summed over workers
+
+    def set_override(self, limit):
+        """Limit every upload to `limit` bytes per second, None goes back to the profiles"""
+        with self.lock:
+            self.override = limit
+            self.checked = None
+            self.refresh(time.monotonic())
+
+    def current_rate(self):
+        """Bytes per second in force right now, 0 is unlimited"""
+        with self.lock:
+            self.refresh(time.monotonic())
+            return self.rate
+
+    def chunk_ceiling(self):
+        """Largest resumable chunk worth sending at the current limit, None if unlimited"""
+        rate = self.current_rate()
+        return int(rate * BURST_SECONDS) if rate else None
+
+    def scheduled_rate(self):
+        if self.override is not None:
+            return self.override
+        now = time.localtime()
+        for profile in self.profiles:
+            if profile.matches(now):
+                return profile.rate
+        return self.default_rate
+
+    def refresh(self, now):
+        """Pick up a new limit, called with the lock held"""
+        if self.checked is not None and now - self.checked < PROFILE_CHECK_INTERVAL:
+            return
+        self.checked = now
+        if self.path:
+            self.reload()
+        rate = self.scheduled_rate()
+        if rate == self.rate:
+            return
+        if rate:
+            # Keep the debt of the old limit, it was already sent
+            self.tokens = min(self.tokens, rate * BURST_SECONDS)
+        else:
+            self.tokens = 0.0
+        self.rate = rate
+        self.updated = now
+
+    def reload(self):
+        """Re-read the bandwidth file if it changed, keeping the old settings if it is broken"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.loaded_mtime:
+            return
+        self.loaded_mtime = mtime
+        try:
+            self.default_rate, self.profiles = read_bandwidth(self.path)
+        except Exception as e:
+            print(f"Could not read {self.path}, keeping the previous limits: {e}")
+
+    def consume(self, size, is_running=None):
+        """Block until `size` bytes may be sent, returns early if is_running() turns False"""
+        if size <= 0:
+            return
+        started = None
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refresh(now)
+                if not self.rate:
+                    self.bytes_sent += size
+                    break
+                self.tokens = min(self.rate * BURST_SECONDS,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 0:
+                    self.tokens -= size
+                    self.bytes_sent += size
+                    break
+                wait = -self.tokens / self.rate
+            if is_running and not is_running():
+                break
+            if started is None:
+                started = now
+            time.sleep(min(wait, MAX_WAIT))
+        if started is not None:
+            with self.lock:
+                self.waited += time.monotonic() - started
+
+
+def load_bandwidth(path=BANDWIDTH_FILE):
+    """Limiter configured from the bandwidth file, unlimited if there is none
+
+    The file is watched either way, so limits can be added during a run.
+    Raises ValueError if the file exists but cannot be used.
+    """
+    limiter = BandwidthLimiter(path=path)
+    if os.path.exists(path):
+        limiter.default_rate, limiter.profiles = read_bandwidth(path)
+        limiter.loaded_mtime = os.path.getmtime(path)
+    return limiter
@@ -0,0 +1,106 @@
+"""Compare uploading tiny files one by one with packing them, against a simulated Drive
+
+Uses the stand-in service of bench_sync_engine, where every request
+costs a fixed latency. The tree holds many folders of files under the
+pack threshold, like a source tree or a mail export. Each mode syncs the
+tree, then syncs again after one file changed.
+
+    python bench_file_packer.py
+"""
+import os
+import tempfile
+import time
+
+from bench_sync_engine import SimulatedDrive, Files, Request, make_engine, LATENCY
+from sync_index import INDEX_FILE
+from sync_scheduler import SyncScheduler, SCHEDULER_WORKERS
+from file_packer import PACK_THRESHOLD
+
+FOLDERS = 20
+FILES_PER_FOLDER = 250
+FILE_SIZE = 2 * 1024
+
+
+class UpdatableFiles(Files):
+    def update(self, fileId=None, body=None, media_body=None, **kwargs):
+        with self.drive.lock:
+            self.drive.updated += 1
+        return Request({'id': fileId, 'name': fileId, 'md5Checksum': None},
+                       media_body.size() if media_body is not None else 0)
+
+
+class Batch:
+    """Answers all of its requests in one round trip"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self, **kwargs):
+        time.sleep(LATENCY)
+        for request_id, request in self.requests:
+            self.callback(request_id, request.result, None)
+
+
+class UpdatableDrive(SimulatedDrive):
+    """SimulatedDrive that also takes new revisions and batched folder creation"""
+
+    def __init__(self):
+        super().__init__()
+        self.updated = 0
+
+    def files(self):
+        return UpdatableFiles(self)
+
+    def new_batch_http_request(self, callback=None):
+        return Batch(callback)
+
+
+def sync(root, db_path, drive, pack_threshold):
+    """One sync of root, returning (seconds, create and update requests)"""
+    scheduler = SyncScheduler(SCHEDULER_WORKERS)
+    engine = make_engine(root, db_path, drive, scheduler)
+    engine.pack_threshold = pack_threshold
+    requests_before = drive.created + drive.updated
+    started = time.perf_counter()
+    engine.run()
+    elapsed = time.perf_counter() - started
+    scheduler.close()
+    engine.hash_cache.close()
+    return elapsed, drive.created + drive.updated - requests_before
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = os.path.join(temp_dir, 'root')
+        for folder in range(FOLDERS):
+            folder_path = os.path.join(root, f"folder{folder:02d}")
+            os.makedirs(folder_path)
+            for i in range(FILES_PER_FOLDER):
+                with open(os.path.join(folder_path, f"file{i:04d}.txt"), 'wb') as f:
+                    f.write(os.urandom(FILE_SIZE))
+        changed = os.path.join(root, 'folder00', 'file0000.txt')
+
+        print(f"{FOLDERS * FILES_PER_FOLDER} files of {FILE_SIZE} bytes in {FOLDERS} folders, "
+              f"{SCHEDULER_WORKERS} upload threads")
+        for label, pack_threshold in (('one by one', 0), ('packed', PACK_THRESHOLD)):
+            work_dir = os.path.join(temp_dir, label.replace(' ', '_'))
+            os.makedirs(work_dir)
+            os.chdir(work_dir)
+            db_path = os.path.abspath(INDEX_FILE)
+            drive = UpdatableDrive()
+
+            elapsed, requests = sync(root, db_path, drive, pack_threshold)
+            print(f"  {label:>10}: full sync {elapsed:.2f}s, {requests} create or update requests")
+            with open(changed, 'wb') as f:
+                f.write(os.urandom(FILE_SIZE))
+            elapsed, requests = sync(root, db_path, drive, pack_threshold)
+            print(f"  {label:>10}: one file changed {elapsed:.2f}s, {requests} create or update requests")
+        os.chdir(os.path.dirname(temp_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Time FolderSearchIndex searches over a large synthetic folder tree
+
+Builds an index of randomly named, randomly nested folders and reports
+the build time and the slowest of several searches, which should stay
+well under the time between two keystrokes.
+
+    python bench_folder_search.py [folder count]
+"""
+import sys
+import time
+import random
+import string
+
+from folder_search import FolderSearchIndex
+
+FOLDER_COUNT = 100000
+
+QUERIES = ['a', 'ph', 'pho', 'photos', 'zzzz', 'photos/2023', '/a', 'a/b', 'backup 20']
+
+
+def make_folders(count):
+    """Folders named from a small vocabulary, nested up to a few levels deep"""
+    random.seed(0)
+    words = [''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(3, 9)))
+             for _ in range(3000)] + ['photos', 'backup', '2023', 'projects']
+    folders = []
+    for i in range(count):
+        parent = f"folder{random.randrange(i)}" if i > 100 else 'root'
+        name = ' '.join(random.sample(words, random.randint(1, 3))).title()
+        folders.append({'id': f"folder{i}", 'name': name, 'parents': [parent]})
+    return folders
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else FOLDER_COUNT
+    folders = make_folders(count)
+
+    started = time.perf_counter()
+    index = FolderSearchIndex()
+    index.build(folders)
+    print(f"built index of {len(index)} folders in {time.perf_counter() - started:.2f} s")
+
+    print(f"{'query':<16} {'results':>8} {'ms':>8}")
+    for query in QUERIES:
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            results = index.search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{query:<16} {len(results):>8} {max(timings):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Compare hashing throughput with raw read speed of the same files
+
+Writes a set of test files, then reads them without hashing and hashes
+them with every available algorithm, once in a single thread and once
+on a HashEngine pool. Pass a directory to measure a real disk instead of
+the temp directory; the page cache is warm after the first pass, so use
+files larger than RAM to measure the disk itself.
+
+    python bench_hashing.py [directory]
+"""
+import os
+import sys
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from hashing import ALGORITHMS, HASH_BLOCK_SIZE, HashEngine, hash_file
+from sync_progress import format_bytes
+
+FILE_COUNT = 8
+FILE_SIZE = 64 * 1024 * 1024
+
+
+def read_file(file_path, block_size=HASH_BLOCK_SIZE):
+    """Read a file without hashing it and return the number of bytes read"""
+    buffer = bytearray(block_size)
+    size = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                return size
+            size += count
+
+
+def measure(label, paths, fn, workers):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(fn, paths))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<24} {workers:>7} {format_bytes(total / elapsed):>12}/s")
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else None
+    workers = HashEngine().workers
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        paths = []
+        for i in range(FILE_COUNT):
+            file_path = os.path.join(temp_dir, f"file_{i}.bin")
+            with open(file_path, 'wb') as f:
+                f.write(os.urandom(FILE_SIZE))
+            paths.append(file_path)
+
+        print(f"{'':<24} {'threads':>7} {'throughput':>14}")
+        for count in sorted({1, workers}):
+            measure('raw read', paths, read_file, count)
+            for name in ALGORITHMS:
+                measure(name, paths, lambda path: hash_file(path, (name,))[1], count)
+                measure(f"{name} (mmap)", paths,
+                        lambda path: hash_file(path, (name,), use_mmap=True)[1], count)
+
+
+if __name__ == '__main__':
+    main()
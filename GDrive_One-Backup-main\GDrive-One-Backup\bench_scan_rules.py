@@ -0,0 +1,144 @@
+"""Compare scanning and syncing a development tree with and without scan rules
+
+The tree holds projects with a small source folder next to large
+node_modules, .git and build folders. The scan is timed without rules,
+with the rules applied to every file found (what filtering after
+os.walk costs) and with ScanRules pruning excluded folders. A second
+part matches file names against a rule list with fnmatch and with the
+compiled tables, and a last one syncs the tree to a simulated Drive.
+
+    python bench_scan_rules.py
+"""
+import fnmatch
+import os
+import tempfile
+import time
+
+from bench_sync_engine import make_engine
+from bench_file_packer import UpdatableDrive
+from scan_rules import ScanRules
+from scanner import TreeScanner, FILE
+from sync_index import INDEX_FILE
+from sync_scheduler import SyncScheduler, SCHEDULER_WORKERS
+from sync_progress import format_bytes
+
+PROJECTS = 8
+SOURCE_FILES = 40
+PACKAGES = 30
+PACKAGE_DEPTH = 3
+PACKAGE_FILES = 8
+GIT_OBJECTS = 300
+BUILD_FILES = 100
+FILE_SIZE = 1024
+
+RULES = ['node_modules/', '.git/', 'build/', '__pycache__/', '.venv/', 'dist/', '*.tmp', '*.lock',
+         '*.log', '*.pyc', '*.o', '*.obj', '*.swp', '~$*', 'Thumbs.db', '.DS_Store', '*.bak',
+         'coverage/', '.idea/', '.vscode/', '*.class', 'target/', '*.min.js.map', '!important.log']
+
+MATCH_NAMES = 200000
+
+
+def write_files(folder, count, suffix='.txt'):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(folder, f"file{i:04d}{suffix}"), 'wb') as f:
+            f.write(os.urandom(FILE_SIZE))
+
+
+def make_tree(root):
+    for project in range(PROJECTS):
+        project_path = os.path.join(root, f"project{project}")
+        write_files(os.path.join(project_path, 'src'), SOURCE_FILES, '.py')
+        write_files(os.path.join(project_path, 'src'), 4, '.tmp')
+        write_files(os.path.join(project_path, '.git', 'objects'), GIT_OBJECTS, '')
+        write_files(os.path.join(project_path, 'build'), BUILD_FILES, '.o')
+        for package in range(PACKAGES):
+            package_path = os.path.join(project_path, 'node_modules', f"package{package}")
+            for depth in range(PACKAGE_DEPTH):
+                write_files(package_path, PACKAGE_FILES, '.js')
+                package_path = os.path.join(package_path, 'lib')
+
+
+def naive_excluded(rel_path):
+    """Last matching rule wins, every rule checked against every path component"""
+    parts = rel_path.split('/')
+    excluded = False
+    for rule in RULES:
+        negate = rule.startswith('!')
+        pattern = rule.lstrip('!').strip('/')
+        if any(fnmatch.fnmatchcase(part, pattern) for part in parts):
+            excluded = not negate
+    return excluded
+
+
+def scan(root, mode):
+    """(seconds, files yielded, bytes yielded) of one scan"""
+    rules = ScanRules(RULES) if mode == 'pruned' else None
+    started = time.perf_counter()
+    files = size = 0
+    for item in TreeScanner(root, rules=rules).scan():
+        if item.kind != FILE:
+            continue
+        if mode == 'filtered' and naive_excluded(item.rel_path.replace(os.sep, '/')):
+            continue
+        files += 1
+        size += item.stat.st_size
+    return time.perf_counter() - started, files, size
+
+
+def match_names():
+    names = [f"file{i}{('.js', '.py', '.tmp', '.log', '.txt')[i % 5]}" for i in range(MATCH_NAMES)]
+    stat_result = os.stat(__file__)
+
+    started = time.perf_counter()
+    naive = sum(naive_excluded(name) for name in names)
+    naive_time = time.perf_counter() - started
+
+    rules = ScanRules(RULES)
+    started = time.perf_counter()
+    compiled = sum(rules.skip_file(name, name, stat_result) for name in names)
+    compiled_time = time.perf_counter() - started
+    assert naive == compiled
+    return naive_time, compiled_time
+
+
+def sync(root, db_path, drive, scan_rules):
+    scheduler = SyncScheduler(SCHEDULER_WORKERS)
+    engine = make_engine(root, db_path, drive, scheduler)
+    engine.scan_rules = scan_rules
+    started = time.perf_counter()
+    engine.run()
+    elapsed = time.perf_counter() - started
+    scheduler.close()
+    engine.hash_cache.close()
+    return elapsed, drive.created
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = os.path.join(temp_dir, 'root')
+        make_tree(root)
+
+        print(f"{PROJECTS} projects, {len(RULES)} rules")
+        for mode in ('no rules', 'filtered', 'pruned'):
+            best = min(scan(root, mode) for _ in range(3))
+            print(f"  scan {mode:>8}: {best[0] * 1000:.0f} ms, {best[1]} files, {format_bytes(best[2])}")
+
+        naive_time, compiled_time = match_names()
+        print(f"  {MATCH_NAMES} names: fnmatch {naive_time * 1000:.0f} ms, "
+              f"compiled {compiled_time * 1000:.0f} ms")
+
+        for label, scan_rules in (('no rules', None), ('rules', ScanRules(RULES))):
+            work_dir = os.path.join(temp_dir, label.replace(' ', '_'))
+            os.makedirs(work_dir)
+            os.chdir(work_dir)
+            elapsed, requests = sync(root, os.path.abspath(INDEX_FILE), UpdatableDrive(), scan_rules)
+            print(f"  sync {label:>8}: {elapsed:.2f}s, {requests} files created")
+            if scan_rules:
+                for line in scan_rules.summary():
+                    print(f"    {line}")
+        os.chdir(os.path.dirname(temp_dir))
+
+
+if __name__ == '__main__':
+    main()
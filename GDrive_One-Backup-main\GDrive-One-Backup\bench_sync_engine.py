@@ -0,0 +1,165 @@
+"""Time whole SyncEngine runs against a simulated Drive, without Qt or network
+
+Every request to the stand-in service sleeps for a fixed latency plus the
+time its payload would take at a fixed bandwidth. The first scenario puts
+one large upload in front of many small ones and compares the scheduling
+policies, the second syncs a large and a small root through one shared
+scheduler, the last rescans a tree where nothing changed.
+
+    python bench_sync_engine.py
+"""
+import os
+import tempfile
+import threading
+import time
+
+from sync_engine import SyncEngine
+from sync_index import HashCache, ContentIndex, INDEX_FILE
+from folder_cache import FolderCache
+from remote_index import RemoteIndex
+from drive_retry import RetryPolicy, TokenBucket
+from sync_scheduler import SyncScheduler, POLICIES, SCHEDULER_WORKERS
+
+LATENCY = 0.02  # Seconds per request
+BANDWIDTH = 16 * 1024 * 1024  # Bytes per second per upload
+SMALL_FILES = 2000
+LARGE_FILE_SIZE = 32 * 1024 * 1024
+SECOND_ROOT_FILES = 40
+
+
+class Request:
+    def __init__(self, result, payload=0, uploads=None):
+        self.result = result
+        self.payload = payload
+        self.uploads = uploads
+
+    def execute(self, **kwargs):
+        time.sleep(LATENCY + self.payload / BANDWIDTH)
+        if self.uploads is not None:
+            self.uploads.append((time.perf_counter(), self.result['name']))
+        return self.result
+
+
+class Files:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, **kwargs):
+        return Request({'files': []})
+
+    def create(self, body=None, media_body=None, **kwargs):
+        with self.drive.lock:
+            self.drive.created += 1
+            file_id = f"id{self.drive.created}"
+        if media_body is None:
+            return Request({'id': file_id})
+        return Request({'id': file_id, 'name': body['name'], 'md5Checksum': None},
+                       media_body.size(), self.drive.uploads)
+
+
+class Changes:
+    def getStartPageToken(self, **kwargs):
+        return Request({'startPageToken': '1'})
+
+    def list(self, **kwargs):
+        return Request({'changes': [], 'newStartPageToken': '1'})
+
+
+class SimulatedDrive:
+    """Just enough of the Drive service for SyncEngine"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = 0
+        self.uploads = []  # (finished at, name)
+
+    def files(self):
+        return Files(self)
+
+    def changes(self):
+        return Changes()
+
+    def get(self):
+        # Stands in for ThreadLocalDrive as well
+        return self
+
+
+def make_engine(root, db_path, drive, scheduler):
+    # The real request rate limit would be all this measures
+    policy = RetryPolicy(TokenBucket(rate=1000000, capacity=1000000))
+    engine = SyncEngine(drive, root, 'parent-id', retry_policy=policy,
+                        folder_cache=FolderCache(db_path, policy), hash_cache=HashCache(),
+                        content_index=ContentIndex(db_path), remote_index=RemoteIndex(db_path, policy),
+                        small_file_threshold=LARGE_FILE_SIZE * 2, scheduler=scheduler,
+                        on_error=lambda message: print(f"  error: {message}"))
+    engine.upload_drives = drive
+    return engine
+
+
+def run_roots(roots, work_dir, drive, policy):
+    """Sync roots side by side on one scheduler, returning (start, seconds, engines)
+
+    Every index lives in work_dir, runs in the same work_dir see each other's uploads.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    db_path = os.path.abspath(INDEX_FILE)
+    scheduler = SyncScheduler(SCHEDULER_WORKERS, policy=policy)
+    engines = [make_engine(root, db_path, drive, scheduler) for root in roots]
+    threads = [threading.Thread(target=engine.run) for engine in engines]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    scheduler.close()
+    for engine in engines:
+        engine.hash_cache.close()
+    return started, elapsed, engines
+
+
+def write_files(root, count, prefix, size=1024):
+    os.makedirs(root)
+    for i in range(count):
+        with open(os.path.join(root, f"{prefix}{i:05d}.txt"), 'wb') as f:
+            f.write(os.urandom(size))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = os.path.join(temp_dir, 'root')
+        write_files(root, SMALL_FILES, 'small')
+        # Scanned first, its upload alone takes about two seconds
+        with open(os.path.join(root, '0_large.bin'), 'wb') as f:
+            f.write(os.urandom(LARGE_FILE_SIZE))
+        second_root = os.path.join(temp_dir, 'second')
+        write_files(second_root, SECOND_ROOT_FILES, 'second')
+
+        large_upload = LATENCY + LARGE_FILE_SIZE / BANDWIDTH
+        ideal = max(large_upload, (SMALL_FILES * LATENCY + large_upload) / SCHEDULER_WORKERS)
+        print(f"one root, {SMALL_FILES + 1} files, lower bound {ideal:.2f}s "
+              f"with {SCHEDULER_WORKERS} upload threads")
+        for policy in POLICIES:
+            drive = SimulatedDrive()
+            started, elapsed, _ = run_roots([root], os.path.join(temp_dir, policy), drive, policy)
+            mean = sum(done - started for done, _ in drive.uploads) / len(drive.uploads)
+            print(f"  {policy:>8}: all files in {elapsed:.2f}s, "
+                  f"a file is protected after {mean:.2f}s on average")
+
+        print(f"two roots of {SMALL_FILES + 1} and {SECOND_ROOT_FILES} files sharing the scheduler")
+        drive = SimulatedDrive()
+        started, elapsed, _ = run_roots([root, second_root], os.path.join(temp_dir, 'shared'),
+                                        drive, POLICIES[0])
+        second_done = max(done for done, name in drive.uploads if name.startswith('second'))
+        print(f"  second root protected after {second_done - started:.2f}s, "
+              f"everything after {elapsed:.2f}s")
+
+        started, elapsed, engines = run_roots([root], os.path.join(temp_dir, 'shared'),
+                                              SimulatedDrive(), POLICIES[0])
+        print(f"unchanged rescan: {engines[0].unchanged_files} files in {elapsed:.2f}s")
+        os.chdir(os.path.dirname(temp_dir))
+
+
+if __name__ == '__main__':
+    main()
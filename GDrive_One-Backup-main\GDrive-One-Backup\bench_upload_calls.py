@@ -0,0 +1,74 @@
+"""Count Drive API calls per uploaded file, with and without the small-file fast path
+
+Runs offline: requests are answered by a stand-in for httplib2.Http that
+mimics the Drive upload endpoints, so only the request count is measured.
+
+    python bench_upload_calls.py
+"""
+import os
+import json
+import tempfile
+
+import httplib2
+from googleapiclient.discovery import build
+
+from sync_engine import SyncEngine, SMALL_FILE_THRESHOLD
+from folder_cache import FolderCache
+
+SESSION_URI = 'https://upload.example.invalid/session'
+
+# Typical files found in a backup root
+FILE_SIZES = [300, 4 * 1024, 100 * 1024, 1024 * 1024, 4 * 1024 * 1024, 20 * 1024 * 1024]
+
+
+class CountingHttp:
+    """Answers Drive upload requests and counts them"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        self.calls += 1
+        headers = headers or {}
+
+        if 'uploadType=resumable' in uri:
+            return httplib2.Response({'status': '200', 'location': SESSION_URI}), b''
+
+        if uri.startswith(SESSION_URI):
+            content_range = headers.get('Content-Range', headers.get('content-range', ''))
+            span, _, total = content_range.replace('bytes ', '').partition('/')
+            end = int(span.split('-')[1])
+            if end + 1 < int(total):
+                return httplib2.Response({'status': '308', 'range': f'bytes=0-{end}'}), b''
+
+        body = json.dumps({'id': 'file-id', 'md5Checksum': '0' * 32}).encode()
+        return httplib2.Response({'status': '200'}), body
+
+
+def count_calls(file_path, small_file_threshold):
+    """Upload one file through SyncEngine.upload_file and return the request count"""
+    http = CountingHttp()
+    drive_service = build('drive', 'v3', http=http, static_discovery=True)
+    worker = SyncEngine(drive_service, os.path.dirname(file_path), 'parent-id',
+                        folder_cache=FolderCache(':memory:'),
+                        small_file_threshold=small_file_threshold)
+    worker.upload_file(file_path, os.path.basename(file_path), 'parent-id')
+    return http.calls
+
+
+def main():
+    print(f"{'size':>12} {'before':>8} {'after':>8}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in FILE_SIZES:
+            file_path = os.path.join(temp_dir, f"file_{size}.bin")
+            with open(file_path, 'wb') as f:
+                f.write(os.urandom(size))
+
+            before = count_calls(file_path, 0)
+            after = count_calls(file_path, SMALL_FILE_THRESHOLD)
+            print(f"{size:>12} {before:>8} {after:>8}")
+
+
+if __name__ == '__main__':
+    main()
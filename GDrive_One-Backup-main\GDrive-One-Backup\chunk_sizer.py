@@ -0,0 +1,85 @@
+from googleapiclient.http import MediaFileUpload
+
+# Drive requires resumable chunks to be a multiple of 256 KiB
+CHUNK_UNIT = 256 * 1024
+
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Chunks are sized so one round trip takes about this long at the measured rate
+TARGET_CHUNK_SECONDS = 3.0
+
+
+class AdaptiveChunkSizer:
+    """Picks the next resumable chunk size from measured per-chunk throughput
+
+    Fast links get large chunks so fewer round trips are paid, slow or
+    unstable links get small chunks so a failed chunk costs little. The
+    size never changes by more than a factor of two per chunk and always
+    stays a multiple of CHUNK_UNIT between min_chunk_size and
+    max_chunk_size.
+    """
+
+    def __init__(self, min_chunk_size=MIN_CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE,
+                 target_seconds=TARGET_CHUNK_SECONDS):
+        self.min_chunk_size = max(CHUNK_UNIT, self.round_to_unit(min_chunk_size))
+        self.max_chunk_size = max(self.min_chunk_size, self.round_to_unit(max_chunk_size))
+        self.target_seconds = target_seconds
+        self.chunk_size = self.min_chunk_size
+        self.throughput = None  # Smoothed bytes per second
+        self.chunks = []  # (chunk size, bytes sent, seconds) per chunk
+
+    @staticmethod
+    def round_to_unit(size):
+        """Round down to a multiple of CHUNK_UNIT"""
+        return max(CHUNK_UNIT, int(size) // CHUNK_UNIT * CHUNK_UNIT)
+
+    def record(self, bytes_sent, seconds):
+        """Feed back one acknowledged chunk and choose the next chunk size"""
+        self.chunks.append((self.chunk_size, bytes_sent, seconds))
+        if bytes_sent <= 0 or seconds <= 0:
+            return self.chunk_size
+
+        rate = bytes_sent / seconds
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput = 0.7 * self.throughput + 0.3 * rate
+
+        ideal = self.throughput * self.target_seconds
+        ideal = min(max(ideal, self.chunk_size / 2), self.chunk_size * 2)
+        ideal = min(max(ideal, self.min_chunk_size), self.max_chunk_size)
+        self.chunk_size = self.round_to_unit(ideal)
+        return self.chunk_size
+
+    def stats(self):
+        """Summary of the chunks sent so far"""
+        total_bytes = sum(sent for _, sent, _ in self.chunks)
+        total_seconds = sum(seconds for _, _, seconds in self.chunks)
+        return {
+            'chunks': len(self.chunks),
+            'bytes': total_bytes,
+            'seconds': total_seconds,
+            'throughput': total_bytes / total_seconds if total_seconds else 0.0,
+            'chunk_sizes': [size for size, _, _ in self.chunks],
+            'final_chunk_size': self.chunk_size,
+        }
+
+
+class AdaptiveMediaFileUpload(MediaFileUpload):
+    """MediaFileUpload whose chunk size is taken from an AdaptiveChunkSizer
+
+    ceiling caps the chunk below what the sizer picked, e.g. to what a
+    bandwidth limit allows per second. It is set before each chunk and
+    must not change while the chunk is sent.
+    """
+
+    def __init__(self, filename, sizer, mimetype=None):
+        super().__init__(filename, mimetype=mimetype, chunksize=sizer.chunk_size, resumable=True)
+        self.sizer = sizer
+        self.ceiling = None
+
+    def chunksize(self):
+        if self.ceiling:
+            return min(self.sizer.chunk_size, AdaptiveChunkSizer.round_to_unit(self.ceiling))
+        return self.sizer.chunk_size
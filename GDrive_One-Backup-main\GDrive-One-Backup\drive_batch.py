@@ -0,0 +1,84 @@
+from drive_retry import default_policy
+
+# Drive accepts at most 100 calls in a single batch request
+MAX_BATCH_SIZE = 100
+
+
+class DriveBatcher:
+    """Collects Drive metadata requests and sends them as HTTP batch requests
+
+    Requests are queued with add() and sent when the batch is full or on
+    flush(). Every request's callback receives (response, exception), and
+    sub-requests that fail inside a batch are retried one by one before
+    the callback is called. Drive may have carried out a request even when
+    its batch failed, so requests that must not run twice (creates) pass a
+    lookup returning the response already produced, or None to send again.
+    """
+
+    def __init__(self, drive_service, max_batch_size=MAX_BATCH_SIZE, retry_policy=None):
+        self.drive_service = drive_service
+        self.retry_policy = retry_policy or default_policy
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_SIZE)
+        self.queue = []
+        self.batches_sent = 0
+        self.requests_sent = 0
+        self.retried = 0
+
+    def add(self, request, callback=None, lookup=None):
+        """Queue a request, sending the batch once it is full"""
+        self.queue.append((request, callback, lookup))
+        if len(self.queue) >= self.max_batch_size:
+            self.flush()
+
+    def flush(self):
+        """Send all queued requests and return their (response, exception) pairs"""
+        results = []
+        while self.queue:
+            chunk = self.queue[:self.max_batch_size]
+            self.queue = self.queue[self.max_batch_size:]
+            results.extend(self.send(chunk))
+        return results
+
+    def send(self, chunk):
+        """Send one batch and map each sub-response back to its caller"""
+        responses = {}
+
+        def on_response(request_id, response, exception):
+            responses[request_id] = (response, exception)
+
+        if len(chunk) > 1:
+            batch = self.drive_service.new_batch_http_request(callback=on_response)
+            for i, (request, _, _) in enumerate(chunk):
+                batch.add(request, request_id=str(i))
+            try:
+                if any(lookup for _, _, lookup in chunk):
+                    # Retrying the batch would run its creates twice, failures go through the lookups
+                    self.retry_policy.limiter.acquire(len(chunk))
+                    batch.execute()
+                else:
+                    # Every sub-request counts against the quota
+                    self.retry_policy.execute(batch, tokens=len(chunk))
+                self.batches_sent += 1
+            except Exception as e:
+                # The whole batch failed, fall back to sending every request alone
+                print(f"Batch request failed (retrying individually): {e}")
+
+        results = []
+        for i, (request, callback, lookup) in enumerate(chunk):
+            request_id = str(i)
+            response, exception = responses.get(request_id, (None, None))
+            if exception is not None or request_id not in responses:
+                if len(chunk) > 1:
+                    self.retried += 1
+                try:
+                    response = lookup() if lookup and len(chunk) > 1 else None
+                    if response is None:
+                        response = self.retry_policy.execute(request)
+                    exception = None
+                except Exception as e:
+                    response, exception = None, e
+            self.requests_sent += 1
+            if callback:
+                callback(response, exception)
+            results.append((response, exception))
+        return results
@@ -0,0 +1,168 @@
+import json
+import random
+import socket
+import ssl
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httplib2
+from google.auth.exceptions import TransportError
+from googleapiclient.errors import HttpError
+from requests import exceptions as requests_errors
+
+# Sustained Drive requests per second across all threads, and the burst allowed on top.
+# Drive's default per-user quota is 12,000 queries a minute (200/s), leave headroom.
+REQUESTS_PER_SECOND = 50
+REQUEST_BURST = 100
+
+MAX_RETRIES = 8
+BASE_DELAY = 1.0
+MAX_DELAY = 64.0
+
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'sharingRateLimitExceeded'}
+SERVER_ERROR_STATUSES = {500, 502, 503, 504}
+NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, socket.gaierror,
+                  ssl.SSLError, httplib2.HttpLib2Error, TransportError,
+                  requests_errors.ConnectionError, requests_errors.Timeout,
+                  requests_errors.ChunkedEncodingError)
+
+# Error classes
+RATE_LIMIT = 'rate_limit'
+SERVER = 'server'
+NETWORK = 'network'
+FATAL = 'fatal'
+
+
+class TokenBucket:
+    """Request rate limiter shared by every thread that talks to Drive
+
+    Besides spacing requests out, a rate-limit answer from Drive pauses
+    the whole bucket so other workers back off too instead of piling on.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, capacity=REQUEST_BURST):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` requests may be sent"""
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self.paused_until - now, (tokens - self.tokens) / self.rate)
+            time.sleep(min(wait, 1.0))
+
+    def pause(self, seconds):
+        """Hold back every caller for the given number of seconds"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def error_reason(error):
+    """Return the reason string of a Drive HttpError, e.g. 'rateLimitExceeded'"""
+    try:
+        content = error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content
+        return json.loads(content)['error']['errors'][0]['reason']
+    except Exception:
+        return ''
+
+
+def retry_after(error):
+    """Return the Retry-After delay of an HttpError in seconds, if any"""
+    value = getattr(error, 'resp', None) and error.resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class RetryPolicy:
+    """Executes Drive calls with classified retries and exponential backoff
+
+    Rate-limit answers (429, 403 rateLimitExceeded), server errors and
+    dropped connections are retried with jittered exponential backoff,
+    honouring Retry-After when Drive sends it. Anything else is raised
+    straight away. Every attempt first takes a token from the shared
+    limiter.
+    """
+
+    def __init__(self, limiter=None, max_retries=MAX_RETRIES, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY):
+        self.limiter = limiter or TokenBucket()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def classify(self, error):
+        """Sort an exception into rate_limit, server, network or fatal"""
+        if isinstance(error, HttpError):
+            status = int(error.resp.status)
+            if status == 429:
+                return RATE_LIMIT
+            if status == 403 and error_reason(error) in RATE_LIMIT_REASONS:
+                return RATE_LIMIT
+            if status in SERVER_ERROR_STATUSES or status == 408:
+                return SERVER
+            return FATAL
+        if isinstance(error, NETWORK_ERRORS):
+            return NETWORK
+        return FATAL
+
+    def backoff(self, attempt, error):
+        """Delay before the next attempt"""
+        delay = retry_after(error) if isinstance(error, HttpError) else None
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+            delay += random.uniform(0, self.base_delay)
+        return delay
+
+    def call(self, function, tokens=1, is_running=None):
+        """Call function() until it succeeds or fails with a non-retryable error
+
+        `is_running` lets a worker cut a long backoff short when it is stopped.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                return function()
+            except Exception as e:
+                kind = self.classify(e)
+                if kind == FATAL or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                if kind == RATE_LIMIT:
+                    self.limiter.pause(delay)
+                print(f"Drive {kind} error (retry {attempt + 1} in {delay:.1f}s): {e}")
+                attempt += 1
+
+                deadline = time.monotonic() + delay
+                while time.monotonic() < deadline:
+                    if is_running is not None and not is_running():
+                        raise
+                    time.sleep(max(0.0, min(0.5, deadline - time.monotonic())))
+
+    def execute(self, request, tokens=1, is_running=None):
+        """Execute a googleapiclient request under this policy"""
+        return self.call(request.execute, tokens=tokens, is_running=is_running)
+
+
+# Shared by every worker and every Drive call unless one is passed in explicitly
+default_policy = RetryPolicy()
@@ -0,0 +1,125 @@
+import threading
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from google.auth.transport.requests import AuthorizedSession
+from googleapiclient.discovery import build
+from requests.adapters import HTTPAdapter
+
+# Keep-alive connections to Google kept open per account, shared by every thread
+POOL_SIZE = 16
+
+# Seconds to wait for a connection and then for each response
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 300
+
+# 'pooled' shares one keep-alive connection pool per account across all
+# threads, 'httplib2' gives every service its own single connection
+TRANSPORT = 'pooled'
+
+
+class PooledHttp:
+    """httplib2-compatible transport backed by a keep-alive connection pool
+
+    google-api-python-client only needs request() to return an
+    (httplib2.Response, content) pair, so one AuthorizedSession can serve
+    every Drive service built for an account. Unlike httplib2.Http it is
+    safe to use from several threads at once, and each request borrows an
+    idle connection instead of opening a new TLS session.
+    """
+
+    def __init__(self, credentials, pool_size=POOL_SIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials)
+        # Retries are left to RetryPolicy. Threads beyond pool_size still get a
+        # connection, it is closed instead of kept when they are done
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        # Resumable uploads answer 308 while incomplete, which must not be followed
+        response = self.session.request(
+            method, uri, data=body, headers=headers, timeout=self.timeout,
+            allow_redirects=method == 'GET' and redirections > 0
+        )
+        info = dict(response.headers)
+        info['status'] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def stats(self):
+        """Requests sent and connections opened, over every host in the pool"""
+        requests = connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                requests += pool.num_requests
+                connections += pool.num_connections
+        return {'requests': requests, 'connections': connections,
+                'reused': max(requests - connections, 0)}
+
+    def close(self):
+        self.session.close()
+
+
+_lock = threading.Lock()
+_pooled = {}  # id(credentials) -> PooledHttp
+
+
+def drive_transport(credentials, kind=None, pool_size=None):
+    """HTTP transport for Drive services of credentials, pooled ones are shared"""
+    if (kind or TRANSPORT) == 'httplib2':
+        return AuthorizedHttp(credentials, http=httplib2.Http())
+    with _lock:
+        transport = _pooled.get(id(credentials))
+        if transport is None or transport.credentials is not credentials:
+            transport = _pooled[id(credentials)] = PooledHttp(credentials, pool_size or POOL_SIZE)
+        return transport
+
+
+def transport_stats():
+    """Requests sent, connections opened and connections reused by every pooled transport"""
+    totals = {'requests': 0, 'connections': 0, 'reused': 0}
+    with _lock:
+        transports = list(_pooled.values())
+    for transport in transports:
+        for name, value in transport.stats().items():
+            totals[name] += value
+    return totals
+
+
+def build_drive_service(credentials, transport=None):
+    """Build a Drive service, on the shared connection pool unless a transport is given"""
+    http = transport or drive_transport(credentials)
+    return build('drive', 'v3', http=http, cache_discovery=False)
+
+
+def service_credentials(drive_service):
+    """Return the credentials an existing Drive service was built with, if any"""
+    return getattr(getattr(drive_service, '_http', None), 'credentials', None)
+
+
+class ThreadLocalDrive:
+    """Hands every thread its own Drive service
+
+    Service objects are cheap and keep per-request state, so upload
+    workers never share the one used by the GUI. With the pooled
+    transport they still share its connections.
+    """
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.local = threading.local()
+
+    def get(self):
+        service = getattr(self.local, 'service', None)
+        if service is None:
+            service = build_drive_service(self.credentials)
+            self.local.service = service
+        return service
@@ -0,0 +1,191 @@
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import tempfile
+import zlib
+
+from drive_retry import default_policy
+
+# Files smaller than this are packed when packing is enabled
+PACK_THRESHOLD = 4 * 1024
+
+# A directory needs this many small files before they are packed instead of uploaded one by one
+PACK_MIN_FILES = 8
+
+# The small files of a directory are split by name into packs of about this size,
+# so a changed file only repacks its share of the directory
+PACK_TARGET_SIZE = 16 * 1024 * 1024
+
+# A pack is built in memory up to this size and spills to a temporary file beyond
+PACK_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Large packs are uploaded in resumable chunks of at most this size
+PACK_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Packs and manifests are stored in the Drive folder of the directory they pack
+PACK_PREFIX = '.gdrive-pack-'
+PACK_MIME_TYPE = 'application/x-tar'
+MANIFEST_MIME_TYPE = 'application/json'
+MANIFEST_VERSION = 1
+
+
+def pack_name(bucket):
+    return f"{PACK_PREFIX}{bucket:03d}.tar"
+
+
+def manifest_name(bucket):
+    return f"{PACK_PREFIX}{bucket:03d}.json"
+
+
+def bucket_count(total_size):
+    """Number of packs for a directory holding total_size bytes of small files
+
+    A power of two, so a growing directory is only split again each time
+    it doubles.
+    """
+    buckets = 1
+    while total_size > buckets * PACK_TARGET_SIZE:
+        buckets *= 2
+    return buckets
+
+
+def pack_bucket(name, buckets):
+    """Pack a file name belongs to, stable across runs and platforms"""
+    return zlib.crc32(name.encode('utf-8')) % buckets
+
+
+class PackStat:
+    """Size and newest mtime of a pack, so the scheduler can order it like a file"""
+
+    __slots__ = ('st_size', 'st_mtime_ns')
+
+    def __init__(self, stat_results):
+        self.st_size = sum(stat_result.st_size for stat_result in stat_results)
+        self.st_mtime_ns = max((stat_result.st_mtime_ns for stat_result in stat_results), default=0)
+
+
+def build_pack(members, spool_size=PACK_SPOOL_SIZE):
+    """Write (name, path, stat_result) members into a tar archive
+
+    Returns (archive, size, entries). The archive is a file object at
+    position 0 that the caller closes; it is built one member at a time
+    and spills to disk past spool_size, so memory stays bounded however
+    large the directory. entries maps each packed name to its data offset,
+    size, mtime and MD5 for the manifest. Members that can no longer be
+    read are left out.
+    """
+    archive = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    entries = {}
+    try:
+        with tarfile.open(fileobj=archive, mode='w', format=tarfile.PAX_FORMAT) as tar:
+            for name, path, stat_result in members:
+                try:
+                    with open(path, 'rb') as f:
+                        # A file that grew since the scan is packed as it was, its new mtime repacks it
+                        data = f.read(stat_result.st_size)
+                except OSError:
+                    # Deleted or renamed since the scan
+                    continue
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = stat_result.st_mtime
+                info.mode = stat.S_IMODE(stat_result.st_mode)
+                tar.addfile(info, io.BytesIO(data))
+                # The data ends on the block boundary the archive has reached
+                blocks = -(-len(data) // tarfile.BLOCKSIZE)
+                entries[name] = {
+                    'offset': tar.offset - blocks * tarfile.BLOCKSIZE,
+                    'size': len(data),
+                    'mtime_ns': stat_result.st_mtime_ns,
+                    'md5': hashlib.md5(data).hexdigest(),
+                }
+        size = archive.tell()
+        archive.seek(0)
+    except BaseException:
+        archive.close()
+        raise
+    return archive, size, entries
+
+
+def pack_manifest(bucket, buckets, entries):
+    """Manifest uploaded next to a pack, enough to restore any member on its own"""
+    return {
+        'version': MANIFEST_VERSION,
+        'pack': pack_name(bucket),
+        'bucket': bucket,
+        'buckets': buckets,
+        'members': entries,
+    }
+
+
+class PackRestorer:
+    """Restores single files from the packs of a Drive folder
+
+    Only the manifests and the byte range of the wanted member are
+    downloaded, never the whole pack.
+    """
+
+    def __init__(self, drive_service, folder_id, retry_policy=None):
+        self.drive_service = drive_service
+        self.folder_id = folder_id
+        self.retry_policy = retry_policy or default_policy
+        self.manifests = {}  # bucket -> manifest
+
+    def find(self, name):
+        """Drive ID of a file in the folder, or None"""
+        escaped = name.replace('\\', '\\\\').replace("'", "\\'")
+        results = self.retry_policy.execute(self.drive_service.files().list(
+            q=f"'{self.folder_id}' in parents and name='{escaped}' and trashed=false",
+            spaces='drive',
+            fields='files(id)',
+            # A pack uploaded by a run that failed before recording it may linger, take the latest
+            orderBy='modifiedTime desc',
+            pageSize=1
+        ))
+        files = results.get('files', [])
+        return files[0]['id'] if files else None
+
+    def download(self, file_id, start=None, end=None):
+        """Content of a Drive file, or of the bytes start to end inclusive"""
+        request = self.drive_service.files().get_media(fileId=file_id)
+        if start is not None:
+            request.headers['Range'] = f"bytes={start}-{end}"
+        return self.retry_policy.execute(request)
+
+    def manifest(self, bucket):
+        if bucket not in self.manifests:
+            manifest_id = self.find(manifest_name(bucket))
+            if manifest_id is None:
+                raise Exception(f"No packed files in Drive folder {self.folder_id}")
+            self.manifests[bucket] = json.loads(self.download(manifest_id))
+        return self.manifests[bucket]
+
+    def entry(self, name):
+        """(pack file ID, manifest entry) of a packed file"""
+        # The first manifest always exists and tells how the directory is split
+        manifest = self.manifest(0)
+        manifest = self.manifest(pack_bucket(name, manifest['buckets']))
+        entry = manifest['members'].get(name)
+        if entry is None:
+            raise Exception(f"{name} is not packed in Drive folder {self.folder_id}")
+        pack_id = self.find(manifest['pack'])
+        if pack_id is None:
+            raise Exception(f"{manifest['pack']} is missing from Drive folder {self.folder_id}")
+        return pack_id, entry
+
+    def restore(self, name, destination):
+        """Write the packed file `name` to destination, returning its size"""
+        pack_id, entry = self.entry(name)
+        data = b''
+        if entry['size']:
+            data = self.download(pack_id, entry['offset'], entry['offset'] + entry['size'] - 1)
+        if hashlib.md5(data).hexdigest() != entry['md5']:
+            # The pack was replaced between reading the manifest and the pack
+            raise Exception(f"{name} does not match its manifest, the pack changed, try again")
+        with open(destination, 'wb') as f:
+            f.write(data)
+        os.utime(destination, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        return len(data)
@@ -0,0 +1,288 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+import time
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# A file must be quiet this long before it is queued for upload
+DEBOUNCE_SECONDS = 0.5
+
+# Files that never stop changing are still queued after this long
+MAX_DELAY_SECONDS = 10.0
+
+# How often pending events are checked
+DISPATCH_INTERVAL = 0.1
+
+# Pause between noticing events and reading them
+READ_DELAY = 0.05
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class EventCoalescer:
+    """Collapses bursts of events on the same file into one work item"""
+
+    def __init__(self, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> [root, first event, last event]
+        self.events_seen = 0
+
+    def add(self, root, path):
+        now = time.monotonic()
+        with self.lock:
+            self.events_seen += 1
+            entry = self.pending.get(path)
+            if entry is None:
+                self.pending[path] = [root, now, now]
+            else:
+                entry[2] = now
+
+    def pop_ready(self):
+        """Remove and return (root, path) for every file that has settled"""
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for path, (root, first, last) in list(self.pending.items()):
+                if now - last >= self.debounce or now - first >= self.max_delay:
+                    ready.append((root, path))
+                    del self.pending[path]
+        return ready
+
+
+class InotifyBackend:
+    """Recursive directory watching with Linux inotify"""
+
+    def __init__(self, on_event, on_error, on_root_lost=None):
+        self.on_event = on_event
+        self.on_error = on_error
+        self.on_root_lost = on_root_lost or (lambda root, reason: None)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.lock = threading.Lock()
+        self.watches = {}  # watch descriptor -> (root, directory)
+        self.wake_read, self.wake_write = os.pipe()
+        self.running = True
+        self.thread = threading.Thread(target=self.read_events, daemon=True)
+        self.thread.start()
+
+    def add_tree(self, root, top, report_files=False):
+        """Watch top and every directory below it"""
+        for dir_path, dirs, files in os.walk(top):
+            self.add_watch(root, dir_path)
+            if report_files:
+                # Files created before the watch existed would be missed otherwise
+                for name in files:
+                    self.on_event(root, os.path.join(dir_path, name))
+
+    def add_watch(self, root, dir_path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            self.on_error(f"Cannot watch {dir_path}: {os.strerror(err)}")
+            return
+        with self.lock:
+            self.watches[wd] = (root, dir_path)
+
+    def remove_root(self, root):
+        with self.lock:
+            for wd, (watch_root, _) in list(self.watches.items()):
+                if watch_root == root:
+                    self.libc.inotify_rm_watch(self.fd, wd)
+                    del self.watches[wd]
+
+    def read_events(self):
+        while self.running:
+            readable, _, _ = select.select([self.fd, self.wake_read], [], [])
+            if self.wake_read in readable or not self.running:
+                break
+            # Let a burst pile up so it is read in one go instead of waking per event
+            time.sleep(READ_DELAY)
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                self.on_error(f"Error reading file events: {e}")
+                continue
+            self.handle(data)
+
+    def handle(self, data):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                self.on_error("File event queue overflowed, run Sync Now to catch up")
+                continue
+
+            with self.lock:
+                watch = self.watches.get(wd)
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+            if watch is None:
+                continue
+
+            root, dir_path = watch
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # A moved sub-directory keeps its watch, it is re-added under its new path
+                if dir_path == root:
+                    self.on_root_lost(root, "removed" if mask & IN_DELETE_SELF else "moved or renamed")
+                continue
+            if not name:
+                continue
+
+            path = os.path.join(dir_path, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(root, path, report_files=True)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.on_event(root, path)
+
+    def close(self):
+        self.running = False
+        os.write(self.wake_write, b'x')
+        self.thread.join()
+        os.close(self.fd)
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+
+class WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, root, on_event):
+        super().__init__()
+        self.root = root
+        self.on_event = on_event
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.on_event(self.root, event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.on_event(self.root, event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.on_event(self.root, event.dest_path)
+
+
+class WatchdogBackend:
+    """Directory watching through the optional watchdog package (Windows, macOS)"""
+
+    def __init__(self, on_event, on_error, on_root_lost=None):
+        self.on_event = on_event
+        self.on_error = on_error
+        self.observer = Observer()
+        self.watches = {}
+        self.observer.start()
+
+    def add_tree(self, root, top, report_files=False):
+        self.watches[root] = self.observer.schedule(
+            WatchdogHandler(root, self.on_event), top, recursive=True)
+
+    def remove_root(self, root):
+        watch = self.watches.pop(root, None)
+        if watch is not None:
+            self.observer.unschedule(watch)
+
+    def close(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+class FileWatcher:
+    """Watches backup roots and reports settled file changes in batches
+
+    on_changes receives a list of (root, path) tuples from a background
+    thread. Each file appears once per batch no matter how many events
+    it produced while it was being written. A root that is removed or
+    renamed is no longer watched, on_error and on_root_lost(root) are
+    called from the background thread when that happens.
+    """
+
+    def __init__(self, on_changes, on_error=print, debounce=DEBOUNCE_SECONDS,
+                 max_delay=MAX_DELAY_SECONDS, on_root_lost=None):
+        self.on_changes = on_changes
+        self.on_error = on_error
+        self.on_root_lost = on_root_lost or (lambda root: None)
+        self.watched_paths = set()
+        self.coalescer = EventCoalescer(debounce, max_delay)
+
+        if sys.platform.startswith('linux'):
+            self.backend = InotifyBackend(self.coalescer.add, on_error, self.root_lost)
+        elif Observer is not None:
+            self.backend = WatchdogBackend(self.coalescer.add, on_error, self.root_lost)
+        else:
+            raise RuntimeError("Real-time sync needs the 'watchdog' package on this platform")
+
+        self.running = True
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def start_watching(self, path):
+        """Start watching a backup root and everything below it"""
+        path = os.path.abspath(path)
+        if path in self.watched_paths:
+            return
+        self.watched_paths.add(path)
+        self.backend.add_tree(path, path)
+
+    def stop_watching(self, path):
+        """Stop watching a backup root"""
+        path = os.path.abspath(path)
+        self.watched_paths.discard(path)
+        self.backend.remove_root(path)
+
+    def root_lost(self, root, reason):
+        """Stop watching a root that was removed or renamed and say so"""
+        if root not in self.watched_paths:
+            return
+        self.stop_watching(root)
+        self.on_error(f"Backup folder {root} was {reason}, real-time sync stopped watching it")
+        self.on_root_lost(root)
+
+    def dispatch(self):
+        while self.running:
+            time.sleep(DISPATCH_INTERVAL)
+            ready = [(root, path) for root, path in self.coalescer.pop_ready()
+                     if root in self.watched_paths]
+            if ready:
+                try:
+                    self.on_changes(ready)
+                except Exception as e:
+                    self.on_error(f"Error queueing changes: {e}")
+
+    def close(self):
+        """Stop watching everything"""
+        for path in list(self.watched_paths):
+            self.stop_watching(path)
+        self.running = False
+        self.dispatcher.join()
+        self.backend.close()
@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import threading
+
+from sync_index import INDEX_FILE
+from drive_batch import DriveBatcher
+from drive_retry import default_policy
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+class FolderCache:
+    """Maps local relative directory paths to Google Drive folder IDs
+
+    One cache is shared by every SyncWorker started by a sync, and its
+    contents are persisted in the sync index database so later runs can
+    resolve known folders without talking to Drive at all. Folders found
+    deleted or trashed on Drive are dropped with invalidate() and created
+    again when a file needs them.
+    """
+
+    def __init__(self, db_path=INDEX_FILE, retry_policy=None):
+        self.db_path = db_path
+        self.retry_policy = retry_policy or default_policy
+        self.lock = threading.RLock()
+        self.folders = {}  # (destination, relative path) -> folder ID
+        self.dirty = set()
+        self.stale = set()  # Keys dropped by invalidate(), deleted from disk on save()
+        self.seeded = set()
+        self.lookups_saved = 0
+        self.folders_created = 0
+        self.created = set()  # IDs of folders created by this process
+
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS folders (
+                    destination TEXT NOT NULL,
+                    rel_path TEXT NOT NULL,
+                    folder_id TEXT NOT NULL,
+                    PRIMARY KEY (destination, rel_path)
+                )
+            """)
+            for destination, rel_path, folder_id in conn.execute(
+                    "SELECT destination, rel_path, folder_id FROM folders"):
+                self.folders[(destination, rel_path)] = folder_id
+            conn.commit()
+        finally:
+            conn.close()
+
+    def seed(self, drive_service, destination):
+        """Load every folder below destination with one paged listing"""
+        children = {}
+        page_token = None
+        while True:
+            results = self.retry_policy.execute(drive_service.files().list(
+                q=f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
+                spaces='drive',
+                fields='nextPageToken, files(id, name, parents)',
+                pageSize=1000,
+                pageToken=page_token
+            ))
+            for folder in results.get('files', []):
+                for parent in folder.get('parents', []):
+                    children.setdefault(parent, []).append(folder)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        # Walk down from the destination, building relative paths
+        pending = [(destination, '')]
+        while pending:
+            parent_id, parent_path = pending.pop()
+            for folder in children.get(parent_id, []):
+                rel_path = f"{parent_path}/{folder['name']}" if parent_path else folder['name']
+                key = (destination, rel_path)
+                if key not in self.folders:
+                    self.folders[key] = folder['id']
+                    self.dirty.add(key)
+                pending.append((folder['id'], rel_path))
+
+        self.seeded.add(destination)
+
+    def resolve(self, drive_service, destination, relative_path):
+        """Return the folder ID for relative_path, creating missing folders"""
+        if relative_path in ('.', ''):
+            return destination
+
+        with self.lock:
+            current_parent = destination
+            current_path = ''
+
+            for folder_name in relative_path.split(os.sep):
+                if not folder_name:
+                    continue
+
+                current_path = f"{current_path}/{folder_name}" if current_path else folder_name
+                key = (destination, current_path)
+
+                if key in self.folders:
+                    # Each hit replaces the files().list query of an uncached lookup
+                    self.lookups_saved += 1
+                    current_parent = self.folders[key]
+                    continue
+
+                # Unknown folder, it may still exist remotely
+                if destination not in self.seeded:
+                    self.seed(drive_service, destination)
+                    if key in self.folders:
+                        current_parent = self.folders[key]
+                        continue
+
+                folder_metadata = {
+                    'name': folder_name,
+                    'mimeType': FOLDER_MIME_TYPE,
+                    'parents': [current_parent]
+                }
+                folder = self.retry_policy.execute(drive_service.files().create(
+                    body=folder_metadata,
+                    fields='id'
+                ))
+                current_parent = folder['id']
+                self.folders[key] = current_parent
+                self.dirty.add(key)
+                self.folders_created += 1
+                self.created.add(current_parent)
+
+            return current_parent
+
+    def resolve_many(self, drive_service, destination, relative_paths):
+        """Resolve several folders at once, creating missing ones in batch requests"""
+        with self.lock:
+            missing = set()
+            for relative_path in relative_paths:
+                parts = [part for part in relative_path.split(os.sep) if part and part != '.']
+                for depth in range(1, len(parts) + 1):
+                    key = (destination, '/'.join(parts[:depth]))
+                    if key in self.folders:
+                        self.lookups_saved += 1
+                    else:
+                        missing.add(key[1])
+
+            if missing and destination not in self.seeded:
+                self.seed(drive_service, destination)
+                missing = {path for path in missing if (destination, path) not in self.folders}
+
+            # Create one level at a time so every parent exists before its children
+            for depth in sorted({path.count('/') for path in missing}):
+                batcher = DriveBatcher(drive_service, retry_policy=self.retry_policy)
+                for path in sorted(path for path in missing if path.count('/') == depth):
+                    parent_path, _, folder_name = path.rpartition('/')
+                    parent_id = self.folders.get((destination, parent_path)) if parent_path else destination
+                    if parent_id is None:
+                        continue
+                    folder_metadata = {
+                        'name': folder_name,
+                        'mimeType': FOLDER_MIME_TYPE,
+                        'parents': [parent_id]
+                    }
+                    request = drive_service.files().create(body=folder_metadata, fields='id')
+                    batcher.add(request, callback=lambda response, exception, path=path:
+                                self.folder_created(destination, path, response, exception),
+                                lookup=lambda parent_id=parent_id, folder_name=folder_name:
+                                self.find(drive_service, parent_id, folder_name))
+                batcher.flush()
+
+    def find(self, drive_service, parent_id, folder_name):
+        """The folder named folder_name in parent_id as {'id': ...}, or None"""
+        escaped = folder_name.replace('\\', '\\\\').replace("'", "\\'")
+        results = self.retry_policy.execute(drive_service.files().list(
+            q=f"'{parent_id}' in parents and name='{escaped}' and "
+              f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
+            spaces='drive',
+            fields='files(id)',
+            pageSize=1
+        ))
+        files = results.get('files', [])
+        return {'id': files[0]['id']} if files else None
+
+    def folder_created(self, destination, path, response, exception):
+        """Record the result of a batched folder creation"""
+        if exception is not None:
+            # Left uncached, resolve() will retry and report the error
+            print(f"Error creating folder {path}: {exception}")
+            return
+        key = (destination, path)
+        self.folders[key] = response['id']
+        self.dirty.add(key)
+        self.folders_created += 1
+        self.created.add(response['id'])
+
+    def invalidate(self, folder_ids):
+        """Forget folders deleted or trashed on Drive and every folder below them
+
+        Returns the number of cached folders dropped.
+        """
+        folder_ids = set(folder_ids)
+        if not folder_ids:
+            return 0
+        with self.lock:
+            gone = [key for key, folder_id in self.folders.items() if folder_id in folder_ids]
+            stale = set(gone)
+            for destination, rel_path in gone:
+                prefix = rel_path + '/'
+                stale.update(key for key in self.folders
+                             if key[0] == destination and key[1].startswith(prefix))
+            for key in stale:
+                del self.folders[key]
+                self.dirty.discard(key)
+            self.stale |= stale
+            return len(stale)
+
+    def save(self):
+        """Persist newly learned folders to disk"""
+        with self.lock:
+            if not self.dirty and not self.stale:
+                return
+            rows = [(destination, rel_path, self.folders[(destination, rel_path)])
+                    for destination, rel_path in self.dirty]
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.executemany(
+                    "DELETE FROM folders WHERE destination=? AND rel_path=?",
+                    list(self.stale)
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO folders (destination, rel_path, folder_id) "
+                    "VALUES (?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            self.dirty.clear()
+            self.stale.clear()
@@ -0,0 +1,152 @@
+from bisect import bisect_left, bisect_right
+
+# Results returned by one search
+SEARCH_LIMIT = 200
+
+# Joins names and paths in the search text, cannot appear in a query
+SEPARATOR = '\n'
+
+
+class FolderSearchIndex:
+    """In-memory search over Google Drive folder names and paths
+
+    Names are kept in a sorted list for prefix lookups. For substring
+    lookups all lowercase names, and all lowercase paths, are joined into
+    one string each, so a search is a handful of str.find calls that jump
+    from match to match instead of a Python loop over every folder. A
+    query containing '/' is matched against the full folder paths.
+    """
+
+    def __init__(self):
+        self.entries = []       # (folder ID, name, path)
+        self.sorted_names = []  # (lowercase name, entry number)
+        self.children = {}      # parent ID -> entry numbers
+        self.ids = {}           # folder ID -> entry number
+        self.removed = set()
+        self.name_text = ''
+        self.name_starts = []
+        self.path_text = ''
+        self.path_starts = []
+
+    def __len__(self):
+        return len(self.entries) - len(self.removed)
+
+    def build(self, folders):
+        """Index folder resources with id, name and parents"""
+        by_id = {folder['id']: folder for folder in folders}
+        paths = {}
+
+        def folder_path(folder_id):
+            # Iterative so deep trees do not hit the recursion limit
+            chain = []
+            while folder_id in by_id and folder_id not in paths:
+                chain.append(folder_id)
+                parents = by_id[folder_id].get('parents') or [None]
+                folder_id = parents[0]
+            prefix = paths.get(folder_id, '')
+            for current in reversed(chain):
+                name = by_id[current]['name']
+                prefix = f"{prefix}/{name}" if prefix else name
+                paths[current] = prefix
+            return paths[chain[0]] if chain else prefix
+
+        names = []
+        path_list = []
+        for folder in folders:
+            parents = folder.get('parents') or [None]
+            # Folders whose parent is not a known folder sit at the top level
+            parent_id = parents[0] if parents[0] in by_id else None
+            path = folder_path(folder['id'])
+            number = self.add_entry(folder['id'], folder['name'], path, parent_id)
+            self.sorted_names.append((folder['name'].lower(), number))
+            names.append(self.searchable(folder['name']))
+            path_list.append(self.searchable(path))
+        self.sorted_names.sort()
+
+        self.name_starts, self.name_text = self.join(names)
+        self.path_starts, self.path_text = self.join(path_list)
+
+    def add(self, folder_id, name, path, parent_id=None):
+        """Add one folder, e.g. after it was created"""
+        number = self.add_entry(folder_id, name, path, parent_id)
+        lower_name = name.lower()
+        self.sorted_names.insert(bisect_left(self.sorted_names, (lower_name, number)),
+                                 (lower_name, number))
+        self.name_starts.append(len(self.name_text))
+        self.name_text += self.searchable(name) + SEPARATOR
+        self.path_starts.append(len(self.path_text))
+        self.path_text += self.searchable(path) + SEPARATOR
+
+    def discard(self, folder_id):
+        """Hide a deleted folder from results"""
+        number = self.ids.get(folder_id)
+        if number is not None:
+            self.removed.add(number)
+
+    def path(self, folder_id):
+        number = self.ids.get(folder_id)
+        return self.entries[number][2] if number is not None else None
+
+    def add_entry(self, folder_id, name, path, parent_id):
+        number = len(self.entries)
+        self.entries.append((folder_id, name, path))
+        self.ids[folder_id] = number
+        self.children.setdefault(parent_id, []).append(number)
+        return number
+
+    def searchable(self, text):
+        return text.lower().replace(SEPARATOR, ' ')
+
+    def join(self, texts):
+        """Return (start offset of each text, joined text)"""
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + 1
+        return starts, ''.join(text + SEPARATOR for text in texts)
+
+    def subfolders(self, parent_id=None):
+        """Return (folder ID, name) of the direct children of parent_id"""
+        return [self.entries[number][:2] for number in self.children.get(parent_id, [])
+                if number not in self.removed]
+
+    def has_subfolders(self, folder_id):
+        return any(number not in self.removed for number in self.children.get(folder_id, []))
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Return (folder ID, name, path) of matching folders, prefix matches first"""
+        query = self.searchable(query.strip())
+        if not query:
+            return []
+
+        results = []
+        seen = set(self.removed)
+
+        def accept(number):
+            if number not in seen:
+                seen.add(number)
+                results.append(self.entries[number])
+
+        if '/' in query:
+            text, starts = self.path_text, self.path_starts
+        else:
+            text, starts = self.name_text, self.name_starts
+
+            # Names starting with the query
+            position = bisect_left(self.sorted_names, (query,))
+            while position < len(self.sorted_names) and len(results) < limit:
+                lower_name, number = self.sorted_names[position]
+                if not lower_name.startswith(query):
+                    break
+                accept(number)
+                position += 1
+
+        # Names or paths containing the query, str.find skips straight to the next match
+        position = text.find(query)
+        while position != -1 and len(results) < limit:
+            accept(bisect_right(starts, position) - 1)
+            # Continue after this entry, one match per folder is enough
+            position = text.find(query, text.index(SEPARATOR, position) + 1)
+
+        return results
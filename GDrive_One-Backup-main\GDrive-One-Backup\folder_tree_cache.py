@@ -0,0 +1,228 @@
+import sqlite3
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from sync_index import INDEX_FILE
+from drive_retry import default_policy
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Listings older than this are fetched again even if no change was reported
+BROWSE_CACHE_TTL = 24 * 3600
+
+
+class FolderTreeCache:
+    """Drive folder hierarchy shown by the Browse Google Drive dialog
+
+    Every folder listing the dialog fetches is kept in the sync index
+    database, so the tree can be drawn from disk as soon as the dialog
+    opens. A Changes API page token tells which listings went stale
+    since the last visit; listings older than ttl are treated as stale
+    regardless. The cache holds one Google account at a time and is
+    emptied by set_account() when another one logs in.
+    """
+
+    def __init__(self, db_path=INDEX_FILE, ttl=BROWSE_CACHE_TTL, retry_policy=None):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.retry_policy = retry_policy or default_policy
+        self.lock = threading.RLock()
+        self.validated = False
+
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS browse_folders (
+                    parent_id TEXT NOT NULL,
+                    folder_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    PRIMARY KEY (parent_id, folder_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS browse_folders_id ON browse_folders (folder_id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS browse_listings (
+                    parent_id TEXT PRIMARY KEY,
+                    listed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS browse_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def set_account(self, account):
+        """Empty the cache unless it belongs to account, None if the account is unknown
+
+        Returns True if the cache was emptied.
+        """
+        with self.lock:
+            if account is not None and self.get_state('account') == account:
+                return False
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("DELETE FROM browse_folders")
+                conn.execute("DELETE FROM browse_listings")
+                # The root ID and page token belong to the previous account too
+                conn.execute("DELETE FROM browse_state")
+                conn.commit()
+            finally:
+                conn.close()
+            if account is not None:
+                self.set_state('account', account)
+            self.validated = False
+            return True
+
+    def load(self):
+        """Every cached listing as {parent ID: [folder, ...]} in Drive's name order"""
+        listings = {}
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            for (parent_id,) in conn.execute("SELECT parent_id FROM browse_listings"):
+                listings[parent_id] = []
+            for parent_id, folder_id, name in conn.execute(
+                    "SELECT parent_id, folder_id, name FROM browse_folders ORDER BY parent_id, position"):
+                if parent_id in listings:
+                    listings[parent_id].append({'id': folder_id, 'name': name})
+        finally:
+            conn.close()
+        return listings
+
+    def is_fresh(self, parent_id):
+        """True if the cached listing of parent_id can be shown without asking Drive"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            row = conn.execute(
+                "SELECT listed_at FROM browse_listings WHERE parent_id=?", (parent_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def store(self, parent_id, folders):
+        """Replace the cached listing of parent_id"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("DELETE FROM browse_folders WHERE parent_id=?", (parent_id,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO browse_folders (parent_id, folder_id, name, position) "
+                "VALUES (?, ?, ?, ?)",
+                [(parent_id, folder['id'], folder['name'], position)
+                 for position, folder in enumerate(folders)]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO browse_listings (parent_id, listed_at) VALUES (?, ?)",
+                (parent_id, time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def validate(self, drive_service):
+        """Expire the listings touched by Drive changes since the last visit, once per session
+
+        Returns the set of parent IDs whose listings went stale.
+        """
+        with self.lock:
+            if self.validated:
+                return set()
+
+            root_id = self.get_state('root_id')
+            if root_id is None:
+                root_id = self.retry_policy.execute(
+                    drive_service.files().get(fileId='root', fields='id'))['id']
+                self.set_state('root_id', root_id)
+
+            page_token = self.get_state('page_token')
+            stale = set()
+            if page_token is not None:
+                try:
+                    page_token = self.collect_changes(drive_service, page_token, root_id, stale)
+                except HttpError as e:
+                    if e.resp.status not in (400, 404, 410):
+                        raise
+                    print(f"Folder tree cache token rejected: {e}")
+                    page_token = None
+
+            if page_token is None:
+                # Without a usable token nothing cached can be trusted
+                page_token = self.retry_policy.execute(
+                    drive_service.changes().getStartPageToken())['startPageToken']
+                stale = self.expire()
+            else:
+                self.expire(stale)
+
+            self.set_state('page_token', page_token)
+            self.validated = True
+            return stale
+
+    def collect_changes(self, drive_service, page_token, root_id, stale):
+        """Add the parents of every folder changed since page_token to stale"""
+        while True:
+            results = self.retry_policy.execute(drive_service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                pageSize=1000,
+                fields='nextPageToken, newStartPageToken, '
+                       'changes(fileId, removed, file(id, name, mimeType, parents, trashed))'
+            ))
+            for change in results.get('changes', []):
+                resource = change.get('file')
+                if resource and resource.get('mimeType') != FOLDER_MIME_TYPE:
+                    continue
+                # The old location comes from the cache, the new one from Drive
+                stale.update(self.parents_of(change['fileId']))
+                if resource and not change.get('removed') and not resource.get('trashed'):
+                    stale.update('root' if parent == root_id else parent
+                                 for parent in resource.get('parents', []))
+            if 'newStartPageToken' in results:
+                return results['newStartPageToken']
+            page_token = results['nextPageToken']
+
+    def parents_of(self, folder_id):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            return [parent_id for (parent_id,) in conn.execute(
+                "SELECT parent_id FROM browse_folders WHERE folder_id=?", (folder_id,))]
+        finally:
+            conn.close()
+
+    def expire(self, parent_ids=None):
+        """Mark listings stale, all of them if parent_ids is None, and return their IDs"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            if parent_ids is None:
+                parent_ids = {parent_id for (parent_id,) in conn.execute(
+                    "SELECT parent_id FROM browse_listings")}
+            conn.executemany(
+                "UPDATE browse_listings SET listed_at=0 WHERE parent_id=?",
+                [(parent_id,) for parent_id in parent_ids]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return set(parent_ids)
+
+    def get_state(self, key):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            row = conn.execute("SELECT value FROM browse_state WHERE key=?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("INSERT OR REPLACE INTO browse_state (key, value) VALUES (?, ?)", (key, value))
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,263 @@
+import argparse
+import contextlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+
+from sync_scheduler import POLICIES, DEFAULT_POLICY, SCHEDULER_WORKERS
+from bandwidth import BANDWIDTH_FILE, MB, load_bandwidth
+from file_packer import PACK_THRESHOLD
+from scan_rules import CONFIG_FILE, folder_settings
+# Credentials saved by the GUI after logging in
+TOKEN_FILE = 'token.pickle'
+
+EXIT_OK = 0
+EXIT_ERRORS = 1  # The sync ran but some files could not be synced
+EXIT_SETUP = 2   # Nothing was synced, the config or credentials are unusable
+
+
+class Reporter:
+    """Writes sync events to stdout as text lines or as one JSON object per line"""
+
+    def __init__(self, json_output=False):
+        self.json_output = json_output
+        # Kept so events still reach stdout while library output is sent to stderr
+        self.stream = sys.stdout
+        self.lock = threading.Lock()
+        self.errors = 0
+
+    def emit(self, event, message, **fields):
+        with self.lock:
+            if self.json_output:
+                record = {'event': event, 'time': round(time.time(), 3), 'message': message}
+                record.update(fields)
+                print(json.dumps(record), file=self.stream, flush=True)
+            elif event == 'progress':
+                print(f"[{fields['percent']:3d}%] {message}", file=self.stream, flush=True)
+            elif event == 'error':
+                print(f"Error: {message}", file=sys.stderr, flush=True)
+            else:
+                print(message, file=self.stream, flush=True)
+
+    def progress(self, message, percent):
+        self.emit('progress', message, percent=percent)
+
+    def error(self, message):
+        self.errors += 1
+        self.emit('error', message)
+
+
+def load_config(config_path):
+    """Folders to back up as {local folder: Drive folder ID, None or an object with rules}"""
+    if not os.path.exists(config_path):
+        raise Exception(f"Config file not found: {config_path}")
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def load_credentials(token_path):
+    """Credentials saved by the GUI, refreshed and saved again if they expired"""
+    if not os.path.exists(token_path):
+        raise Exception(f"{token_path} not found, log in once with the GUI first")
+    with open(token_path, 'rb') as token:
+        credentials = pickle.load(token)
+
+    if not credentials.valid:
+        if not (credentials.expired and credentials.refresh_token):
+            raise Exception(f"Credentials in {token_path} are not usable, log in again with the GUI")
+        from google.auth.transport.requests import Request
+        credentials.refresh(Request())
+        with open(token_path, 'wb') as token:
+            pickle.dump(credentials, token)
+    return credentials
+
+
+def library_output(json_output):
+    """Sends what the sync modules print to stderr in JSON mode, stdout stays one JSON object per line"""
+    return contextlib.redirect_stdout(sys.stderr) if json_output else contextlib.nullcontext()
+
+
+def run_engines(engines):
+    """Run engines side by side on worker threads so Ctrl+C stops them cleanly
+
+    Returns False if interrupted.
+    """
+    threads = [threading.Thread(target=engine.run, daemon=True) for engine in engines]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        for engine in engines:
+            engine.stop()
+        for thread in threads:
+            thread.join()
+        return False
+    return True
+
+
+def run(args):
+    """Sync every folder in the config, returns the exit code"""
+    reporter = Reporter(args.json)
+    with library_output(args.json):
+        return sync_folders(args, reporter)
+
+
+def sync_folders(args, reporter):
+    """Body of run, events go to reporter"""
+    try:
+        folders = load_config(args.config)
+        credentials = load_credentials(args.token)
+        bandwidth = load_bandwidth(args.bandwidth)
+        settings = [(folder,) + folder_settings(value) for folder, value in folders.items()]
+    except Exception as e:
+        reporter.error(str(e))
+        return EXIT_SETUP
+
+    jobs = [(folder, destination or args.destination, rules) for folder, destination, rules in settings]
+    if not jobs:
+        reporter.error(f"No folders to back up in {args.config}")
+        return EXIT_SETUP
+    missing = [folder for folder, destination, rules in jobs if not destination]
+    if missing:
+        reporter.error(f"No Google Drive destination for {', '.join(missing)}, pass --destination")
+        return EXIT_SETUP
+    if args.limit is not None:
+        bandwidth.set_override(int(args.limit * MB))
+
+    # Imported here so the setup checks above answer instantly
+    from sync_index import HashCache, ContentIndex
+    from folder_cache import FolderCache
+    from remote_index import RemoteIndex
+    import drive_transport
+    from sync_progress import ProgressAggregator
+    from sync_engine import SyncEngine
+    from sync_scheduler import SyncScheduler
+
+    if args.pool_size:
+        drive_transport.POOL_SIZE = args.pool_size
+    drive_service = drive_transport.build_drive_service(credentials)
+    # Shared by every folder like a GUI sync, all folders upload through one scheduler
+    folder_cache = FolderCache()
+    aggregator = ProgressAggregator(bandwidth=bandwidth)
+    hash_cache = HashCache()
+    content_index = ContentIndex()
+    remote_index = RemoteIndex()
+    scheduler = SyncScheduler(args.workers, policy=args.priority)
+
+    def finished(folder, engine):
+        stats = drive_transport.transport_stats()
+        reporter.emit('finished', f"Finished {folder}, {stats['reused']} of "
+                      f"{stats['requests']} requests reused a connection",
+                      folder=folder, uploaded=engine.uploaded_files,
+                      unchanged=engine.unchanged_files, deduplicated=engine.deduplicated_files,
+                      connections=stats)
+        if engine.scan_rules:
+            for (label, files, size, folders), line in zip(engine.scan_rules.report(),
+                                                            engine.scan_rules.summary()):
+                reporter.emit('skipped', line, folder=folder, rule=label, files=files,
+                              bytes=size, folders=folders)
+
+    engines = []
+    for folder, destination, rules in jobs:
+        if not os.path.isdir(folder):
+            reporter.error(f"Folder not found: {folder}")
+            continue
+
+        reporter.emit('started', f"Syncing {folder}", folder=folder, destination=destination)
+        engine = SyncEngine(drive_service, folder, destination,
+                            folder_cache=folder_cache, credentials=credentials,
+                            progress_aggregator=aggregator, hash_cache=hash_cache,
+                            content_index=content_index, remote_index=remote_index,
+                            scheduler=scheduler, bandwidth=bandwidth,
+                            pack_threshold=PACK_THRESHOLD if args.pack else 0,
+                            scan_rules=rules, on_progress=reporter.progress,
+                            on_error=reporter.error)
+        engine.on_finished = lambda folder=folder, engine=engine: finished(folder, engine)
+        engines.append(engine)
+
+    try:
+        if not run_engines(engines):
+            reporter.error("Interrupted")
+    finally:
+        scheduler.close()
+        hash_cache.close()
+
+    return EXIT_ERRORS if reporter.errors else EXIT_OK
+
+
+def restore(args):
+    """Restore one packed file, returns the exit code"""
+    reporter = Reporter(args.json)
+    try:
+        credentials = load_credentials(args.token)
+    except Exception as e:
+        reporter.error(str(e))
+        return EXIT_SETUP
+
+    import drive_transport
+    from file_packer import PackRestorer
+
+    try:
+        with library_output(args.json):
+            restorer = PackRestorer(drive_transport.build_drive_service(credentials), args.folder)
+            size = restorer.restore(args.name, args.output)
+    except Exception as e:
+        reporter.error(f"Could not restore {args.name}: {str(e)}")
+        return EXIT_ERRORS
+    reporter.emit('restored', f"Restored {args.name} to {args.output} ({size} bytes)",
+                  name=args.name, output=args.output, size=size)
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='gdrive_sync', description="Back up folders to Google Drive without the GUI")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Sync every folder in the config once")
+    run_parser.add_argument('--config', default=CONFIG_FILE,
+                            help=f"folders to back up (default: {CONFIG_FILE})")
+    run_parser.add_argument('--token', default=TOKEN_FILE,
+                            help=f"credentials saved by the GUI (default: {TOKEN_FILE})")
+    run_parser.add_argument('--destination',
+                            help="Drive folder ID for folders without one in the config")
+    run_parser.add_argument('--priority', choices=POLICIES, default=DEFAULT_POLICY,
+                            help=f"which files of each folder upload first (default: {DEFAULT_POLICY})")
+    run_parser.add_argument('--workers', type=int, default=SCHEDULER_WORKERS,
+                            help=f"files uploaded at once across all folders (default: {SCHEDULER_WORKERS})")
+    run_parser.add_argument('--limit', type=float, metavar='MB/S',
+                            help="upload limit for the whole run, 0 is unlimited "
+                                 "(default: the profiles in --bandwidth)")
+    run_parser.add_argument('--bandwidth', default=BANDWIDTH_FILE,
+                            help=f"upload limits by time of day, re-read when edited (default: {BANDWIDTH_FILE})")
+    run_parser.add_argument('--pool-size', type=int,
+                            help="keep-alive connections to Google kept open (default: 16)")
+    run_parser.add_argument('--pack', action='store_true',
+                            help=f"upload files under {PACK_THRESHOLD // 1024} KB in one archive per folder")
+    run_parser.add_argument('--json', action='store_true',
+                            help="report progress as one JSON object per line")
+    run_parser.set_defaults(handler=run)
+
+    restore_parser = commands.add_parser(
+        'restore', help="Restore one packed file without downloading its whole pack")
+    restore_parser.add_argument('folder', help="Drive folder ID the file's folder was backed up to")
+    restore_parser.add_argument('name', help="name of the file in that folder")
+    restore_parser.add_argument('output', help="where to write the restored file")
+    restore_parser.add_argument('--token', default=TOKEN_FILE,
+                                help=f"credentials saved by the GUI (default: {TOKEN_FILE})")
+    restore_parser.add_argument('--json', action='store_true',
+                                help="report the result as a JSON object")
+    restore_parser.set_defaults(handler=restore)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import threading
+
+from drive_retry import default_policy
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+class RemoteFiles:
+    """Files that already exist in Drive folders, listed once per folder
+
+    Used to skip uploads whose bytes are already at the target path, for
+    example after the sync index was lost or when a folder was uploaded
+    by another machine. Folders mirrored by a RemoteIndex are answered
+    from it without a request. Upload threads share one instance.
+    """
+
+    def __init__(self, retry_policy=None, remote_index=None):
+        self.retry_policy = retry_policy or default_policy
+        self.remote_index = remote_index
+        self.lock = threading.Lock()
+        self.listings = {}  # folder ID -> {name: [file, ...]}
+        self.folders_listed = 0
+
+    def mark_empty(self, folder_id):
+        """Remember a folder created by this run, there is nothing to list"""
+        with self.lock:
+            self.listings.setdefault(folder_id, {})
+
+    def children(self, drive_service, folder_id):
+        """Return the files directly inside a folder, grouped by name"""
+        with self.lock:
+            listing = self.listings.get(folder_id)
+        if listing is not None:
+            return listing
+
+        if self.remote_index is not None:
+            listing = self.remote_index.listing(folder_id)
+            if listing is not None:
+                return listing
+
+        listing = {}
+        page_token = None
+        while True:
+            results = self.retry_policy.execute(drive_service.files().list(
+                q=f"'{folder_id}' in parents and mimeType!='{FOLDER_MIME_TYPE}' and trashed=false",
+                spaces='drive',
+                fields='nextPageToken, files(id, name, size, md5Checksum)',
+                pageSize=1000,
+                pageToken=page_token
+            ))
+            for item in results.get('files', []):
+                listing.setdefault(item['name'], []).append(item)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        with self.lock:
+            self.listings[folder_id] = listing
+            self.folders_listed += 1
+        return listing
+
+    def named(self, drive_service, folder_id, name):
+        """Files in a folder with the given name"""
+        return self.children(drive_service, folder_id).get(name, [])
+
+    def candidates(self, drive_service, folder_id, name, size):
+        """Files at the target path that could hold the same bytes"""
+        return [item for item in self.named(drive_service, folder_id, name)
+                if item.get('md5Checksum') and int(item.get('size', -1)) == size]
@@ -0,0 +1,313 @@
+import sqlite3
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from sync_index import INDEX_FILE
+from drive_retry import default_policy
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+FILE_FIELDS = 'id, name, parents, mimeType, md5Checksum, size, modifiedTime, createdTime'
+
+# Folders created this long before the last refresh are treated as moved in and listed
+CLOCK_SKEW = 300
+
+
+def drive_time(seconds):
+    """Format a timestamp the way Drive reports createdTime"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(seconds))
+
+
+class RemoteIndex:
+    """Local mirror of every file below a Drive destination folder
+
+    The mirror is built once with a paged listing and stored in the sync
+    index database together with a Changes API page token. Later runs
+    only ask Drive what changed since that token, which costs a single
+    request when nothing did.
+    """
+
+    def __init__(self, db_path=INDEX_FILE, retry_policy=None):
+        self.db_path = db_path
+        self.retry_policy = retry_policy or default_policy
+        self.lock = threading.RLock()
+        self.files = {}     # destination -> {file ID: file}
+        self.children = {}  # destination -> {folder ID: {name: [file, ...]}}
+        self.refreshed = set()
+        self.changes_applied = 0
+        # IDs that left a mirror in this process: deleted, trashed or moved out
+        self.removed = set()
+
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS remote_files (
+                    destination TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    parent_id TEXT NOT NULL,
+                    mime_type TEXT,
+                    md5 TEXT,
+                    size INTEGER,
+                    modified_time TEXT,
+                    PRIMARY KEY (destination, file_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS remote_state (
+                    destination TEXT PRIMARY KEY,
+                    page_token TEXT NOT NULL,
+                    refreshed_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def refresh(self, drive_service, destination):
+        """Bring the mirror of destination up to date, once per run"""
+        with self.lock:
+            if destination in self.refreshed:
+                return
+
+            files = self.files.get(destination)
+            page_token, refreshed_at = self.load_state(destination)
+            if files is None and page_token:
+                files = self.load(destination)
+
+            started = time.time()
+            if page_token is None:
+                files, page_token = self.build(drive_service, destination)
+                self.save(destination, files, page_token, started, rebuild=True)
+            else:
+                try:
+                    page_token, changed, removed = self.apply_changes(
+                        drive_service, destination, files, page_token, refreshed_at)
+                except HttpError as e:
+                    if e.resp.status not in (400, 404, 410):
+                        raise
+                    # Token expired or was rejected, start over
+                    print(f"Rebuilding remote index of {destination}: {e}")
+                    old_files = files or {}
+                    files, page_token = self.build(drive_service, destination)
+                    self.save(destination, files, page_token, started, rebuild=True)
+                    self.removed.update(set(old_files) - set(files))
+                else:
+                    self.save(destination, files, page_token, started, changed, removed)
+                    self.removed.update(removed)
+
+            self.files[destination] = files
+            self.index_children(destination)
+            self.refreshed.add(destination)
+
+    def invalidate(self):
+        """Ask Drive for changes again on the next refresh"""
+        with self.lock:
+            self.refreshed.clear()
+
+    def listing(self, folder_id):
+        """Files directly inside a mirrored folder grouped by name, or None if it is not mirrored"""
+        with self.lock:
+            for destination in self.refreshed:
+                files = self.files[destination]
+                if folder_id == destination or folder_id in files:
+                    return self.children[destination].get(folder_id, {})
+        return None
+
+    def entry(self, resource, parent_id):
+        return {
+            'id': resource['id'],
+            'name': resource['name'],
+            'parent': parent_id,
+            'mimeType': resource.get('mimeType'),
+            'md5Checksum': resource.get('md5Checksum'),
+            'size': resource.get('size'),
+            'modifiedTime': resource.get('modifiedTime'),
+        }
+
+    def list_query(self, drive_service, query):
+        """Every file matching query, across all result pages"""
+        page_token = None
+        while True:
+            results = self.retry_policy.execute(drive_service.files().list(
+                q=query,
+                spaces='drive',
+                fields=f'nextPageToken, files({FILE_FIELDS})',
+                pageSize=1000,
+                pageToken=page_token
+            ))
+            yield from results.get('files', [])
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+    def build(self, drive_service, destination):
+        """List the whole subtree of destination and return (files, page token)"""
+        # Taken first so nothing that changes during the listing is missed
+        page_token = self.retry_policy.execute(
+            drive_service.changes().getStartPageToken())['startPageToken']
+
+        by_parent = {}
+        for resource in self.list_query(drive_service, 'trashed=false'):
+            for parent in resource.get('parents', []):
+                by_parent.setdefault(parent, []).append(resource)
+
+        files = {}
+        pending = [destination]
+        while pending:
+            parent_id = pending.pop()
+            for resource in by_parent.get(parent_id, []):
+                files[resource['id']] = self.entry(resource, parent_id)
+                if resource.get('mimeType') == FOLDER_MIME_TYPE:
+                    pending.append(resource['id'])
+        return files, page_token
+
+    def apply_changes(self, drive_service, destination, files, page_token, refreshed_at):
+        """Apply changes since page_token, return (new token, changed IDs, removed IDs)"""
+        updates = {}
+        removed = set()
+        while True:
+            results = self.retry_policy.execute(drive_service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                pageSize=1000,
+                fields=f'nextPageToken, newStartPageToken, '
+                       f'changes(fileId, removed, file({FILE_FIELDS}, trashed))'
+            ))
+            for change in results.get('changes', []):
+                resource = change.get('file')
+                if change.get('removed') or resource is None or resource.get('trashed'):
+                    updates.pop(change['fileId'], None)
+                    removed.add(change['fileId'])
+                else:
+                    updates[change['fileId']] = resource
+                    removed.discard(change['fileId'])
+                self.changes_applied += 1
+            if 'newStartPageToken' in results:
+                page_token = results['newStartPageToken']
+                break
+            page_token = results['nextPageToken']
+
+        for file_id in removed:
+            files.pop(file_id, None)
+
+        # A changed file stays mirrored if any parent is the destination, a mirrored
+        # folder or a folder changed in the same batch
+        changed = set()
+        moved_in = []
+        for file_id, resource in updates.items():
+            parent_id = next((parent for parent in resource.get('parents', [])
+                              if parent == destination or parent in files or parent in updates), None)
+            if parent_id is None:
+                if files.pop(file_id, None) is not None:
+                    removed.add(file_id)
+                continue
+            if (file_id not in files and resource.get('mimeType') == FOLDER_MIME_TYPE
+                    and resource.get('createdTime', '') < drive_time(refreshed_at - CLOCK_SKEW)):
+                # An older folder appeared, it was moved in or restored with its contents
+                moved_in.append(file_id)
+            files[file_id] = self.entry(resource, parent_id)
+            changed.add(file_id)
+
+        while moved_in:
+            folder_id = moved_in.pop()
+            for resource in self.list_query(drive_service, f"'{folder_id}' in parents and trashed=false"):
+                files[resource['id']] = self.entry(resource, folder_id)
+                changed.add(resource['id'])
+                if resource.get('mimeType') == FOLDER_MIME_TYPE:
+                    moved_in.append(resource['id'])
+
+        if changed or removed:
+            removed |= self.prune(files, destination)
+        return page_token, changed - removed, removed
+
+    def prune(self, files, destination):
+        """Drop files whose parent chain no longer reaches the destination"""
+        by_parent = {}
+        for file in files.values():
+            by_parent.setdefault(file['parent'], []).append(file['id'])
+
+        reachable = set()
+        pending = [destination]
+        while pending:
+            for file_id in by_parent.get(pending.pop(), []):
+                reachable.add(file_id)
+                pending.append(file_id)
+
+        orphans = set(files) - reachable
+        for file_id in orphans:
+            del files[file_id]
+        return orphans
+
+    def index_children(self, destination):
+        """Group the mirrored files of destination by folder and name"""
+        children = {}
+        for file in self.files[destination].values():
+            if file['mimeType'] != FOLDER_MIME_TYPE:
+                children.setdefault(file['parent'], {}).setdefault(file['name'], []).append(file)
+        self.children[destination] = children
+
+    def load_state(self, destination):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            row = conn.execute(
+                "SELECT page_token, refreshed_at FROM remote_state WHERE destination=?",
+                (destination,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row if row else (None, 0.0)
+
+    def load(self, destination):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            files = {}
+            for file_id, name, parent_id, mime_type, md5, size, modified_time in conn.execute(
+                    "SELECT file_id, name, parent_id, mime_type, md5, size, modified_time "
+                    "FROM remote_files WHERE destination=?", (destination,)):
+                files[file_id] = {
+                    'id': file_id,
+                    'name': name,
+                    'parent': parent_id,
+                    'mimeType': mime_type,
+                    'md5Checksum': md5,
+                    'size': None if size is None else str(size),
+                    'modifiedTime': modified_time,
+                }
+            return files
+        finally:
+            conn.close()
+
+    def save(self, destination, files, page_token, refreshed_at, changed=None, removed=(), rebuild=False):
+        """Write changed rows and the new page token to disk"""
+        if rebuild:
+            changed = files.keys()
+        rows = [(destination, file['id'], file['name'], file['parent'], file['mimeType'],
+                 file['md5Checksum'], None if file['size'] is None else int(file['size']),
+                 file['modifiedTime'])
+                for file in (files[file_id] for file_id in changed)]
+
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            if rebuild:
+                conn.execute("DELETE FROM remote_files WHERE destination=?", (destination,))
+            conn.executemany(
+                "DELETE FROM remote_files WHERE destination=? AND file_id=?",
+                [(destination, file_id) for file_id in removed]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO remote_files "
+                "(destination, file_id, name, parent_id, mime_type, md5, size, modified_time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO remote_state (destination, page_token, refreshed_at) "
+                "VALUES (?, ?, ?)",
+                (destination, page_token, refreshed_at)
+            )
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import time
+
+from sync_progress import format_bytes
+
+# Written by the GUI: local folder -> Drive destination folder ID, null, or an object
+# with "destination" and the scan rules of that folder
+CONFIG_FILE = 'backup_config.json'
+
+# Windows file names are case-insensitive, so are the rules there
+IGNORE_CASE = os.name == 'nt'
+
+WILDCARDS = set('*?[\\')
+
+
+def translate_segment(segment):
+    """Regex for one path segment of a gitignore pattern"""
+    out = []
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        if char == '*':
+            while i + 1 < len(segment) and segment[i + 1] == '*':
+                i += 1
+            out.append('[^/]*')
+        elif char == '?':
+            out.append('[^/]')
+        elif char == '[':
+            end = segment.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(char))
+            else:
+                body = segment[i + 1:end].replace('\\', '\\\\')
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        elif char == '\\' and i + 1 < len(segment):
+            i += 1
+            out.append(re.escape(segment[i]))
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return ''.join(out)
+
+
+def translate(pattern):
+    """Regex matching the '/' separated paths a gitignore pattern selects"""
+    segments = pattern.split('/')
+    regex = ''
+    for index, segment in enumerate(segments):
+        last = index == len(segments) - 1
+        if segment == '**':
+            # Leading and inner ** match any number of folders, a trailing one everything inside
+            regex += '.*' if last else '(?:.*/)?'
+        else:
+            regex += translate_segment(segment) + ('' if last else '/')
+    return regex
+
+
+class Rule:
+    """One line of a rule list, e.g. 'node_modules/', '*.tmp' or '!keep.log'"""
+
+    __slots__ = ('text', 'index', 'negate', 'dir_only', 'anchored', 'pattern')
+
+    def __init__(self, text, index):
+        self.text = text
+        self.index = index
+        pattern = text
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        elif pattern.startswith('\\'):
+            # \! and \# stand for a leading ! or #
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # A slash anywhere but at the end ties the pattern to the root, otherwise it matches names
+        self.anchored = '/' in pattern
+        self.pattern = pattern.lstrip('/')
+        if not self.pattern:
+            raise ValueError(f"Invalid rule: {text!r}")
+
+
+class RuleTable:
+    """Rules that apply to files or to folders, indexed for matching
+
+    Plain names are looked up in a dict and '*.ext' rules by extension;
+    only the remaining rules are tried as regexes, newest first, and
+    only while they could still beat the best match found so far.
+    """
+
+    def __init__(self, rules):
+        self.names = {}
+        self.extensions = {}
+        self.patterns = []
+        flags = re.IGNORECASE if IGNORE_CASE else 0
+        for rule in rules:
+            pattern = rule.pattern.lower() if IGNORE_CASE else rule.pattern
+            if not rule.anchored and not WILDCARDS & set(pattern):
+                self.names[pattern] = rule.index
+            elif (not rule.anchored and pattern.startswith('*.') and pattern.count('.') == 1
+                  and not WILDCARDS & set(pattern[1:])):
+                self.extensions[pattern[1:]] = rule.index
+            else:
+                try:
+                    regex = re.compile(translate(rule.pattern), flags)
+                except re.error as e:
+                    raise ValueError(f"Invalid rule {rule.text!r}: {str(e)}")
+                self.patterns.append((rule.index, regex, rule.anchored))
+        self.patterns.reverse()
+
+    def match(self, rel_path, name):
+        """Index of the last rule matching a path, or -1"""
+        key = name.lower() if IGNORE_CASE else name
+        best = self.names.get(key, -1)
+        dot = key.rfind('.')
+        if dot > 0:
+            best = max(best, self.extensions.get(key[dot:], -1))
+        for index, regex, anchored in self.patterns:
+            if index <= best:
+                break
+            if regex.fullmatch(rel_path if anchored else name):
+                return index
+        return best
+
+
+class ScanRules:
+    """Compiled include and exclude rules, size and age filters of one backup root
+
+    Rules are written like .gitignore lines and the last matching rule
+    wins: 'node_modules/' excludes every folder of that name, '*.tmp'
+    every file ending in .tmp, '/build/' only the build folder at the
+    top of the root, and '!important.tmp' brings a file back. Excluded
+    folders are never entered, so nothing inside them can be included
+    again. Files larger than max_size bytes or not modified for max_age
+    seconds are skipped too.
+
+    skipped counts, per rule, the files and bytes it skipped and the
+    folders it kept the scanner out of. One instance serves one scanner
+    thread.
+    """
+
+    def __init__(self, rules=(), max_size=None, max_age=None):
+        self.rules = []
+        for line in rules:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                self.rules.append(Rule(line, len(self.rules)))
+        self.files = RuleTable([rule for rule in self.rules if not rule.dir_only])
+        self.folders = RuleTable(self.rules)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.skipped = {}  # label -> [files, bytes, folders]
+
+    @classmethod
+    def from_config(cls, entry):
+        """Rules of a backup_config.json folder object, None if it sets none"""
+        rules = entry.get('rules') or []
+        if isinstance(rules, str):
+            rules = rules.splitlines()
+        max_size = entry.get('max_size_mb')
+        max_age = entry.get('max_age_days')
+        if not rules and max_size is None and max_age is None:
+            return None
+        return cls(rules,
+                   max_size=int(float(max_size) * 1024 * 1024) if max_size is not None else None,
+                   max_age=float(max_age) * 24 * 3600 if max_age is not None else None)
+
+    def count(self, label, size=None):
+        counts = self.skipped.setdefault(label, [0, 0, 0])
+        if size is None:
+            counts[2] += 1
+        else:
+            counts[0] += 1
+            counts[1] += size
+
+    def skip_folder(self, rel_path, name):
+        """Whether a folder is excluded, rel_path uses '/' separators"""
+        index = self.folders.match(rel_path, name)
+        if index < 0 or self.rules[index].negate:
+            return False
+        self.count(self.rules[index].text)
+        return True
+
+    def skip_file(self, rel_path, name, stat_result):
+        """Whether a file is excluded by a rule or filtered by size or age"""
+        index = self.files.match(rel_path, name)
+        if index >= 0 and not self.rules[index].negate:
+            self.count(self.rules[index].text, stat_result.st_size)
+            return True
+        if self.max_size is not None and stat_result.st_size > self.max_size:
+            self.count(f"larger than {format_bytes(self.max_size)}", stat_result.st_size)
+            return True
+        if self.max_age is not None and stat_result.st_mtime < time.time() - self.max_age:
+            self.count(f"older than {self.max_age / (24 * 3600):g} days", stat_result.st_size)
+            return True
+        return False
+
+    def skip_path(self, rel_path, stat_result):
+        """Whether a single file is excluded, checking the folders above it as well
+
+        Used for files reported by the watcher, which the scanner never
+        had a chance to prune.
+        """
+        parts = rel_path.split('/')
+        for depth in range(1, len(parts)):
+            index = self.folders.match('/'.join(parts[:depth]), parts[depth - 1])
+            if index >= 0 and not self.rules[index].negate:
+                self.count(self.rules[index].text, stat_result.st_size)
+                return True
+        return self.skip_file(rel_path, parts[-1], stat_result)
+
+    def totals(self):
+        """(files, bytes, folders) skipped by every rule and filter together"""
+        return tuple(sum(counts[i] for counts in self.skipped.values()) for i in range(3))
+
+    def report(self):
+        """(label, files, bytes, folders) for every rule or filter that skipped something"""
+        order = {rule.text: rule.index for rule in self.rules}
+        return [(label,) + tuple(counts) for label, counts in
+                sorted(self.skipped.items(), key=lambda item: order.get(item[0], len(order)))]
+
+    def summary(self):
+        """One line per rule or filter that skipped something"""
+        lines = []
+        for label, files, size, folders in self.report():
+            counts = []
+            if files or not folders:
+                counts.append(f"{files} files, {format_bytes(size)}")
+            if folders:
+                counts.append(f"{folders} folders not scanned")
+            lines.append(f"Skipped by {label}: {', '.join(counts)}")
+        return lines
+
+
+def folder_settings(value):
+    """(destination, ScanRules or None) of one backup_config.json entry
+
+    An entry is the Drive folder ID, null, or an object such as
+    {"destination": "<ID>", "rules": ["node_modules/", "*.tmp"],
+     "max_size_mb": 500, "max_age_days": 365}.
+    """
+    if isinstance(value, dict):
+        return value.get('destination'), ScanRules.from_config(value)
+    return value, None
+
+
+def load_scan_rules(folder, config_path=CONFIG_FILE):
+    """ScanRules configured for a local folder, None if it has none"""
+    if not os.path.exists(config_path):
+        return None
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    target = os.path.normcase(os.path.abspath(folder))
+    for path, value in config.items():
+        if os.path.normcase(os.path.abspath(path)) == target:
+            return folder_settings(value)[1]
+    return None
@@ -0,0 +1,86 @@
+import os
+
+FILE = 'file'
+DIRECTORY = 'directory'
+
+
+class ScanItem:
+    """A file or directory found by TreeScanner"""
+
+    __slots__ = ('kind', 'path', 'rel_path', 'rel_dir', 'stat', 'subdirs')
+
+    def __init__(self, kind, path, rel_path, rel_dir, stat=None, subdirs=None):
+        self.kind = kind
+        self.path = path
+        self.rel_path = rel_path  # Relative to the scanned root, '.' for the root itself
+        self.rel_dir = rel_dir  # Directory the item lives in, '.' for the root
+        self.stat = stat
+        self.subdirs = subdirs or []
+
+
+class TreeScanner:
+    """Single-pass os.scandir walk of a backup root
+
+    Files are yielded as soon as they are found, together with the stat
+    result scandir already fetched, so uploads start while the rest of
+    the tree is still being scanned. After the files of a directory a
+    DIRECTORY item lists its sub-directories, before any of them is
+    entered. files_found and bytes_found are a running total that only
+    becomes final once `finished` is set.
+
+    With ScanRules, excluded directories are dropped from the listing and
+    never entered, and excluded files are not yielded.
+    """
+
+    def __init__(self, root, on_error=None, rules=None):
+        self.root = root
+        self.on_error = on_error
+        self.rules = rules
+        self.files_found = 0
+        self.bytes_found = 0
+        self.finished = False
+
+    def scan(self):
+        """Yield ScanItems for every file and directory below root"""
+        rules = self.rules
+        pending = ['']
+        while pending:
+            rel_dir = pending.pop()
+            dir_path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            subdirs = []
+
+            try:
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if rules and rules.skip_folder(rel_path.replace(os.sep, '/'), entry.name):
+                                    continue
+                                subdirs.append(entry.name)
+                            elif entry.is_file():
+                                stat_result = entry.stat()
+                                if rules and rules.skip_file(rel_path.replace(os.sep, '/'), entry.name,
+                                                             stat_result):
+                                    continue
+                                self.files_found += 1
+                                self.bytes_found += stat_result.st_size
+                                yield ScanItem(FILE, entry.path, rel_path, rel_dir or '.', stat_result)
+                        except OSError as e:
+                            self.report_error(entry.path, e)
+            except OSError as e:
+                self.report_error(dir_path, e)
+                continue
+
+            yield ScanItem(DIRECTORY, dir_path, rel_dir or '.', os.path.dirname(rel_dir) or '.',
+                           subdirs=subdirs)
+
+            # Depth first, in listing order
+            for name in reversed(subdirs):
+                pending.append(os.path.join(rel_dir, name) if rel_dir else name)
+
+        self.finished = True
+
+    def report_error(self, path, error):
+        if self.on_error:
+            self.on_error(f"Error scanning {path}: {str(error)}")
@@ -0,0 +1,913 @@
+import asyncio
+import io
+import json
+import mimetypes
+import os
+import stat
+import threading
+import time
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeout, wait as futures_wait
+
+from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
+
+from sync_index import SyncIndex, UploadSessions, HashCache, ContentIndex, PackIndex, index_key
+from folder_cache import FolderCache
+from remote_files import RemoteFiles
+from remote_index import RemoteIndex
+from hashing import CHANGE_HASH, DRIVE_HASH
+from drive_transport import ThreadLocalDrive, service_credentials
+from drive_retry import default_policy
+from drive_batch import DriveBatcher
+from scanner import TreeScanner, ScanItem, DIRECTORY, FILE
+from sync_progress import ProgressAggregator
+from sync_scheduler import SyncScheduler
+from chunk_sizer import AdaptiveChunkSizer, AdaptiveMediaFileUpload, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE
+from file_packer import (PACK_MIN_FILES, PACK_CHUNK_SIZE, PACK_MIME_TYPE, MANIFEST_MIME_TYPE, PackStat,
+                         build_pack, bucket_count, pack_bucket, pack_manifest, pack_name, manifest_name)
+
+# Number of files uploaded in parallel by a SyncEngine that has no shared scheduler
+UPLOAD_WORKERS = 8
+
+# Files smaller than this are sent in one multipart request instead of a resumable session
+SMALL_FILE_THRESHOLD = 5 * 1024 * 1024
+
+# Scanned items are handed to the engine in lists of up to SCAN_BATCH,
+# or sooner when the scanner has been holding them for SCAN_BATCH_DELAY seconds
+SCAN_BATCH = 256
+SCAN_BATCH_DELAY = 0.05
+SCAN_QUEUE_SIZE = 16
+
+
+class SyncEngine:
+    """Backs up one local folder to a Drive folder
+
+    The core is the sync() coroutine, run() drives it on a fresh event
+    loop. Progress, errors and completion are reported through the
+    on_progress(message, percentage), on_error(message) and on_finished()
+    callbacks, which may be called from the scanner and upload threads as
+    well as the loop's. The engine has no GUI dependency, SyncWorker
+    bridges the callbacks to Qt signals and gdrive_sync to stdout.
+    """
+
+    def __init__(self, drive_service, folder_path, parent_id=None, folder_cache=None,
+                 credentials=None, max_workers=UPLOAD_WORKERS,
+                 small_file_threshold=SMALL_FILE_THRESHOLD,
+                 min_chunk_size=MIN_CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE,
+                 retry_policy=None, progress_aggregator=None, paths=None,
+                 hash_cache=None, content_index=None, change_hash=CHANGE_HASH,
+                 remote_index=None, scheduler=None, bandwidth=None, pack_threshold=0,
+                 scan_rules=None, on_progress=None, on_error=None, on_finished=None):
+        if drive_service is None:
+            raise ValueError("Drive service cannot be None")
+        self.drive_service = drive_service
+        self.folder_path = folder_path
+        self.root_key = os.path.abspath(folder_path)
+        self.parent_id = parent_id
+        # Shared between all workers of a sync so each remote folder is resolved once
+        self.folder_cache = folder_cache or FolderCache()
+        # Upload threads need their own transport, the shared service is not thread-safe
+        if credentials is None:
+            credentials = service_credentials(drive_service)
+        self.upload_drives = ThreadLocalDrive(credentials) if credentials else None
+        self.max_workers = max_workers if self.upload_drives else 1
+        self.small_file_threshold = small_file_threshold
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        # Per-file chunk statistics of resumable uploads, keyed by relative path
+        self.chunk_stats = {}
+        # Saved resumable sessions, opened for the duration of run()
+        self.upload_sessions = None
+        # Backoff and rate limiting shared with every other Drive call
+        self.retry_policy = retry_policy or default_policy
+        # Shared between all workers of a sync so the UI gets one rate-limited progress stream
+        self.aggregator = progress_aggregator or ProgressAggregator()
+        # Explicit list of changed files for real-time sync, None scans the whole root
+        self.paths = paths
+        # Shared between all workers of a sync so hardlinks and duplicates are hashed once
+        self.hash_cache = hash_cache or HashCache()
+        self.owns_hash_cache = hash_cache is None
+        # Algorithm used to tell whether a touched file really changed
+        self.change_hash = change_hash
+        # Content already on Drive, duplicates are copied server-side instead of uploaded
+        self.content_index = content_index
+        # Mirror of the destination kept current through the Changes API
+        self.remote_index = remote_index
+        # Listings of destination folders, opened for the duration of run()
+        self.remote_files = None
+        # Shared between all workers of a sync so uploads of every root are scheduled together
+        self.scheduler = scheduler
+        self.owns_scheduler = scheduler is None
+        # Uploads handed to the scheduler and not finished yet
+        self.jobs = set()
+        # Tasks of the files in the window and the slots that bound them, set while sync() runs
+        self.tasks = set()
+        self.slots = None
+        # Files smaller than this are uploaded in packs per directory, 0 uploads every file on its own
+        self.pack_threshold = pack_threshold
+        # Shared between all workers of a sync so the upload limit holds for the whole sync
+        self.bandwidth = bandwidth
+        # ScanRules of this root, excluded folders are never scanned and excluded files never synced
+        self.scan_rules = scan_rules
+        self.on_progress = on_progress or (lambda message, value: None)
+        self.on_error = on_error or print
+        self.on_finished = on_finished or (lambda: None)
+        self.uploaded_files = 0
+        self.deduplicated_files = 0
+        self.unchanged_files = 0
+        self.packs_uploaded = 0
+        # Event loop and the scheduler's control thread, set while sync() runs
+        self.loop = None
+        self.control = None
+        self.running = True
+
+    def run(self):
+        """Run the whole sync on the calling thread"""
+        asyncio.run(self.sync())
+
+    async def sync(self):
+        """Main sync process
+
+        Scanning runs on its own thread, content checks on the hash pool
+        and uploads on the scheduler's workers. Each file is handled by its
+        own task as soon as it is found and recorded when it completes, so
+        a large upload never holds back the files queued behind it.
+        """
+        try:
+            if not self.parent_id:
+                self.on_error("No destination folder selected")
+                return
+
+            self.loop = asyncio.get_running_loop()
+            if self.scheduler is None:
+                self.scheduler = SyncScheduler(self.max_workers)
+            # Calls on the shared service are kept on one thread, it is not thread-safe
+            self.control = self.scheduler.control
+            index = SyncIndex()
+            self.upload_sessions = UploadSessions()
+            if self.content_index is None:
+                self.content_index = ContentIndex()
+            if self.remote_index is None:
+                self.remote_index = RemoteIndex(retry_policy=self.retry_policy)
+            try:
+                await self.control_call(self.remote_index.refresh, self.drive_service, self.parent_id)
+                # Folders deleted or trashed on Drive are created again instead of uploaded into
+                self.folder_cache.invalidate(self.remote_index.removed)
+            except Exception as e:
+                # Folders are listed one by one instead
+                self.on_error(f"Could not refresh remote index: {str(e)}")
+            self.remote_files = RemoteFiles(self.retry_policy, self.remote_index)
+            pack_index = PackIndex(index) if self.pack_threshold else None
+
+            if self.paths is None:
+                known = index.load_root(self.parent_id, self.root_key)
+                # Files are uploaded while the scan is still running, the total grows as it goes
+                scanner = TreeScanner(self.folder_path, on_error=self.on_error, rules=self.scan_rules)
+                items = scanner.scan()
+            else:
+                # Only the files reported by the watcher, the tree is never rescanned
+                known = index.load_paths(self.parent_id, self.root_key, [
+                    index_key(os.path.relpath(path, self.folder_path)) for path in self.paths])
+                items = self.changed_items()
+            self.aggregator.scan_started()
+
+            self.tasks = set()
+            self.slots = asyncio.Semaphore(self.scheduler.window)
+            scanned, abandoned = self.start_scan(items)
+            # Small files of each directory, held until the whole directory is scanned
+            small_files = {}
+
+            try:
+                current_dir = None
+                current_parent = None
+
+                async def start_file(item):
+                    """Start the task that syncs one file, unless the index shows it unchanged"""
+                    nonlocal current_dir, current_parent
+                    if item.rel_dir != current_dir:
+                        current_dir = item.rel_dir
+                        current_parent = None
+
+                    rel_key = index_key(item.rel_path)
+                    if self.paths is not None and rel_key not in known:
+                        # Listed with a changed small file of its directory
+                        known.update(index.load_paths(self.parent_id, self.root_key, [rel_key]))
+                    state = index.classify(known, rel_key, item.stat)
+
+                    if state == SyncIndex.UNCHANGED:
+                        self.unchanged_files += 1
+                        self.aggregator.skipped(item.stat.st_size)
+                    else:
+                        # Create folder structure in Google Drive only when something needs uploading
+                        if current_parent is None:
+                            current_parent = asyncio.ensure_future(
+                                self.control_call(self.create_folder_structure, current_dir))
+                        await self.start_task(self.sync_item, index, item, state, known.get(rel_key),
+                                              current_parent)
+
+                while self.running:
+                    batch = await scanned.get()
+                    if batch is None:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+
+                    for item in batch:
+                        if not self.running:
+                            break
+
+                        if item.kind == DIRECTORY:
+                            if item.subdirs:
+                                # Create missing sub-folders of this directory in batch requests
+                                await self.control_call(
+                                    self.folder_cache.resolve_many, self.drive_service, self.parent_id,
+                                    [os.path.normpath(os.path.join(item.rel_path, d)) for d in item.subdirs])
+                            if pack_index is not None:
+                                # Every file of the directory has been seen, its packs can be checked
+                                await self.sync_packs(pack_index, item.rel_path,
+                                                      small_files.pop(item.rel_path, []), start_file)
+                            continue
+
+                        self.aggregator.found(item.stat.st_size)
+                        if pack_index is not None and item.stat.st_size < self.pack_threshold:
+                            small_files.setdefault(item.rel_dir, []).append(item)
+                        else:
+                            await start_file(item)
+
+                        self.aggregator.tick(self.on_progress)
+
+                if self.tasks:
+                    await asyncio.wait(list(self.tasks))
+            finally:
+                abandoned.set()
+                self.aggregator.scan_finished()
+                for task in self.tasks:
+                    task.cancel()
+                # Uploads already running still use the index and sessions
+                futures_wait(list(self.jobs))
+                if self.owns_scheduler:
+                    self.scheduler.close()
+                    self.scheduler = None
+                index.close()
+                self.upload_sessions.close()
+                self.upload_sessions = None
+                if self.owns_hash_cache:
+                    self.hash_cache.close()
+                self.folder_cache.save()
+
+            self.aggregator.tick(self.on_progress, force=True)
+            self.on_progress(
+                f"Sync complete: {self.uploaded_files} uploaded, {self.unchanged_files} unchanged, "
+                f"{self.deduplicated_files} already on Drive, "
+                f"{self.folder_cache.lookups_saved} folder lookups saved"
+                + (f", {self.packs_uploaded} packs uploaded" if self.pack_threshold else "")
+                + (f", {self.scan_rules.totals()[0]} skipped by rules" if self.scan_rules else ""), 100)
+            self.on_finished()
+
+        except Exception as e:
+            self.on_error(f"Sync error: {str(e)}")
+
+    def control_call(self, function, *args):
+        """Run a call that uses the shared Drive service on the control thread"""
+        return self.loop.run_in_executor(self.control, function, *args)
+
+    async def start_task(self, function, *args):
+        """Run function(*args) as a task once the window has room, the task releases its slot"""
+        await self.slots.acquire()
+        task = asyncio.ensure_future(function(*args))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def start_scan(self, items):
+        """Iterate items on a scanner thread, returning (queue of batches, abandoned event)
+
+        Items arrive in lists to keep the cross-thread hand-off cheap. The
+        queue ends with None, or with the exception that stopped the scan.
+        Setting the event lets the scanner thread exit early.
+        """
+        loop = self.loop
+        scanned = asyncio.Queue(maxsize=SCAN_QUEUE_SIZE)
+        abandoned = threading.Event()
+
+        def put(batch):
+            if abandoned.is_set():
+                return False
+            try:
+                future = asyncio.run_coroutine_threadsafe(scanned.put(batch), loop)
+            except RuntimeError:
+                # The sync ended and its loop is closed
+                return False
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except CancelledError:
+                    return False
+                except FutureTimeout:
+                    if abandoned.is_set():
+                        future.cancel()
+                        return False
+
+        def produce():
+            try:
+                batch = []
+                flushed = time.monotonic()
+                for item in items:
+                    batch.append(item)
+                    if len(batch) >= SCAN_BATCH or time.monotonic() - flushed > SCAN_BATCH_DELAY:
+                        if not put(batch):
+                            return
+                        batch = []
+                        flushed = time.monotonic()
+                if batch and not put(batch):
+                    return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+
+        threading.Thread(target=produce, daemon=True).start()
+        return scanned, abandoned
+
+    async def sync_item(self, index, item, state, entry, parent):
+        """Check, upload and record one file"""
+        file_path = item.path
+        stat_result = item.stat
+        try:
+            parent_id = await parent
+            # Modified files keep their Drive file ID and get a new revision
+            file_id = entry[4] if entry is not None else None
+
+            if state == SyncIndex.CHECK:
+                # Touched but same size, compare its content on the hash pool
+                digests = await asyncio.wrap_future(
+                    self.hash_cache.submit(file_path, stat_result, self.check_algorithms(entry)))
+                if self.record_check(index, item, entry, digests):
+                    return
+            elif file_id is None and stat_result.st_size >= self.content_index.min_size:
+                # sync_file needs the MD5, hash it ahead so upload threads only upload
+                await asyncio.wrap_future(self.hash_cache.submit(file_path, stat_result))
+
+            try:
+                result = await self.run_job(stat_result, self.sync_file, file_path, item.rel_path,
+                                            parent_id, stat_result, file_id)
+            except HttpError as e:
+                parent_id = await self.recreate_parent(e, parent_id, item.rel_dir)
+                result = await self.run_job(stat_result, self.sync_file, file_path, item.rel_path,
+                                            parent_id, stat_result)
+            if result is not None:
+                file_id, md5, uploaded = result
+                index.record(self.parent_id, self.root_key, index_key(item.rel_path),
+                             stat_result, md5, file_id)
+                if uploaded:
+                    self.uploaded_files += 1
+                else:
+                    self.deduplicated_files += 1
+        except Exception as e:
+            self.on_error(f"Error uploading {file_path}: {str(e)}")
+        finally:
+            self.slots.release()
+            self.aggregator.file_done(file_path, stat_result.st_size)
+            self.aggregator.tick(self.on_progress)
+
+    async def sync_packs(self, pack_index, rel_dir, items, start_file):
+        """Bring the small files of a directory to Drive in packs
+
+        The files are split into packs by name and only packs whose
+        members changed are built and uploaded again. Directories with
+        fewer than PACK_MIN_FILES small files and no packs yet upload them
+        one by one instead.
+        """
+        dir_key = index_key(rel_dir)
+        packs = pack_index.load_dir(self.parent_id, self.root_key, dir_key)
+        if not packs and len(items) < PACK_MIN_FILES:
+            for item in items:
+                await start_file(item)
+            return
+
+        buckets = bucket_count(sum(item.stat.st_size for item in items)) if items else 0
+        groups = {bucket: [] for bucket in range(buckets)}
+        for item in items:
+            groups[pack_bucket(os.path.basename(item.rel_path), buckets)].append(item)
+
+        parent = None
+        for bucket, members in groups.items():
+            pack = packs.get(bucket)
+            if pack is not None and pack[0] == buckets and self.pack_unchanged(pack[3], members):
+                self.unchanged_files += len(members)
+                for item in members:
+                    self.aggregator.skipped(item.stat.st_size)
+                continue
+            if parent is None:
+                parent = asyncio.ensure_future(self.control_call(self.create_folder_structure, rel_dir))
+            await self.start_task(self.sync_pack, pack_index, rel_dir, bucket, buckets, members,
+                                  pack, parent)
+
+        # Packs left over from a directory that shrank or lost its small files
+        for bucket, pack in packs.items():
+            if bucket >= buckets:
+                await self.control_call(self.discard_pack, pack)
+                pack_index.delete(self.parent_id, self.root_key, dir_key, bucket)
+
+    async def discard_standalone(self, index, rel_dir, names):
+        """Trash the copies of newly packed files that were uploaded one by one before"""
+        rel_keys = [index_key(os.path.normpath(os.path.join(rel_dir, name))) for name in names]
+        standalone = index.load_paths(self.parent_id, self.root_key, rel_keys)
+        if not standalone:
+            return
+        file_ids = [entry[4] for entry in standalone.values() if entry[4]]
+        trashed = await self.control_call(self.trash_files, file_ids)
+        for rel_key, entry in standalone.items():
+            # Kept when trashing failed, so the copy is not forgotten on Drive
+            if not entry[4] or entry[4] in trashed:
+                index.delete(self.parent_id, self.root_key, rel_key)
+
+    async def run_job(self, priority, function, *args):
+        """Run function(*args) on the scheduler's upload threads and return its result"""
+        job = self.scheduler.submit(self.root_key, priority, function, *args)
+        self.jobs.add(job)
+        job.add_done_callback(self.jobs.discard)
+        return await asyncio.wrap_future(job)
+
+    async def recreate_parent(self, error, parent_id, rel_dir):
+        """New ID of a cached folder an upload failed in, re-raising error if the folder is fine"""
+        if error.resp.status != 404 or not await self.control_call(self.folder_gone, parent_id):
+            raise error
+        self.on_error(f"Folder {rel_dir} was removed from Google Drive, creating it again")
+        return await self.control_call(self.create_folder_structure, rel_dir)
+
+    def folder_gone(self, folder_id):
+        """Whether a cached folder was deleted or trashed on Drive, dropping it from the cache if so"""
+        if folder_id == self.parent_id:
+            return False
+        try:
+            folder = self.retry_policy.execute(self.drive_service.files().get(
+                fileId=folder_id,
+                fields='id, trashed'
+            ))
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            folder = None
+        if folder is not None and not folder.get('trashed'):
+            return False
+        self.folder_cache.invalidate([folder_id])
+        return True
+
+    def pack_unchanged(self, recorded, members):
+        """Whether a pack recorded with these member stats still holds exactly these files"""
+        return len(recorded) == len(members) and all(
+            recorded.get(os.path.basename(item.rel_path)) ==
+            [item.stat.st_size, item.stat.st_mtime_ns, item.stat.st_ino]
+            for item in members)
+
+    async def sync_pack(self, pack_index, rel_dir, bucket, buckets, members, pack, parent):
+        """Build, upload and record one pack of a directory"""
+        size = sum(item.stat.st_size for item in members)
+        sent = 0
+        try:
+            parent_id = await parent
+            priority = PackStat([item.stat for item in members])
+            try:
+                result = await self.run_job(priority, self.upload_pack, rel_dir, bucket, buckets,
+                                            members, parent_id, pack)
+            except HttpError as e:
+                parent_id = await self.recreate_parent(e, parent_id, rel_dir)
+                result = await self.run_job(priority, self.upload_pack, rel_dir, bucket, buckets,
+                                            members, parent_id)
+            if result is not None:
+                file_id, manifest_id, entries, sent = result
+                stats = {}
+                for item in members:
+                    name = os.path.basename(item.rel_path)
+                    if name in entries:
+                        stats[name] = [item.stat.st_size, item.stat.st_mtime_ns, item.stat.st_ino]
+                pack_index.record(self.parent_id, self.root_key, index_key(rel_dir), bucket, buckets,
+                                  file_id, manifest_id, stats)
+                self.uploaded_files += len(entries)
+                self.packs_uploaded += 1
+                await self.discard_standalone(pack_index.index, rel_dir, entries)
+        except Exception as e:
+            self.on_error(f"Error uploading {pack_name(bucket)} of "
+                          f"{os.path.normpath(os.path.join(self.folder_path, rel_dir))}: {str(e)}")
+        finally:
+            self.slots.release()
+            self.aggregator.packed(len(members), size, sent)
+            self.aggregator.tick(self.on_progress)
+
+    def changed_items(self):
+        """ScanItems for the explicit list of changed files
+
+        When packing, a changed small file stands for its whole directory:
+        every small file of it is listed, followed by the DIRECTORY item
+        that makes the engine check its packs. Files the scan rules exclude
+        are dropped, including those inside excluded folders.
+        """
+        packed_dirs = []
+        # Changed files the rules skipped, so listing their directory does not count them again
+        excluded = set()
+        for file_path in self.paths:
+            rel_path = os.path.relpath(file_path, self.folder_path)
+            rel_dir = os.path.dirname(rel_path) or '.'
+            try:
+                stat_result = os.stat(file_path)
+            except OSError:
+                # Deleted or renamed again before it could be uploaded, a pack may still hold it
+                if self.pack_threshold and rel_dir not in packed_dirs:
+                    packed_dirs.append(rel_dir)
+                continue
+            if not stat.S_ISREG(stat_result.st_mode):
+                continue
+            if self.scan_rules and self.scan_rules.skip_path(index_key(rel_path), stat_result):
+                excluded.add(os.path.normpath(file_path))
+                continue
+            if stat_result.st_size < self.pack_threshold:
+                if rel_dir not in packed_dirs:
+                    packed_dirs.append(rel_dir)
+                continue
+            yield ScanItem(FILE, file_path, rel_path, rel_dir, stat_result)
+
+        for rel_dir in packed_dirs:
+            dir_path = os.path.normpath(os.path.join(self.folder_path, rel_dir))
+            try:
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        try:
+                            if not entry.is_file():
+                                continue
+                            stat_result = entry.stat()
+                        except OSError:
+                            continue
+                        if stat_result.st_size < self.pack_threshold:
+                            rel_path = os.path.normpath(os.path.join(rel_dir, entry.name))
+                            if entry.path in excluded or (self.scan_rules and self.scan_rules.skip_path(
+                                    index_key(rel_path), stat_result)):
+                                continue
+                            yield ScanItem(FILE, entry.path, rel_path, rel_dir, stat_result)
+            except OSError as e:
+                self.on_error(f"Error scanning {dir_path}: {str(e)}")
+                continue
+            yield ScanItem(DIRECTORY, dir_path, rel_dir, os.path.dirname(rel_dir) or '.')
+
+    def check_algorithms(self, entry):
+        """Hashes needed to tell whether an indexed file changed"""
+        local_hash = entry[5]
+        if self.change_hash == DRIVE_HASH:
+            return (DRIVE_HASH,)
+        if local_hash and local_hash.startswith(self.change_hash + ':'):
+            return (self.change_hash,)
+        # First check with the fast hash, compare MD5 once and remember both
+        return (DRIVE_HASH, self.change_hash)
+
+    def record_check(self, index, item, entry, digests):
+        """Record a touched file whose content turned out unchanged, return True if so"""
+        size, mtime_ns, inode, md5, file_id, local_hash = entry
+
+        if DRIVE_HASH in digests:
+            same = digests[DRIVE_HASH] == md5
+        else:
+            same = f"{self.change_hash}:{digests[self.change_hash]}" == local_hash
+        if not same:
+            return False
+
+        if self.change_hash in digests and self.change_hash != DRIVE_HASH:
+            local_hash = f"{self.change_hash}:{digests[self.change_hash]}"
+        index.record(self.parent_id, self.root_key, index_key(item.rel_path), item.stat,
+                     md5, file_id, local_hash)
+        self.unchanged_files += 1
+        return True
+
+    def create_folder_structure(self, relative_path):
+        """Create folder structure in Google Drive"""
+        return self.folder_cache.resolve(self.drive_service, self.parent_id, relative_path)
+
+    def sync_file(self, file_path, relative_path, parent_id, stat_result, file_id=None):
+        """Bring one file to Drive, uploading its bytes only when Drive lacks them
+
+        file_id is the Drive file the path was synced to before, it is
+        updated in place instead of creating a second file. Returns
+        (file ID, MD5, uploaded) or None if the sync was stopped.
+        """
+        if not self.running:
+            return None
+        drive_service = self.upload_drives.get() if self.upload_drives else self.drive_service
+        name = os.path.basename(file_path)
+        size = stat_result.st_size
+        md5 = None
+
+        # Same bytes already at the target path, nothing to do
+        if parent_id in self.folder_cache.created:
+            self.remote_files.mark_empty(parent_id)
+        candidates = self.remote_files.candidates(drive_service, parent_id, name, size)
+        if candidates:
+            md5 = self.hash_cache.md5(file_path, stat_result)
+            for candidate in candidates:
+                if candidate['md5Checksum'] == md5:
+                    return candidate['id'], md5, False
+
+        if file_id is None:
+            # Not in the index but already on Drive, keep one file per path
+            existing = self.remote_files.named(drive_service, parent_id, name)
+            if existing:
+                file_id = existing[0]['id']
+
+        # Same bytes elsewhere on Drive or being uploaded right now, copy them server-side
+        claimed = False
+        if file_id is None and size >= self.content_index.min_size:
+            md5 = md5 or self.hash_cache.md5(file_path, stat_result)
+            source_id = self.content_index.claim(md5)
+            if source_id:
+                copied = self.copy_file(drive_service, source_id, name, parent_id)
+                if copied is not None:
+                    return copied, md5, False
+                self.content_index.discard(md5)
+            else:
+                claimed = True
+
+        result = None
+        try:
+            result = self.upload_file(file_path, relative_path, parent_id, file_id)
+            if result is not None:
+                self.content_index.add(result[1], result[0], size)
+        finally:
+            if claimed:
+                self.content_index.release(md5)
+        if result is None:
+            return None
+        return result + (True,)
+
+    def copy_file(self, drive_service, source_id, name, parent_id):
+        """Copy an existing Drive file into parent_id, returning the new ID or None"""
+        try:
+            copied = self.retry_policy.execute(drive_service.files().copy(
+                fileId=source_id,
+                body={'name': name, 'parents': [parent_id]},
+                fields='id'
+            ), is_running=lambda: self.running)
+            return copied['id']
+        except Exception as e:
+            # Source was deleted or is not accessible any more, upload instead
+            print(f"Could not copy {source_id}: {e}")
+            return None
+
+    def upload_file(self, file_path, relative_path, parent_id=None, file_id=None):
+        """Upload a file to Google Drive and return its file ID and MD5
+
+        With a file_id the content is uploaded as a new revision of that
+        file, otherwise a new file is created in parent_id.
+        """
+        try:
+            file_size = os.path.getsize(file_path)
+            mime_type, _ = mimetypes.guess_type(file_path)
+            
+            if mime_type is None:
+                mime_type = 'application/octet-stream'
+
+            file_metadata = {
+                'name': os.path.basename(file_path),
+                'parents': [parent_id or self.parent_id]
+            }
+
+            drive_service = self.upload_drives.get() if self.upload_drives else self.drive_service
+
+            if file_size < self.small_file_threshold:
+                return self.upload_small_file(drive_service, file_path, relative_path,
+                                              file_metadata, mime_type, file_id)
+
+            # Chunk size adapts to the throughput measured on earlier chunks
+            sizer = AdaptiveChunkSizer(self.min_chunk_size, self.max_chunk_size)
+            media = AdaptiveMediaFileUpload(file_path, sizer, mimetype=mime_type)
+
+            request = self.upload_request(drive_service, file_metadata, media, file_id)
+
+            # Pick up where an interrupted run left off
+            rel_key = index_key(relative_path)
+            stat_result = os.stat(file_path)
+            sessions = self.upload_sessions
+            response = None
+            if sessions:
+                response = self.resume_session(request, sessions, rel_key, stat_result)
+
+            def send_chunk():
+                if self.bandwidth:
+                    # Chunks no larger than the limit allows per burst, paid for before sending
+                    media.ceiling = self.bandwidth.chunk_ceiling()
+                    self.bandwidth.consume(min(media.chunksize(), file_size - request.resumable_progress),
+                                           is_running=lambda: self.running)
+                    if not self.running:
+                        return None, None
+                # Timed per attempt so backoff sleeps and throttling do not skew the chunk sizing
+                sent_before = request.resumable_progress
+                chunk_started = time.monotonic()
+                result = request.next_chunk()
+                sent = (file_size if result[1] is not None else request.resumable_progress) - sent_before
+                sizer.record(sent, time.monotonic() - chunk_started)
+                self.aggregator.transferred(file_path, sent, relative_path)
+                self.aggregator.tick(self.on_progress)
+                return result
+
+            while response is None:
+                if not self.running:
+                    return None
+                _, response = self.retry_policy.call(send_chunk, is_running=lambda: self.running)
+                if sessions and response is None:
+                    sessions.save(self.parent_id, self.root_key, rel_key,
+                                  request.resumable_uri, request.resumable_progress, stat_result)
+
+            if sessions:
+                sessions.delete(self.parent_id, self.root_key, rel_key)
+            self.chunk_stats[relative_path] = sizer.stats()
+            return response['id'], response.get('md5Checksum')
+
+        except HttpError as e:
+            if file_id and e.resp.status == 404:
+                # Deleted on Drive since the last sync, upload it as a new file
+                return self.upload_file(file_path, relative_path, parent_id)
+            if e.resp.status == 404:
+                # The parent folder may be gone, sync_item checks and creates it again
+                raise
+            raise Exception(f"Error uploading {file_path}: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Error uploading {file_path}: {str(e)}")
+
+    def upload_pack(self, rel_dir, bucket, buckets, members, parent_id, pack=None):
+        """Build one pack of small files and upload it with its manifest
+
+        An existing pack and manifest get new revisions, so their Drive
+        IDs stay the same. Returns (pack ID, manifest ID, manifest entries,
+        bytes sent) or None if the sync was stopped.
+        """
+        if not self.running:
+            return None
+        drive_service = self.upload_drives.get() if self.upload_drives else self.drive_service
+        file_id, manifest_id = (pack[1], pack[2]) if pack else (None, None)
+
+        archive, size, entries = build_pack(
+            [(os.path.basename(item.rel_path), item.path, item.stat) for item in members])
+        try:
+            # The pack goes first, a manifest must never point into a pack that is not there yet
+            file_id = self.upload_stream(drive_service, archive, size, pack_name(bucket),
+                                         PACK_MIME_TYPE, parent_id, file_id)
+        finally:
+            archive.close()
+        if file_id is None:
+            return None
+
+        manifest = json.dumps(pack_manifest(bucket, buckets, entries)).encode('utf-8')
+        manifest_id = self.upload_stream(drive_service, io.BytesIO(manifest), len(manifest),
+                                         manifest_name(bucket), MANIFEST_MIME_TYPE, parent_id,
+                                         manifest_id)
+        if manifest_id is None:
+            return None
+        return file_id, manifest_id, entries, size + len(manifest)
+
+    def upload_stream(self, drive_service, stream, size, name, mime_type, parent_id, file_id=None):
+        """Upload the content of a file object, returning the Drive file ID
+
+        With a file_id the content becomes a new revision of that file,
+        otherwise a new file is created in parent_id. Returns None if the
+        sync was stopped.
+        """
+        resumable = size >= self.small_file_threshold
+        chunk_size = PACK_CHUNK_SIZE
+        if self.bandwidth and self.bandwidth.chunk_ceiling():
+            chunk_size = min(chunk_size, self.bandwidth.chunk_ceiling())
+        media = MediaIoBaseUpload(stream, mimetype=mime_type, resumable=resumable,
+                                  chunksize=AdaptiveChunkSizer.round_to_unit(chunk_size))
+        request = self.upload_request(drive_service, {'name': name, 'parents': [parent_id]},
+                                      media, file_id)
+
+        try:
+            if not resumable:
+                if self.bandwidth:
+                    self.bandwidth.consume(size, is_running=lambda: self.running)
+                if not self.running:
+                    return None
+                return self.retry_policy.execute(request, is_running=lambda: self.running)['id']
+
+            def send_chunk():
+                if self.bandwidth:
+                    self.bandwidth.consume(min(media.chunksize(), size - request.resumable_progress),
+                                           is_running=lambda: self.running)
+                    if not self.running:
+                        return None, None
+                return request.next_chunk()
+
+            response = None
+            while response is None:
+                if not self.running:
+                    return None
+                _, response = self.retry_policy.call(send_chunk, is_running=lambda: self.running)
+            return response['id']
+
+        except HttpError as e:
+            if file_id and e.resp.status == 404:
+                # Deleted on Drive since the last sync, upload it as a new file
+                stream.seek(0)
+                return self.upload_stream(drive_service, stream, size, name, mime_type, parent_id)
+            raise
+
+    def discard_pack(self, pack):
+        """Move a pack and its manifest that are no longer used to the Drive trash"""
+        self.trash_files([pack[1], pack[2]])
+
+    def trash_files(self, file_ids):
+        """Move Drive files to the trash in batch requests, returns the IDs no longer in place"""
+        gone = set()
+
+        def trashed(file_id, exception):
+            if exception is None or (isinstance(exception, HttpError) and exception.resp.status == 404):
+                # A 404 means it is already gone, nothing left to clean up
+                gone.add(file_id)
+            else:
+                self.on_error(f"Could not trash {file_id}: {str(exception)}")
+
+        batcher = DriveBatcher(self.drive_service, retry_policy=self.retry_policy)
+        for file_id in file_ids:
+            batcher.add(self.drive_service.files().update(
+                fileId=file_id,
+                body={'trashed': True},
+                fields='id'
+            ), callback=lambda response, exception, file_id=file_id: trashed(file_id, exception))
+        batcher.flush()
+        return gone
+
+    def upload_request(self, drive_service, file_metadata, media, file_id=None):
+        """Create request for a new file, or update request for an existing one"""
+        if file_id:
+            return drive_service.files().update(
+                fileId=file_id,
+                media_body=media,
+                fields='id, md5Checksum'
+            )
+        return drive_service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id, md5Checksum'
+        )
+
+    def resume_session(self, request, sessions, rel_key, stat_result):
+        """Continue a resumable session saved by an earlier run
+
+        Returns the finished file resource if the saved session had already
+        completed, otherwise None. When the session is still alive the
+        request continues from the last byte Drive committed.
+        """
+        session_uri = sessions.get(self.parent_id, self.root_key, rel_key, stat_result)
+        if not session_uri:
+            return None
+
+        def query():
+            # Ask Drive how much of the upload it has
+            response, content = request.http.request(
+                session_uri, 'PUT',
+                headers={'Content-Range': f'bytes */{stat_result.st_size}', 'Content-Length': '0'}
+            )
+            status = int(response.status)
+            if status >= 500 or status in (408, 429):
+                # httplib2 returns these instead of raising, raise them so the policy retries
+                raise HttpError(response, content, uri=session_uri)
+            return response, content
+
+        try:
+            response, content = self.retry_policy.call(query)
+        except Exception as e:
+            # The session may still be alive, keep it for the next run
+            print(f"Could not query upload session (starting over): {e}")
+            return None
+
+        status = int(response.status)
+        if status in (200, 201):
+            return json.loads(content)
+        if status == 308:
+            range_header = response.get('range')
+            offset = int(range_header.rsplit('-', 1)[1]) + 1 if range_header else 0
+            request.resumable_uri = session_uri
+            request.resumable_progress = offset
+            return None
+
+        if status in (404, 410):
+            # Session expired or unknown to Drive
+            sessions.delete(self.parent_id, self.root_key, rel_key)
+        return None
+
+    def upload_small_file(self, drive_service, file_path, relative_path, file_metadata, mime_type,
+                          file_id=None):
+        """Upload a small file with a single multipart request"""
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mime_type, resumable=False)
+
+        request = self.upload_request(drive_service, file_metadata, media, file_id)
+
+        if self.bandwidth:
+            self.bandwidth.consume(len(data), is_running=lambda: self.running)
+        if not self.running:
+            return None
+        response = self.retry_policy.execute(request, is_running=lambda: self.running)
+        self.aggregator.transferred(file_path, len(data), relative_path)
+        return response['id'], response.get('md5Checksum')
+
+    def stop(self):
+        """Stop the sync process"""
+        self.running = False
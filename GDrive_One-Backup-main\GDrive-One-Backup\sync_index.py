@@ -0,0 +1,421 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from hashing import HashEngine, DRIVE_HASH
+
+# Stored next to backup_config.json and token.pickle
+INDEX_FILE = 'sync_index.db'
+
+# Number of writes buffered before committing to disk
+COMMIT_INTERVAL = 500
+
+# Drive keeps resumable sessions for a week, stop trusting them a little earlier
+SESSION_LIFETIME = 6 * 24 * 3600
+
+# Smaller files are cheaper to upload again than to hash and copy
+DEDUP_MIN_SIZE = 1024 * 1024
+
+
+def index_key(relative_path):
+    """Normalize a relative path so the index is portable between platforms"""
+    return relative_path.replace(os.sep, '/')
+
+
+class HashCache:
+    """Digests of local files, computed at most once per run
+
+    Entries are keyed by device, inode, size and mtime, so hardlinks and
+    repeated lookups of the same file are only read from disk once.
+    DirEntry.stat() on Windows leaves st_dev and st_ino at 0, those files
+    are keyed by their normalized path instead. Upload threads share one
+    instance.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine or HashEngine()
+        self.lock = threading.Lock()
+        self.digests = {}
+        self.pending = {}  # Hashes still running on the pool, shared by later requests
+        self.hashes_reused = 0
+
+    def key(self, file_path, stat_result):
+        if stat_result.st_ino:
+            identity = (stat_result.st_dev, stat_result.st_ino)
+        else:
+            # Without an inode, files of the same size and mtime would share a digest
+            identity = (os.path.normcase(os.path.abspath(file_path)),)
+        return identity + (stat_result.st_size, stat_result.st_mtime_ns)
+
+    def cached(self, file_path, stat_result, algorithms):
+        """Return {algorithm: digest} if every digest is known, else None"""
+        key = self.key(file_path, stat_result)
+        with self.lock:
+            digests = {name: self.digests.get(key + (name,)) for name in algorithms}
+            if None in digests.values():
+                return None
+            self.hashes_reused += 1
+            return digests
+
+    def store(self, file_path, stat_result, digests):
+        key = self.key(file_path, stat_result)
+        with self.lock:
+            for name, digest in digests.items():
+                self.digests[key + (name,)] = digest
+        return digests
+
+    def hash(self, file_path, stat_result, algorithms=(DRIVE_HASH,)):
+        """Hash a file in the calling thread and return {algorithm: digest}"""
+        digests = self.cached(file_path, stat_result, algorithms)
+        if digests is None:
+            digests = self.store(file_path, stat_result, self.engine.hash(file_path, algorithms))
+        return digests
+
+    def md5(self, file_path, stat_result):
+        """Return the hex MD5 digest of a file"""
+        return self.hash(file_path, stat_result)[DRIVE_HASH]
+
+    def submit(self, file_path, stat_result, algorithms=(DRIVE_HASH,)):
+        """Hash a file on the engine's pool, returning a future of {algorithm: digest}"""
+        digests = self.cached(file_path, stat_result, algorithms)
+        if digests is not None:
+            future = Future()
+            future.set_result(digests)
+            return future
+        key = self.key(file_path, stat_result) + (tuple(algorithms),)
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                self.hashes_reused += 1
+                return future
+            future = self.pending[key] = self.engine.submit(file_path, algorithms)
+
+        def finished(done):
+            if done.exception() is None:
+                self.store(file_path, stat_result, done.result())
+            with self.lock:
+                self.pending.pop(key, None)
+
+        future.add_done_callback(finished)
+        return future
+
+    def close(self):
+        self.engine.close()
+
+
+class SyncIndex:
+    """Persistent record of every file that has been synced to Google Drive
+
+    Each row remembers the local size, mtime, inode and content hash of a
+    file together with the Drive file ID it was uploaded as, so later syncs
+    can tell unchanged files apart with nothing more than a local stat.
+    """
+
+    UNCHANGED = 'unchanged'
+    NEW = 'new'
+    MODIFIED = 'modified'
+    CHECK = 'check'
+
+    def __init__(self, db_path=INDEX_FILE):
+        self.db_path = db_path
+        # Every SyncWorker opens its own connection, so allow them to wait on each other
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                destination TEXT NOT NULL,
+                root TEXT NOT NULL,
+                rel_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                md5 TEXT,
+                file_id TEXT,
+                synced_at REAL,
+                local_hash TEXT,
+                PRIMARY KEY (destination, root, rel_path)
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(files)")]
+        if 'local_hash' not in columns:
+            # Indexes written before change hashes were stored
+            self.conn.execute("ALTER TABLE files ADD COLUMN local_hash TEXT")
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def load_root(self, destination, root):
+        """Load all entries for a backup root into a dict keyed by relative path"""
+        cursor = self.conn.execute(
+            "SELECT rel_path, size, mtime_ns, inode, md5, file_id, local_hash FROM files "
+            "WHERE destination=? AND root=?",
+            (destination, root)
+        )
+        return {row[0]: row[1:] for row in cursor}
+
+    def load_paths(self, destination, root, rel_paths):
+        """Load the entries of selected files only, in the same form as load_root"""
+        known = {}
+        for rel_path in rel_paths:
+            row = self.conn.execute(
+                "SELECT rel_path, size, mtime_ns, inode, md5, file_id, local_hash FROM files "
+                "WHERE destination=? AND root=? AND rel_path=?",
+                (destination, root, rel_path)
+            ).fetchone()
+            if row:
+                known[row[0]] = row[1:]
+        return known
+
+    def classify(self, known, rel_path, stat_result):
+        """Classify a file as unchanged, new, modified or in need of a content check
+
+        `known` is the dict returned by load_root. Only a stat is needed for
+        files that have not been touched. Files whose stat changed but whose
+        size did not come back as CHECK, the caller hashes them so a bare
+        mtime bump is not re-uploaded.
+        """
+        entry = known.get(rel_path)
+        if entry is None:
+            return self.NEW
+
+        size, mtime_ns, inode, md5, file_id, local_hash = entry
+        if (size == stat_result.st_size and mtime_ns == stat_result.st_mtime_ns
+                and inode == stat_result.st_ino):
+            return self.UNCHANGED
+
+        if size == stat_result.st_size and md5:
+            return self.CHECK
+
+        return self.MODIFIED
+
+    def record(self, destination, root, rel_path, stat_result, md5, file_id, local_hash=None):
+        """Store the state of a file after it has been synced"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files "
+            "(destination, root, rel_path, size, mtime_ns, inode, md5, file_id, synced_at, local_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (destination, root, rel_path, stat_result.st_size, stat_result.st_mtime_ns,
+             stat_result.st_ino, md5, file_id, time.time(), local_hash)
+        )
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_INTERVAL:
+            self.commit()
+
+    def delete(self, destination, root, rel_path):
+        """Forget a file that is no longer synced on its own"""
+        self.conn.execute(
+            "DELETE FROM files WHERE destination=? AND root=? AND rel_path=?",
+            (destination, root, rel_path)
+        )
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        """Flush buffered writes to disk"""
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def close(self):
+        """Commit outstanding writes and close the database"""
+        self.commit()
+        self.conn.close()
+
+
+class ContentIndex:
+    """Drive file IDs of content that has already been uploaded, keyed by MD5
+
+    Seeded from the sync index and extended as uploads finish, so a file
+    whose bytes are already on Drive under another path can be copied
+    server-side instead of being uploaded again.
+    """
+
+    def __init__(self, db_path=INDEX_FILE, min_size=DEDUP_MIN_SIZE):
+        self.lock = threading.Lock()
+        self.min_size = min_size
+        self.file_ids = {}
+        self.uploading = {}  # MD5 -> Event set once the upload in progress ends
+
+        index = SyncIndex(db_path)
+        try:
+            for md5, file_id in index.conn.execute(
+                    "SELECT md5, file_id FROM files "
+                    "WHERE size >= ? AND md5 IS NOT NULL AND file_id IS NOT NULL",
+                    (min_size,)):
+                self.file_ids[md5] = file_id
+        finally:
+            index.close()
+
+    def claim(self, md5):
+        """Return the Drive file ID holding these bytes, or None to upload them
+
+        If another thread is uploading the same bytes, wait for it to finish
+        first. A caller that gets None must call release() when done,
+        after add() if the upload succeeded.
+        """
+        while True:
+            with self.lock:
+                file_id = self.file_ids.get(md5)
+                if file_id:
+                    return file_id
+                event = self.uploading.get(md5)
+                if event is None:
+                    self.uploading[md5] = threading.Event()
+                    return None
+            event.wait()
+
+    def release(self, md5):
+        """End a claim and wake up threads waiting for the same bytes"""
+        with self.lock:
+            event = self.uploading.pop(md5, None)
+        if event:
+            event.set()
+
+    def add(self, md5, file_id, size):
+        if md5 and file_id and size >= self.min_size:
+            with self.lock:
+                self.file_ids[md5] = file_id
+
+    def discard(self, md5):
+        """Forget content whose Drive copy turned out to be gone"""
+        with self.lock:
+            self.file_ids.pop(md5, None)
+
+
+class UploadSessions:
+    """Resumable upload sessions saved to disk as chunks are acknowledged
+
+    A session is only handed back if the file still has the size, mtime
+    and inode it had when the session was opened and the session is not
+    about to expire. Upload threads share one instance.
+    """
+
+    def __init__(self, db_path=INDEX_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                destination TEXT NOT NULL,
+                root TEXT NOT NULL,
+                rel_path TEXT NOT NULL,
+                session_uri TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (destination, root, rel_path)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, destination, root, rel_path, stat_result):
+        """Return a saved session URI for the file, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT session_uri, size, mtime_ns, inode, created_at FROM upload_sessions "
+                "WHERE destination=? AND root=? AND rel_path=?",
+                (destination, root, rel_path)
+            ).fetchone()
+        if row is None:
+            return None
+
+        session_uri, size, mtime_ns, inode, created_at = row
+        if (size != stat_result.st_size or mtime_ns != stat_result.st_mtime_ns
+                or inode != stat_result.st_ino or time.time() - created_at > SESSION_LIFETIME):
+            # File changed or session expired, it cannot be resumed
+            self.delete(destination, root, rel_path)
+            return None
+        return session_uri
+
+    def save(self, destination, root, rel_path, session_uri, offset, stat_result):
+        """Remember the session and the last byte offset Drive confirmed"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO upload_sessions "
+                "(destination, root, rel_path, session_uri, offset, size, mtime_ns, inode, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (destination, root, rel_path) DO UPDATE SET "
+                "session_uri=excluded.session_uri, offset=excluded.offset",
+                (destination, root, rel_path, session_uri, offset, stat_result.st_size,
+                 stat_result.st_mtime_ns, stat_result.st_ino, time.time())
+            )
+            self.conn.commit()
+
+    def delete(self, destination, root, rel_path):
+        """Forget the session of a file"""
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM upload_sessions WHERE destination=? AND root=? AND rel_path=?",
+                (destination, root, rel_path)
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class PackIndex:
+    """Packs of small files synced to Google Drive, one row per pack
+
+    Packing splits the small files of a directory into `buckets` packs by
+    name. Each row remembers the Drive IDs of a pack and its manifest and
+    the size, mtime and inode of every member, so an unchanged pack is
+    recognised with the stats the scanner already has. It shares the
+    connection of a SyncIndex, whose buffered writes would otherwise lock
+    it out, and is committed together with it.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.conn = index.conn
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS packs (
+                destination TEXT NOT NULL,
+                root TEXT NOT NULL,
+                rel_dir TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                buckets INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                manifest_id TEXT NOT NULL,
+                members TEXT NOT NULL,
+                synced_at REAL,
+                PRIMARY KEY (destination, root, rel_dir, bucket)
+            )
+        """)
+        self.conn.commit()
+
+    def load_dir(self, destination, root, rel_dir):
+        """Packs of a directory as {bucket: (buckets, file_id, manifest_id, members)}
+
+        members maps each file name to its [size, mtime_ns, inode].
+        """
+        cursor = self.conn.execute(
+            "SELECT bucket, buckets, file_id, manifest_id, members FROM packs "
+            "WHERE destination=? AND root=? AND rel_dir=?",
+            (destination, root, rel_dir)
+        )
+        return {row[0]: (row[1], row[2], row[3], json.loads(row[4])) for row in cursor}
+
+    def record(self, destination, root, rel_dir, bucket, buckets, file_id, manifest_id, members):
+        """Store a pack after it has been uploaded"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO packs "
+            "(destination, root, rel_dir, bucket, buckets, file_id, manifest_id, members, synced_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (destination, root, rel_dir, bucket, buckets, file_id, manifest_id,
+             json.dumps(members), time.time())
+        )
+        self.index.commit()
+
+    def delete(self, destination, root, rel_dir, bucket):
+        """Forget a pack that is no longer used"""
+        self.conn.execute(
+            "DELETE FROM packs WHERE destination=? AND root=? AND rel_dir=? AND bucket=?",
+            (destination, root, rel_dir, bucket)
+        )
+        self.index.commit()
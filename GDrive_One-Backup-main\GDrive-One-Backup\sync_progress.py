@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import deque
+
+# At most this many progress updates per second reach the UI, across all workers
+PROGRESS_RATE = 10
+
+# Throughput is averaged over this many seconds
+THROUGHPUT_WINDOW = 5.0
+
+
+def format_bytes(size):
+    """Human readable byte count"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds):
+    """Human readable duration such as '1h 05m' or '42s'"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressAggregator:
+    """Collects file and byte progress from every worker of a sync
+
+    Workers report events as they happen from any thread and call tick()
+    afterwards; tick() only forwards a summary when the shared interval
+    has passed, so the UI never sees more than PROGRESS_RATE updates per
+    second however many files and chunks are flying.
+    """
+
+    def __init__(self, rate=PROGRESS_RATE, bandwidth=None):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_emit = 0.0
+        self.scanners = 0
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.bytes_sent = 0
+        self.in_flight = {}  # key -> bytes already counted for a running upload
+        self.current = ''
+        self.samples = deque()  # (time, bytes_sent, files_done)
+        # BandwidthLimiter of the sync, its limit is shown next to the throughput
+        self.bandwidth = bandwidth
+
+    def scan_started(self):
+        with self.lock:
+            self.scanners += 1
+
+    def scan_finished(self):
+        with self.lock:
+            self.scanners = max(0, self.scanners - 1)
+
+    def found(self, size):
+        """A scanner found a file"""
+        with self.lock:
+            self.files_total += 1
+            self.bytes_total += size
+
+    def skipped(self, size):
+        """A file needed no upload"""
+        with self.lock:
+            self.files_done += 1
+            self.bytes_done += size
+
+    def transferred(self, key, size, label=None):
+        """Drive acknowledged `size` more bytes of an upload"""
+        with self.lock:
+            self.in_flight[key] = self.in_flight.get(key, 0) + size
+            self.bytes_done += size
+            self.bytes_sent += size
+            if label:
+                self.current = label
+
+    def file_done(self, key, size):
+        """An upload ended, successfully or not"""
+        with self.lock:
+            counted = self.in_flight.pop(key, 0)
+            self.files_done += 1
+            self.bytes_done += max(0, size - counted)
+
+    def packed(self, files, size, sent):
+        """A pack of small files holding `size` bytes ended, `sent` bytes went to Drive"""
+        with self.lock:
+            self.files_done += files
+            self.bytes_done += size
+            self.bytes_sent += sent
+
+    def snapshot(self):
+        """Current totals together with throughput, files per second and ETA"""
+        # Outside the lock, the limiter has a lock of its own
+        limit = self.bandwidth.current_rate() if self.bandwidth else 0
+        with self.lock:
+            now = time.monotonic()
+            self.samples.append((now, self.bytes_sent, self.files_done))
+            while len(self.samples) > 2 and now - self.samples[0][0] > THROUGHPUT_WINDOW:
+                self.samples.popleft()
+
+            first_time, first_sent, first_files = self.samples[0]
+            elapsed = now - first_time
+            throughput = (self.bytes_sent - first_sent) / elapsed if elapsed > 0 else 0.0
+            files_per_second = (self.files_done - first_files) / elapsed if elapsed > 0 else 0.0
+
+            scanning = self.scanners > 0
+            files_total = max(self.files_total, self.files_done)
+            bytes_total = max(self.bytes_total, self.bytes_done)
+            remaining = bytes_total - self.bytes_done
+            eta = remaining / throughput if throughput > 0 and not scanning else None
+            percent = int(self.bytes_done * 100 / bytes_total) if bytes_total else 0
+
+            return {
+                'files_done': self.files_done,
+                'files_total': files_total,
+                'bytes_done': self.bytes_done,
+                'bytes_total': bytes_total,
+                'throughput': throughput,
+                'limit': limit,
+                'files_per_second': files_per_second,
+                'eta': eta,
+                'percent': percent,
+                'scanning': scanning,
+                'current': self.current,
+            }
+
+    def format(self, snapshot):
+        """One line summary for the progress label"""
+        message = (
+            f"{snapshot['files_done']:,}/{snapshot['files_total']:,} files, "
+            f"{format_bytes(snapshot['bytes_done'])}/{format_bytes(snapshot['bytes_total'])}, "
+            f"{format_bytes(snapshot['throughput'])}/s"
+        )
+        if snapshot['limit']:
+            message += f" (limit {format_bytes(snapshot['limit'])}/s)"
+        message += f", {snapshot['files_per_second']:.0f} files/s"
+        if snapshot['scanning']:
+            message += ", scanning..."
+        elif snapshot['eta'] is not None:
+            message += f", ETA {format_duration(snapshot['eta'])}"
+        if snapshot['current']:
+            message = f"Uploading: {snapshot['current']}\n{message}"
+        return message
+
+    def tick(self, emit, force=False):
+        """Call emit(message, percent) if the update interval has passed"""
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_emit < self.interval:
+                return
+            self.last_emit = now
+        snapshot = self.snapshot()
+        emit(self.format(snapshot), snapshot['percent'])
@@ -0,0 +1,123 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Order of the files waiting in one backup root
+SCAN_ORDER = 'scan'        # As the scanner found them
+SMALLEST_FIRST = 'smallest'  # Most files protected per second
+NEWEST_FIRST = 'newest'    # Most recently modified, most likely to matter
+POLICIES = (SCAN_ORDER, SMALLEST_FIRST, NEWEST_FIRST)
+DEFAULT_POLICY = SMALLEST_FIRST
+
+# Total upload threads across every backup root
+SCHEDULER_WORKERS = 8
+
+# Files each root may have waiting, the priority policy orders within this window
+SCHEDULER_WINDOW = 512
+
+
+class SyncScheduler:
+    """One upload queue and one pool of workers for every backup root
+
+    Each SyncEngine submits its uploads here instead of running its own
+    pool, so the total number of concurrent Drive uploads stays at
+    workers however many roots sync at once. A free worker serves the
+    root with the fewest uploads running, which gives every root an equal
+    share, and takes that root's next file in policy order. Calls on the
+    shared Drive service are serialized on the scheduler's control thread.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, policy=DEFAULT_POLICY, window=SCHEDULER_WINDOW):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.workers = workers
+        self.policy = policy
+        self.window = window
+        self.control = ThreadPoolExecutor(max_workers=1)
+        self.condition = threading.Condition()
+        self.queues = {}   # root -> heap of (priority, sequence, future, function, args)
+        self.running = {}  # root -> uploads in progress
+        self.done = {}     # root -> uploads finished
+        self.rotation = itertools.count()
+        self.turns = {}    # root -> when it was last served, breaks ties between roots
+        self.sequence = itertools.count()
+        self.threads = []
+        self.closed = False
+
+    def priority(self, stat_result):
+        if self.policy == SMALLEST_FIRST:
+            return stat_result.st_size
+        if self.policy == NEWEST_FIRST:
+            return -stat_result.st_mtime_ns
+        return 0
+
+    def submit(self, root, stat_result, function, *args):
+        """Queue function(*args) as an upload of root, returning its future"""
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Scheduler is closed")
+            queue = self.queues.setdefault(root, [])
+            heapq.heappush(queue, (self.priority(stat_result), next(self.sequence),
+                                   future, function, args))
+            self.running.setdefault(root, 0)
+            self.turns.setdefault(root, next(self.rotation))
+            # Workers are started as the first uploads arrive
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+        return future
+
+    def next_job(self):
+        """Pop the next upload of the least served root, called with the lock held"""
+        roots = [root for root, queue in self.queues.items() if queue]
+        if not roots:
+            return None
+        root = min(roots, key=lambda root: (self.running[root], self.turns[root]))
+        self.turns[root] = next(self.rotation)
+        _, _, future, function, args = heapq.heappop(self.queues[root])
+        self.running[root] += 1
+        return root, future, function, args
+
+    def work(self):
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while job is None:
+                    if self.closed:
+                        return
+                    self.condition.wait()
+                    job = self.next_job()
+
+            root, future, function, args = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(function(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.running[root] -= 1
+                    self.done[root] = self.done.get(root, 0) + 1
+
+    def stats(self):
+        """Uploads queued, running and finished per root"""
+        with self.condition:
+            return {root: {'queued': len(self.queues.get(root, ())),
+                           'running': self.running.get(root, 0),
+                           'done': self.done.get(root, 0)}
+                    for root in self.running}
+
+    def close(self):
+        """Finish queued uploads and stop the workers"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            threads = list(self.threads)
+        for thread in threads:
+            thread.join()
+        self.control.shutdown(wait=True)
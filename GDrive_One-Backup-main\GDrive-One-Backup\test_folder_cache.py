@@ -0,0 +1,225 @@
+import itertools
+import os
+import re
+import tempfile
+import unittest
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from folder_cache import FolderCache, FOLDER_MIME_TYPE
+from sync_engine import SyncEngine
+
+
+def not_found():
+    return HttpError(httplib2.Response({'status': '404'}), b'{"error": {"message": "File not found"}}')
+
+
+class Request:
+    def __init__(self, function):
+        self.function = function
+
+    def execute(self, **kwargs):
+        return self.function()
+
+
+class Files:
+    """files() of MemoryDrive, enough for SyncEngine and FolderCache"""
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q='', **kwargs):
+        def run():
+            files = [dict(file) for file in self.drive.store.values() if not file.get('trashed')]
+            parent = re.match(r"'([^']+)' in parents", q)
+            if parent:
+                files = [file for file in files if parent.group(1) in file['parents']]
+            name = re.search(r"name='([^']*)'", q)
+            if name:
+                files = [file for file in files if file['name'] == name.group(1)]
+            if f"mimeType!='{FOLDER_MIME_TYPE}'" in q:
+                files = [file for file in files if file['mimeType'] != FOLDER_MIME_TYPE]
+            elif f"mimeType='{FOLDER_MIME_TYPE}'" in q:
+                files = [file for file in files if file['mimeType'] == FOLDER_MIME_TYPE]
+            return {'files': files}
+        return Request(run)
+
+    def get(self, fileId=None, **kwargs):
+        def run():
+            if fileId not in self.drive.store:
+                raise not_found()
+            return dict(self.drive.store[fileId])
+        return Request(run)
+
+    def create(self, body=None, media_body=None, **kwargs):
+        def run():
+            for parent in body.get('parents', []):
+                if parent != self.drive.root and parent not in self.drive.store:
+                    raise not_found()
+            file = dict(body, id=f"id{next(self.drive.ids)}", createdTime='2000-01-01T00:00:00.000Z')
+            file.setdefault('mimeType', 'application/octet-stream')
+            self.drive.store[file['id']] = file
+            self.drive.log.append(file['id'])
+            return {'id': file['id'], 'md5Checksum': None}
+        return Request(run)
+
+    def update(self, fileId=None, body=None, media_body=None, **kwargs):
+        def run():
+            if fileId not in self.drive.store:
+                raise not_found()
+            self.drive.store[fileId].update(body or {})
+            self.drive.log.append(fileId)
+            return {'id': fileId, 'md5Checksum': None}
+        return Request(run)
+
+
+class Changes:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return Request(lambda: {'startPageToken': str(len(self.drive.log))})
+
+    def list(self, pageToken=None, **kwargs):
+        def run():
+            changes = [{'fileId': file_id, 'removed': file_id not in self.drive.store,
+                        'file': dict(self.drive.store[file_id]) if file_id in self.drive.store else None}
+                       for file_id in self.drive.log[int(pageToken):]]
+            return {'changes': changes, 'newStartPageToken': str(len(self.drive.log))}
+        return Request(run)
+
+
+class Batch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self, **kwargs):
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class LostBatch(Batch):
+    """Batch that Drive carries out but whose response never arrives"""
+
+    def execute(self, **kwargs):
+        for request_id, request in self.requests:
+            request.execute()
+        raise HttpError(httplib2.Response({'status': '503'}), b'{"error": {"message": "Backend Error"}}')
+
+
+class MemoryDrive:
+    """Drive service kept in a dict, uploads into a missing folder fail with 404 like Drive's"""
+
+    def __init__(self, root):
+        self.root = root
+        self.store = {}
+        self.log = []
+        self.ids = itertools.count()
+
+    def files(self):
+        return Files(self)
+
+    def changes(self):
+        return Changes(self)
+
+    def new_batch_http_request(self, callback=None):
+        return Batch(callback)
+
+    def folder(self, name):
+        return next(file for file in self.store.values()
+                    if file['name'] == name and file['mimeType'] == FOLDER_MIME_TYPE
+                    and not file.get('trashed'))
+
+    def parent_of(self, name):
+        return next(file['parents'][0] for file in self.store.values() if file['name'] == name)
+
+
+class FolderCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.previous_dir = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        self.source = os.path.join(self.temp_dir.name, 'source')
+        os.makedirs(os.path.join(self.source, 'photos'))
+        self.write('photos/a.jpg')
+        self.drive = MemoryDrive('DEST')
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        self.temp_dir.cleanup()
+
+    def write(self, rel_path, data=b'data'):
+        with open(os.path.join(self.source, rel_path), 'wb') as f:
+            f.write(data)
+
+    def sync(self):
+        errors = []
+        engine = SyncEngine(self.drive, self.source, 'DEST', folder_cache=FolderCache(),
+                            on_error=errors.append)
+        engine.run()
+        return errors
+
+    def test_invalidate_drops_folder_and_subfolders(self):
+        cache = FolderCache()
+        folder_id = cache.resolve(self.drive, 'DEST', os.path.join('photos', '2024'))
+        photos_id = cache.folders[('DEST', 'photos')]
+        cache.save()
+
+        self.assertEqual(cache.invalidate([photos_id]), 2)
+        cache.save()
+        reloaded = FolderCache()
+        self.assertNotIn(('DEST', 'photos'), reloaded.folders)
+        self.assertNotIn(('DEST', 'photos/2024'), reloaded.folders)
+
+        del self.drive.store[photos_id]
+        del self.drive.store[folder_id]
+        new_id = reloaded.resolve(self.drive, 'DEST', os.path.join('photos', '2024'))
+        self.assertIn(new_id, self.drive.store)
+        self.assertNotEqual(new_id, folder_id)
+
+    def test_failed_batch_does_not_create_folders_twice(self):
+        self.drive.new_batch_http_request = LostBatch
+        cache = FolderCache()
+        cache.resolve_many(self.drive, 'DEST', ['photos', 'music'])
+
+        folders = sorted(file['name'] for file in self.drive.store.values())
+        self.assertEqual(folders, ['music', 'photos'])
+        self.assertEqual(cache.folders[('DEST', 'photos')], self.drive.folder('photos')['id'])
+        self.assertEqual(cache.folders[('DEST', 'music')], self.drive.folder('music')['id'])
+
+    def test_upload_into_deleted_folder_creates_it_again(self):
+        self.sync()
+        old_id = self.drive.folder('photos')['id']
+        del self.drive.store[old_id]
+
+        self.write('photos/b.jpg')
+        self.sync()
+        parent_id = self.drive.parent_of('b.jpg')
+        self.assertNotEqual(parent_id, old_id)
+        self.assertEqual(self.drive.store[parent_id]['name'], 'photos')
+        self.assertNotIn(old_id, FolderCache().folders.values())
+
+    def test_trashed_folder_from_change_feed_is_not_reused(self):
+        self.sync()
+        old_id = self.drive.folder('photos')['id']
+        self.drive.store[old_id]['trashed'] = True
+        self.drive.log.append(old_id)
+
+        self.write('photos/b.jpg')
+        self.sync()
+        parent_id = self.drive.parent_of('b.jpg')
+        self.assertNotEqual(parent_id, old_id)
+        self.assertFalse(self.drive.store[parent_id].get('trashed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
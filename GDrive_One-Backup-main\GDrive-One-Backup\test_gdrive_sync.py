@@ -0,0 +1,100 @@
+import contextlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import drive_retry
+import drive_transport
+import gdrive_sync
+import sync_engine
+from folder_cache import FOLDER_MIME_TYPE
+from test_folder_cache import Files, MemoryDrive
+
+
+class Credentials:
+    """Stands in for the credentials the GUI pickles"""
+    valid = True
+    expired = False
+    refresh_token = None
+
+
+class FlakyFiles(Files):
+    """files() whose first file upload answers 503 once"""
+
+    def create(self, body=None, media_body=None, **kwargs):
+        request = super().create(body=body, media_body=media_body, **kwargs)
+        if body.get('mimeType') == FOLDER_MIME_TYPE:
+            return request
+        run = request.function
+
+        def flaky():
+            if self.drive.fail_next:
+                self.drive.fail_next = False
+                raise HttpError(httplib2.Response({'status': '503'}), b'{"error": {"message": "Backend Error"}}')
+            return run()
+        request.function = flaky
+        return request
+
+
+class FlakyDrive(MemoryDrive):
+    def __init__(self, root):
+        super().__init__(root)
+        self.fail_next = True
+
+    def files(self):
+        return FlakyFiles(self)
+
+
+class ThreadLocal:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def get(self):
+        return self.drive
+
+
+class JsonOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.previous_dir = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        source = os.path.join(self.temp_dir.name, 'source')
+        os.makedirs(os.path.join(source, 'photos'))
+        for rel_path in ('a.txt', os.path.join('photos', 'b.jpg')):
+            with open(os.path.join(source, rel_path), 'wb') as f:
+                f.write(b'data')
+        with open('backup_config.json', 'w') as f:
+            json.dump({source: 'DEST'}, f)
+        with open('token.pickle', 'wb') as f:
+            pickle.dump(Credentials(), f)
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        self.temp_dir.cleanup()
+
+    def test_stdout_is_only_json_after_a_retry(self):
+        drive = FlakyDrive('DEST')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(drive_transport, 'build_drive_service', lambda credentials: drive), \
+                mock.patch.object(sync_engine, 'ThreadLocalDrive', lambda credentials: ThreadLocal(drive)), \
+                mock.patch.object(drive_retry.default_policy, 'base_delay', 0), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            code = gdrive_sync.main(['run', '--json'])
+
+        self.assertFalse(drive.fail_next)
+        self.assertIn('retry 1', stderr.getvalue())
+        events = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(code, gdrive_sync.EXIT_OK)
+        self.assertEqual([event['uploaded'] for event in events if event['event'] == 'finished'], [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
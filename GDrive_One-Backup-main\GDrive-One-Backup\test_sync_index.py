@@ -0,0 +1,58 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from sync_index import HashCache
+
+
+class WindowsStat:
+    """Stat result as DirEntry.stat() returns it on Windows, without device and inode"""
+
+    def __init__(self, file_path):
+        stat_result = os.stat(file_path)
+        self.st_dev = 0
+        self.st_ino = 0
+        self.st_size = stat_result.st_size
+        self.st_mtime_ns = stat_result.st_mtime_ns
+
+
+class HashCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = HashCache()
+        mtime_ns = 1700000000 * 10 ** 9
+        self.paths = []
+        for name, data in (('a.txt', b'first file'), ('b.txt', b'other file')):
+            file_path = os.path.join(self.temp_dir.name, name)
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            os.utime(file_path, ns=(mtime_ns, mtime_ns))
+            self.paths.append((file_path, hashlib.md5(data).hexdigest()))
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def test_same_size_and_mtime_without_inode(self):
+        for file_path, md5 in self.paths:
+            self.assertEqual(self.cache.md5(file_path, WindowsStat(file_path)), md5)
+
+    def test_same_size_and_mtime_without_inode_on_pool(self):
+        futures = [(self.cache.submit(file_path, WindowsStat(file_path)), md5)
+                   for file_path, md5 in self.paths]
+        for future, md5 in futures:
+            self.assertEqual(future.result()['md5'], md5)
+        for file_path, md5 in self.paths:
+            self.assertEqual(self.cache.md5(file_path, WindowsStat(file_path)), md5)
+
+    def test_same_file_is_hashed_once(self):
+        file_path, md5 = self.paths[0]
+        self.cache.md5(file_path, WindowsStat(file_path))
+        self.assertEqual(self.cache.md5(file_path, WindowsStat(file_path)), md5)
+        self.assertEqual(self.cache.hashes_reused, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()